@@ -121,6 +121,23 @@ def parse_port_option(option: str) -> str:
     return option
 
 
+def parse_size_option(option: str) -> int:
+    """Parses a size like 500M or 2G (powers of 1024) into bytes."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = option.strip().upper().removesuffix("B").removesuffix("I")
+    multiplier = 1
+    if value and value[-1] in units:
+        multiplier = units[value[-1]]
+        value = value[:-1]
+    try:
+        size = int(float(value) * multiplier)
+    except ValueError:
+        raise ValueError(f"Invalid size '{option}'")
+    if size <= 0:
+        raise ValueError(f"Invalid size '{option}'")
+    return size
+
+
 class OverrideDefaultAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         setattr(namespace, self.dest, values)
@@ -779,6 +796,14 @@ Model "artifact" stores the AI Model as an OCI Artifact.
 Model "car" includes base image with the model stored in a /models subdir.
 Model "raw" contains the model and a link file model.file to it stored at /.""",
     )
+    parser.add_argument(
+        "--split-max-size",
+        dest="split_max_size",
+        type=parse_size_option,
+        default=None,
+        help="split GGUF models into shards of at most this size (e.g. 2G), only valid with --type artifact",
+        completer=suppressCompleter,
+    )
     parser.add_argument(
         "--tls-verify",
         dest="tlsverify",
@@ -805,6 +830,8 @@ def _get_source_model(args, transport=None):
 
 
 def push_cli(args):
+    if args.split_max_size and args.type != "artifact":
+        raise ValueError("--split-max-size is only supported with --type artifact")
 
     target = args.SOURCE
     transport = None
@@ -819,6 +846,11 @@ def push_cli(args):
         target = shortnames.resolve(args.TARGET)
 
     target_model = New(target, args)
+    if args.split_max_size and target_model.type != "OCI":
+        # only OCI artifacts are split, so the push skips straight to the container image fallback
+        if any(target.startswith(mtype + "://") for mtype in MODEL_TYPES):
+            raise ValueError(f"--split-max-size is only supported when pushing to an OCI registry, not {target}")
+        target_model = TransportFactory(target, args).create_oci()
 
     try:
         target_model.push(source_model, args)
@@ -1089,6 +1121,29 @@ def daemon_parser(subparsers) -> None:
         help="port for AI Model server to listen on",
         completer=suppressCompleter,
     )
+    start_parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        type=parse_size_option,
+        default=None,
+        help="total memory the served models may use, least recently used idle models are stopped to stay within it",
+        completer=suppressCompleter,
+    )
+    start_parser.add_argument(
+        "--server-type",
+        dest="server_type",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="serve connections with a thread each or from a single asyncio event loop for many concurrent streams",
+        completer=suppressCompleter,
+    )
+    start_parser.add_argument(
+        "--socket",
+        dest="socket",
+        default=config.daemon.socket,
+        help="Unix domain socket to listen on besides the port, local clients connect to it without TCP overhead",
+        completer=suppressCompleter,
+    )
     start_parser.set_defaults(func=daemon_start_cli)
 
     run_parser = daemon_parsers.add_parser("run")
@@ -1106,12 +1161,36 @@ def daemon_parser(subparsers) -> None:
         help="port for AI Model server to listen on",
         completer=suppressCompleter,
     )
+    run_parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        type=parse_size_option,
+        default=None,
+        help="total memory the served models may use, least recently used idle models are stopped to stay within it",
+        completer=suppressCompleter,
+    )
+    run_parser.add_argument(
+        "--server-type",
+        dest="server_type",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="serve connections with a thread each or from a single asyncio event loop for many concurrent streams",
+        completer=suppressCompleter,
+    )
+    run_parser.add_argument(
+        "--socket",
+        dest="socket",
+        default=config.daemon.socket,
+        help="Unix domain socket to listen on besides the port, local clients connect to it without TCP overhead",
+        completer=suppressCompleter,
+    )
     run_parser.set_defaults(func=daemon_run_cli)
 
 
 def daemon_start_cli(args):
     daemon_cmd = []
     daemon_model_store_dir = args.store
+    daemon_socket = args.socket
     is_daemon_in_container = args.container and args.engine in get_args(SUPPORTED_ENGINES)
 
     if is_daemon_in_container:
@@ -1128,8 +1207,14 @@ def daemon_start_cli(args):
             f"{args.port}:8080",
             "-v",
             f"{args.store}:{daemon_model_store_dir}",
-            args.image,
         ]
+        if args.socket:
+            # the directory of the socket is shared, the socket is created by the daemon
+            socket_dir = os.path.dirname(os.path.abspath(args.socket))
+            os.makedirs(socket_dir, exist_ok=True)
+            daemon_socket = f"/run/ramalama/{os.path.basename(args.socket)}"
+            daemon_cmd += ["-v", f"{socket_dir}:/run/ramalama"]
+        daemon_cmd += [args.image]
 
     daemon_cmd += [
         "ramalama",
@@ -1142,13 +1227,26 @@ def daemon_start_cli(args):
         "--host",
         ActiveConfig().host if is_daemon_in_container else args.host,
     ]
+    if args.memory_budget is not None:
+        daemon_cmd += ["--memory-budget", str(args.memory_budget)]
+    if args.server_type != "threaded":
+        daemon_cmd += ["--server-type", args.server_type]
+    if daemon_socket:
+        daemon_cmd += ["--socket", daemon_socket]
     exec_cmd(daemon_cmd)
 
 
 def daemon_run_cli(args):
     from ramalama.daemon.daemon import run
 
-    run(host=args.host, port=int(args.port), model_store_path=args.store)
+    run(
+        host=args.host,
+        port=int(args.port),
+        model_store_path=args.store,
+        memory_budget=args.memory_budget,
+        server_type=args.server_type,
+        socket_path=args.socket,
+    )
 
 
 def version_parser(subparsers):
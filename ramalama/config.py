@@ -152,6 +152,136 @@ class HTTPClientConfig:
             raise ValueError(f"http_client.max_retry_delay must be non-negative: {self.max_retry_delay}")
 
 
+@dataclass
+class PreloadModelConfig:
+    model: str
+    runtime: Optional[str] = None
+    pinned: bool = False
+    # seconds the model is kept loaded without requests, defaults to daemon.idle_timeout
+    idle_timeout: Optional[int] = None
+    # model servers started right away, more are started up to max_replicas when requests queue up
+    replicas: int = 1
+    max_replicas: Optional[int] = None
+    # options of ramalama serve, e.g. ctx_size = 4096 is passed as --ctx-size 4096
+    options: dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.pinned = coerce_to_bool(self.pinned)
+        if self.idle_timeout is not None:
+            self.idle_timeout = int(self.idle_timeout)
+            if self.idle_timeout <= 0:
+                raise ValueError(f"daemon.preload.idle_timeout must be positive: {self.idle_timeout}")
+        self.replicas = int(self.replicas)
+        if self.replicas < 1:
+            raise ValueError(f"daemon.preload.replicas must be positive: {self.replicas}")
+        if self.max_replicas is not None:
+            self.max_replicas = int(self.max_replicas)
+            if self.max_replicas < self.replicas:
+                raise ValueError(f"daemon.preload.max_replicas must be at least {self.replicas}: {self.max_replicas}")
+
+
+@dataclass
+class DaemonConfig:
+    # seconds a model is kept loaded without requests
+    idle_timeout: int = 300
+    # requests a model server processes at the same time unless it sets its parallel slots, 0 for no limit
+    max_concurrent_requests: int = 4
+    max_queued_requests: int = 64
+    preload: dict[str, PreloadModelConfig] = field(default_factory=dict)
+    preload_concurrency: int = 2
+    # requests waiting per replica at which another replica of a model is started
+    scale_up_queue_depth: int = 2
+    # seconds a replica beyond the requested ones is kept running without requests
+    scale_down_delay: int = 60
+    # cache the responses of requests with temperature 0 and a fixed seed
+    response_cache: bool = False
+    response_cache_size_mb: int = 256
+    # directory responses evicted from memory are written to, kept in memory only if unset
+    response_cache_dir: Optional[str] = None
+    response_cache_dir_size_mb: int = 1024
+    # leading characters of the prompts routing requests to the replica and slot caching them, 0 disables it
+    prefix_affinity_chars: int = 1024
+    # milliseconds embeddings requests are collected to be sent upstream as one batch, 0 disables it
+    embedding_batch_window_ms: int = 0
+    # inputs of a batch of embeddings requests at most
+    embedding_batch_size: int = 64
+    # leave the model servers running on shutdown, for the next daemon to adopt them
+    keep_models_on_exit: bool = False
+    # restarts of a crashed model server within the crash loop window before giving up, 0 disables them
+    max_restarts: int = 5
+    # seconds before the first restart of a crashed model server, doubling with every further crash
+    restart_backoff: float = 1.0
+    # file proxied requests are logged to as JSON lines, not logged if unset
+    access_log: Optional[str] = None
+    # size in MiB at which the access log is rotated, and the rotated files kept
+    access_log_max_size_mb: int = 100
+    access_log_backups: int = 5
+    # Unix domain socket the daemon listens on besides its TCP port, and the octal permissions of it
+    socket: Optional[str] = None
+    socket_mode: str = "0660"
+
+    def __post_init__(self):
+        self.idle_timeout = int(self.idle_timeout)
+        if self.idle_timeout <= 0:
+            raise ValueError(f"daemon.idle_timeout must be positive: {self.idle_timeout}")
+        self.max_concurrent_requests = int(self.max_concurrent_requests)
+        if self.max_concurrent_requests < 0:
+            raise ValueError(f"daemon.max_concurrent_requests must be non-negative: {self.max_concurrent_requests}")
+        self.max_queued_requests = int(self.max_queued_requests)
+        if self.max_queued_requests < 0:
+            raise ValueError(f"daemon.max_queued_requests must be non-negative: {self.max_queued_requests}")
+        self.preload_concurrency = int(self.preload_concurrency)
+        if self.preload_concurrency < 1:
+            raise ValueError(f"daemon.preload_concurrency must be positive: {self.preload_concurrency}")
+        self.scale_up_queue_depth = int(self.scale_up_queue_depth)
+        if self.scale_up_queue_depth < 1:
+            raise ValueError(f"daemon.scale_up_queue_depth must be positive: {self.scale_up_queue_depth}")
+        self.scale_down_delay = int(self.scale_down_delay)
+        if self.scale_down_delay < 0:
+            raise ValueError(f"daemon.scale_down_delay must be non-negative: {self.scale_down_delay}")
+        self.prefix_affinity_chars = int(self.prefix_affinity_chars)
+        if self.prefix_affinity_chars < 0:
+            raise ValueError(f"daemon.prefix_affinity_chars must be non-negative: {self.prefix_affinity_chars}")
+        self.embedding_batch_window_ms = int(self.embedding_batch_window_ms)
+        if self.embedding_batch_window_ms < 0:
+            raise ValueError(f"daemon.embedding_batch_window_ms must be non-negative: {self.embedding_batch_window_ms}")
+        self.embedding_batch_size = int(self.embedding_batch_size)
+        if self.embedding_batch_size < 1:
+            raise ValueError(f"daemon.embedding_batch_size must be positive: {self.embedding_batch_size}")
+        self.max_restarts = int(self.max_restarts)
+        if self.max_restarts < 0:
+            raise ValueError(f"daemon.max_restarts must be non-negative: {self.max_restarts}")
+        self.restart_backoff = float(self.restart_backoff)
+        if self.restart_backoff <= 0:
+            raise ValueError(f"daemon.restart_backoff must be positive: {self.restart_backoff}")
+        self.response_cache = coerce_to_bool(self.response_cache)
+        self.keep_models_on_exit = coerce_to_bool(self.keep_models_on_exit)
+        try:
+            if not 0 <= int(str(self.socket_mode), 8) <= 0o777:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"daemon.socket_mode must be octal permissions: {self.socket_mode}") from None
+        self.access_log_max_size_mb = int(self.access_log_max_size_mb)
+        if self.access_log_max_size_mb < 1:
+            raise ValueError(f"daemon.access_log_max_size_mb must be positive: {self.access_log_max_size_mb}")
+        self.access_log_backups = int(self.access_log_backups)
+        if self.access_log_backups < 0:
+            raise ValueError(f"daemon.access_log_backups must be non-negative: {self.access_log_backups}")
+        self.response_cache_size_mb = int(self.response_cache_size_mb)
+        if self.response_cache_size_mb < 1:
+            raise ValueError(f"daemon.response_cache_size_mb must be positive: {self.response_cache_size_mb}")
+        self.response_cache_dir_size_mb = int(self.response_cache_dir_size_mb)
+        if self.response_cache_dir_size_mb < 0:
+            raise ValueError(
+                f"daemon.response_cache_dir_size_mb must be non-negative: {self.response_cache_dir_size_mb}"
+            )
+        # the name of a preload table is the model to serve unless it names one explicitly
+        self.preload = {
+            name: entry if isinstance(entry, PreloadModelConfig) else PreloadModelConfig(**{"model": name, **entry})
+            for name, entry in self.preload.items()
+        }
+
+
 @dataclass
 class BaseConfig:
     api: str = "none"
@@ -161,6 +291,7 @@ class BaseConfig:
     container: bool = None  # type: ignore
     ctx_size: int = 0
     convert_type: Literal["artifact", "car", "raw"] = "raw"
+    daemon: DaemonConfig = field(default_factory=DaemonConfig)
     default_image: str = DEFAULT_IMAGE
     default_rag_image: str = DEFAULT_RAG_IMAGE
     default_tools_image: str = DEFAULT_TOOLS_IMAGE
@@ -0,0 +1,739 @@
+from __future__ import annotations
+
+import asyncio
+import html
+import http.client
+import http.server
+import io
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import AsyncIterator, Optional, Union
+
+from ramalama.config import ActiveConfig
+from ramalama.daemon.handler.daemon import DaemonAPIHandler
+from ramalama.daemon.handler.metrics import MetricsHandler
+from ramalama.daemon.handler.proxy import (
+    HOP_BY_HOP_HEADERS,
+    RELAY_BLOCK_SIZE,
+    STARTING_MODEL_WAIT_TIMEOUT,
+    ClientDisconnectedError,
+    ModelProxyHandler,
+    ProxiedRequest,
+    ProxyError,
+    forwarded_headers,
+    quickack,
+)
+from ramalama.daemon.handler.ramalama import RamalamaHandler
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.admission import QueueFullError, QueueTimeoutError
+from ramalama.daemon.service.connection_pool import AsyncUpstreamConnection, AsyncUpstreamConnectionPool
+from ramalama.daemon.service.metrics import RequestTimer
+from ramalama.daemon.service.model_runner import UPSTREAM_HOST, ManagedModel, ModelRunner, ModelState
+from ramalama.daemon.service.response_cache import (
+    CachedResponse,
+    ResponseRecorder,
+)
+from ramalama.daemon.service.services import DaemonServices
+from ramalama.daemon.unix_socket import bind_unix_socket, peer_address, remove_unix_socket
+
+# Maximum size of the head of a request or response
+MAX_HEAD_SIZE = 64 * 1024
+
+# Seconds a client connection is kept open while waiting for the next request
+KEEP_ALIVE_TIMEOUT = 60
+
+# Size of the queue of connections not yet accepted, bursts of clients are common for a proxy
+LISTEN_BACKLOG = 1024
+
+# Number of threads running the blocking daemon API handlers, which start and stop models
+API_WORKERS = 16
+
+STALE_CONNECTION_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+AsyncRequestBody = Union[bytes, AsyncIterator[bytes], None]
+
+
+class ClientError(ProxyError):
+    """Raised when a request can't be handled before any response has been sent. The client
+    gets an error response and the connection is closed, since the request body is not read."""
+
+
+class Request:
+    def __init__(self, method: str, path: str, version: str, headers: http.client.HTTPMessage):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.version == "HTTP/1.1" and "close" not in self.headers.get("Connection", "").lower()
+
+
+class UpstreamResponse:
+    def __init__(self, version: str, status: int, reason: str, headers: http.client.HTTPMessage):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+    @property
+    def will_close(self) -> bool:
+        return self.version == "HTTP/1.0" or "close" in self.headers.get("Connection", "").lower()
+
+
+async def read_head(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Reads the head of a request or response. Returns None if the connection was closed before."""
+    try:
+        return await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise ConnectionError("Connection closed within the message head") from e
+    except asyncio.LimitOverrunError as e:
+        raise ClientError(431, "Request head too large") from e
+
+
+def _parse_headers(raw: bytes) -> http.client.HTTPMessage:
+    try:
+        return http.client.parse_headers(io.BytesIO(raw))
+    except http.client.HTTPException as e:
+        raise ClientError(400, f"Bad headers: {e}") from e
+
+
+def parse_request(head: bytes) -> Request:
+    request_line, _, raw_headers = head.partition(b"\r\n")
+    words = request_line.decode("iso-8859-1").split()
+    if len(words) != 3 or not words[2].startswith("HTTP/"):
+        raise ClientError(400, f"Bad request syntax ({request_line!r})")
+    return Request(words[0], words[1], words[2], _parse_headers(raw_headers))
+
+
+async def read_response_head(reader: asyncio.StreamReader) -> UpstreamResponse:
+    while True:
+        head = await read_head(reader)
+        if head is None:
+            raise ConnectionResetError("Upstream closed the connection without a response")
+        status_line, _, raw_headers = head.partition(b"\r\n")
+        version, status, reason = (status_line.decode("iso-8859-1").split(" ", 2) + [""])[:3]
+        # interim responses like 100 Continue are not relayed
+        if 100 <= int(status) < 200 and int(status) != 101:
+            continue
+        return UpstreamResponse(version, int(status), reason, http.client.parse_headers(io.BytesIO(raw_headers)))
+
+
+async def iter_body(reader: asyncio.StreamReader, length: int) -> AsyncIterator[bytes]:
+    remaining = length
+    while remaining > 0:
+        # returns as soon as any data arrived, so streamed bodies are relayed right away
+        block = await reader.read(min(remaining, RELAY_BLOCK_SIZE))
+        if not block:
+            raise ConnectionError(f"Connection closed with {remaining} bytes of the body missing")
+        remaining -= len(block)
+        yield block
+
+
+async def iter_chunked_body(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Decodes a body sent with chunked transfer encoding."""
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise ConnectionError("Connection closed within a chunked body")
+        try:
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+        except ValueError as e:
+            raise ConnectionError(f"Invalid chunk size {size_line!r}") from e
+        if size == 0:
+            break
+        async for block in iter_body(reader, size):
+            yield block
+        await reader.readline()
+
+    # skip the trailer section up to the terminating empty line
+    while await reader.readline() not in (b"\r\n", b"\n", b""):
+        pass
+
+
+async def iter_until_eof(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    while block := await reader.read(RELAY_BLOCK_SIZE):
+        yield block
+
+
+async def client_body(blocks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Reports failures to read a streamed request body as ClientDisconnectedError, so they can
+    be told apart from failures of the upstream connection the body is written to."""
+    try:
+        async for block in blocks:
+            yield block
+    except (OSError, asyncio.IncompleteReadError) as e:
+        raise ClientDisconnectedError(f"Failed to read the request body from the client: {e}") from e
+
+
+async def read_request_body(
+    request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_buffered: int = RELAY_BLOCK_SIZE
+) -> AsyncRequestBody:
+    """Returns the request body to forward upstream. Bodies up to max_buffered are read at once,
+    larger and chunked ones are streamed upstream as they arrive."""
+    if "100-continue" in request.headers.get("Expect", "").lower() and request.version == "HTTP/1.1":
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        await writer.drain()
+
+    if "chunked" in request.headers.get("Transfer-Encoding", "").lower():
+        return client_body(iter_chunked_body(reader))
+
+    try:
+        length = int(request.headers.get("Content-Length", 0))
+    except ValueError as e:
+        raise ClientError(400, "Invalid Content-Length") from e
+    if length == 0:
+        return None if "Content-Length" not in request.headers else b""
+    if length <= max_buffered:
+        try:
+            return await reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionError("Client closed connection within the request body") from e
+    return client_body(iter_body(reader, length))
+
+
+def encode_chunk(block: bytes) -> bytes:
+    return b"%x\r\n%b\r\n" % (len(block), block)
+
+
+def format_response_head(status: int, reason: str, headers: list[tuple[str, str]]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {reason}"] + [f"{key}: {value}" for key, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict")
+
+
+def format_error_response(status: int, message: str, headers: Optional[list[tuple[str, str]]] = None) -> bytes:
+    """Formats an error response like http.server.BaseHTTPRequestHandler.send_error does."""
+    phrase, explain = http.server.BaseHTTPRequestHandler.responses.get(status, ("Error", ""))
+    body = http.server.BaseHTTPRequestHandler.error_message_format % {
+        "code": status,
+        "message": html.escape(message, quote=False),
+        "explain": html.escape(explain, quote=False),
+    }
+    encoded = body.encode("UTF-8", "replace")
+    headers = (headers or []) + [
+        ("Content-Type", http.server.BaseHTTPRequestHandler.error_content_type),
+        ("Content-Length", str(len(encoded))),
+        ("Connection", "close"),
+    ]
+    return format_response_head(status, phrase, headers) + encoded
+
+
+def _has_body(method: str, status: int) -> bool:
+    return method != "HEAD" and status >= 200 and status not in (204, 304)
+
+
+async def send_upstream_request(
+    conn: AsyncUpstreamConnection, method: str, path: str, body: AsyncRequestBody, headers: list[tuple[str, str]]
+):
+    if not any(key.lower() == "host" for key, _ in headers):
+        headers = [("Host", f"{UPSTREAM_HOST}")] + headers
+    if isinstance(body, bytes):
+        # the body might have been rewritten with hints for the model server
+        headers = [(key, value) for key, value in headers if key.lower() != "content-length"]
+        headers.append(("Content-Length", str(len(body))))
+    elif body is not None:
+        headers = [(key, value) for key, value in headers if key.lower() != "content-length"]
+        headers.append(("Transfer-Encoding", "chunked"))
+    elif body is None and method in ("POST", "PUT", "PATCH"):
+        headers.append(("Content-Length", "0"))
+
+    lines = [f"{method} {path} HTTP/1.1"] + [f"{key}: {value}" for key, value in headers]
+    conn.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict"))
+    if isinstance(body, bytes):
+        conn.writer.write(body)
+    elif body is not None:
+        async for block in body:
+            conn.writer.write(encode_chunk(block))
+            await conn.writer.drain()
+        conn.writer.write(b"0\r\n\r\n")
+    await conn.writer.drain()
+
+
+async def relay_response(
+    request: Request,
+    response: UpstreamResponse,
+    upstream: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    timer: Optional[RequestTimer] = None,
+    recorder: Optional[ResponseRecorder] = None,
+) -> tuple[bool, bool]:
+    """Relays the upstream response to the client as it arrives, with backpressure from the client.
+
+    A response without a Content-Length is sent with chunked transfer encoding to HTTP/1.1 clients.
+    Returns whether the client connection can be kept alive and whether the upstream one can be reused.
+    """
+    has_body = _has_body(request.method, response.status)
+    upstream_chunked = "chunked" in response.headers.get("Transfer-Encoding", "").lower()
+    length = None if upstream_chunked else response.headers.get("Content-Length")
+    chunked = has_body and length is None and request.version != "HTTP/1.0"
+    keep_alive = request.keep_alive and (not has_body or length is not None or chunked)
+
+    headers = [(key, value) for key, value in response.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+    if recorder is not None:
+        recorder.start(response.status, response.reason, list(headers))
+    if chunked:
+        headers.append(("Transfer-Encoding", "chunked"))
+    if not keep_alive:
+        headers.append(("Connection", "close"))
+    writer.write(format_response_head(response.status, response.reason, headers))
+
+    if has_body:
+        if upstream_chunked:
+            blocks = iter_chunked_body(upstream)
+        elif length is not None:
+            blocks = iter_body(upstream, int(length))
+        else:
+            blocks = iter_until_eof(upstream)
+
+        async for block in blocks:
+            if timer is not None:
+                timer.block_received(block)
+            if recorder is not None:
+                recorder.write(block)
+            writer.write(encode_chunk(block) if chunked else block)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+    # without a length or chunked encoding the upstream response is delimited by closing the connection
+    reusable = not response.will_close and (not has_body or upstream_chunked or length is not None)
+    return keep_alive, reusable
+
+
+async def replay_response(
+    request: Request, cached: CachedResponse, writer: asyncio.StreamWriter, cache_hit: bool = True
+) -> bool:
+    """Sends a cached or otherwise complete response like relay_response, with the events of a
+    streamed response in chunks of their own. Returns whether the client connection can be kept alive."""
+    has_body = _has_body(request.method, cached.status)
+    chunked = has_body and not cached.has_length and request.version != "HTTP/1.0"
+    keep_alive = request.keep_alive and (not has_body or cached.has_length or chunked)
+
+    headers = cached.headers + ([("X-Ramalama-Cache", "hit")] if cache_hit else [])
+    if chunked:
+        headers.append(("Transfer-Encoding", "chunked"))
+    if not keep_alive:
+        headers.append(("Connection", "close"))
+    writer.write(format_response_head(cached.status, cached.reason, headers))
+
+    if has_body:
+        for block in cached.blocks():
+            writer.write(encode_chunk(block) if chunked else block)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    return keep_alive
+
+
+class BufferedRamalamaHandler(RamalamaHandler):
+    """Runs the synchronous daemon API handlers for a request which has been read completely.
+    The response is written to a buffer and sent to the client by the event loop afterwards."""
+
+    def __init__(self, model_store_path: str, model_runner: ModelRunner, request: Request, body: bytes, client_address):
+        self.model_store_path = model_store_path
+        self.model_runner = model_runner
+        self.client_address = client_address
+        self.client_keep_alive = False
+        self.close_connection = True
+
+        self.command = request.method
+        self.path = request.path
+        self.request_version = request.version
+        self.requestline = f"{request.method} {request.path} {request.version}"
+        self.headers = request.headers
+
+        self.rfile = io.BytesIO(body)
+        self.response = io.BytesIO()
+        self.wfile = self.response
+
+    def run(self) -> bytes:
+        handle = getattr(self, f"do_{self.command}", None)
+        if handle is None:
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+        else:
+            self.handle_safely(handle)
+        return self.response.getvalue()
+
+
+def raise_open_file_limit():
+    """Raises the soft limit of open files to the hard limit, every proxied stream holds a
+    client and an upstream connection."""
+    try:
+        import resource
+    except ImportError:
+        # Windows has no such limit
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else max(soft, 1 << 20)
+    if soft == resource.RLIM_INFINITY or soft >= target:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        logger.debug(f"Raised the limit of open files from {soft} to {target}")
+    except (ValueError, OSError) as e:
+        logger.debug(f"Failed to raise the limit of open files from {soft} to {target}: {e}")
+
+
+class AsyncRamalamaServer:
+    """Ramalama daemon serving all connections from a single asyncio event loop.
+
+    Unlike the RamalamaServer, which uses a thread per connection, an idle or streaming client
+    only costs a few KiB, so the daemon scales to many thousands of concurrent long-lived
+    streams. Proxied requests are relayed with non-blocking upstream connections, the daemon
+    API handlers block on starting and stopping models and run in a small pool of threads.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        model_store_path: str,
+        idle_check_interval: timedelta,
+        memory_budget: Optional[int] = None,
+        socket_path: Optional[str] = None,
+    ):
+        # Use AF_INET6 for IPv6 addresses; on dual-stack systems :: accepts IPv4 too
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        dualstack = family == socket.AF_INET6 and socket.has_dualstack_ipv6()
+        self.socket = socket.create_server(
+            (host, port), family=family, backlog=LISTEN_BACKLOG, dualstack_ipv6=dualstack
+        )
+        self.server_address = self.socket.getsockname()
+
+        self.model_store_path: str = model_store_path
+        self.model_runner: ModelRunner = ModelRunner(memory_budget)
+        self.idle_check_interval: timedelta = idle_check_interval
+        daemon_config = ActiveConfig().daemon
+        self.services = DaemonServices(self.model_runner, model_store_path, idle_check_interval, daemon_config)
+        # local clients connect to the socket without the overhead of TCP
+        self.socket_path = socket_path
+        self.unix_socket: Optional[socket.socket] = None
+        if socket_path is not None:
+            try:
+                self.unix_socket = bind_unix_socket(socket_path, int(daemon_config.socket_mode, 8))
+            except OSError:
+                self.socket.close()
+                raise
+
+        self._executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="ramalama-api")
+        # upstream connection pools by model ID, along with the model they were created for
+        self._pools: dict[str, tuple[ManagedModel, AsyncUpstreamConnectionPool]] = {}
+        self._clients: set[asyncio.Task] = set()
+        # pending waits for starting models to become ready
+        self._ready_waiters: dict[ManagedModel, asyncio.Future[bool]] = {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._shutdown_request = threading.Event()
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        self._is_shut_down.clear()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stops serve_forever and waits for it to finish. Must not be called from the event loop."""
+        self._shutdown_request.set()
+        loop, stop = self._loop, self._stop
+        if loop is not None and stop is not None:
+            try:
+                loop.call_soon_threadsafe(stop.set)
+            except RuntimeError:
+                # the loop has been closed already
+                pass
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        self.socket.close()
+        if self.unix_socket is not None and self.socket_path is not None:
+            self.unix_socket.close()
+            remove_unix_socket(self.socket_path)
+        self._executor.shutdown(wait=False)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._loop = loop
+        if self._shutdown_request.is_set():
+            return
+
+        servers = [await asyncio.start_server(self._handle_client, sock=self.socket, limit=MAX_HEAD_SIZE)]
+        if self.unix_socket is not None:
+            servers.append(
+                await asyncio.start_unix_server(
+                    self._handle_client, sock=self.unix_socket, limit=MAX_HEAD_SIZE, backlog=LISTEN_BACKLOG
+                )
+            )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._stop.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # signal handlers can only be installed by the main thread on Unix
+                pass
+        self.services.start()
+        pool_cleanup = asyncio.create_task(self._close_unused_pools_periodically())
+
+        try:
+            await self._stop.wait()
+        finally:
+            logger.info("Shutting down ramalama daemon...")
+            pool_cleanup.cancel()
+            for server in servers:
+                server.close()
+            for task in list(self._clients):
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            for _, pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+            await loop.run_in_executor(self._executor, self.services.stop)
+            await loop.run_in_executor(self._executor, self.services.close)
+
+    async def _close_unused_pools_periodically(self):
+        while True:
+            await asyncio.sleep(self.idle_check_interval.total_seconds())
+            self._close_unused_pools()
+
+    def _close_unused_pools(self):
+        managed_models = self.model_runner.managed_models
+        for model_id, (model, pool) in list(self._pools.items()):
+            if managed_models.get(model_id) is not model:
+                pool.close()
+                del self._pools[model_id]
+
+    def _pool_for(self, model: ManagedModel) -> AsyncUpstreamConnectionPool:
+        entry = self._pools.get(model.id)
+        if entry is not None and entry[0] is model:
+            return entry[1]
+        # the model has been stopped and served again in the meantime
+        if entry is not None:
+            entry[1].close()
+        pool = AsyncUpstreamConnectionPool(UPSTREAM_HOST, model.port)
+        self._pools[model.id] = (model, pool)
+        return pool
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        assert task is not None
+        self._clients.add(task)
+        client_address = writer.get_extra_info("peername")
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family == getattr(socket, "AF_UNIX", None):
+            client_address = peer_address(sock)
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(read_head(reader), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if head is None:
+                    break
+                keep_alive = await self._handle_request(parse_request(head), reader, writer, client_address)
+        except ProxyError as e:
+            logger.error(e.message)
+            retry_after = [("Retry-After", str(e.retry_after))] if e.retry_after is not None else None
+            writer.write(format_error_response(e.status, e.message, retry_after))
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Client connection {client_address} closed: {e}")
+        except asyncio.CancelledError:
+            # the daemon is shutting down
+            pass
+        except Exception as e:
+            logger.error(f"Error handling request: {e}")
+            logger.debug("", exc_info=True)
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    async def _handle_request(
+        self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_address
+    ) -> bool:
+        """Handles a request and returns whether the client connection can be kept alive."""
+        logger.debug(f"Handling {request.method} request for path: {request.path}")
+
+        referer = request.headers.get("Referer")
+        is_api_request = (
+            request.path.startswith(DaemonAPIHandler.PATH_PREFIX)
+            or (request.method == "GET" and request.path == ModelProxyHandler.PATH_PREFIX)
+            or (request.path == MetricsHandler.PATH_PREFIX and referer is None)
+        )
+        if not is_api_request and (request.path.startswith(ModelProxyHandler.PATH_PREFIX) or referer is not None):
+            return await self._forward_request(request, referer, reader, writer, client_address)
+
+        body = await read_request_body(request, reader, writer)
+        if body is not None and not isinstance(body, bytes):
+            body = b"".join([block async for block in body])
+        handler = BufferedRamalamaHandler(
+            self.model_store_path, self.model_runner, request, body or b"", client_address
+        )
+        response = await asyncio.get_running_loop().run_in_executor(self._executor, handler.run)
+        # responses of the daemon API are delimited by closing the connection
+        writer.write(response)
+        await writer.drain()
+        return False
+
+    async def _forward_request(
+        self,
+        request: Request,
+        referer: Optional[str],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        client_address,
+    ) -> bool:
+        client = client_address[0] if client_address else ""
+        with ProxiedRequest(self.model_runner, request.method, request.path, referer, client) as proxied:
+            return await self._proxy(request, proxied, reader, writer)
+
+    async def _proxy(
+        self, request: Request, proxied: ProxiedRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        body = await read_request_body(request, reader, writer, proxied.max_buffered_body)
+        timer = proxied.route(body, request.headers.get("Authorization"))
+        model = proxied.model
+        # requests for a model which is still loading are held back until it is ready
+        if not await self._wait_until_ready(model):
+            raise proxied.not_ready()
+
+        cached = None
+        if proxied.cache_key is not None:
+            # responses spilled to disk are read without blocking the event loop
+            cached = await asyncio.get_running_loop().run_in_executor(self._executor, proxied.cached_response)
+        if cached is not None:
+            keep_alive = await replay_response(request, cached, writer)
+            proxied.finish(cached.status)
+            return keep_alive
+
+        # embeddings requests of the clients are sent upstream together
+        headers = forwarded_headers(request.headers.items())
+        coalesced = proxied.coalesce_embeddings(headers)
+        batched = await asyncio.wrap_future(coalesced) if coalesced is not None else None
+        if batched is not None:
+            proxied.coalesced(batched)
+            keep_alive = await replay_response(request, batched, writer, cache_hit=False)
+            proxied.finish(batched.status)
+            return keep_alive
+
+        try:
+            async with model.admit_async(proxied.client) as waited:
+                timer.admitted(waited)
+                with proxied.hinted_body() as hinted:
+                    return await self._relay(request, proxied, headers, body if hinted is None else hinted, writer)
+        except (QueueFullError, QueueTimeoutError) as e:
+            raise proxied.rejected(e) from e
+
+    async def _relay(
+        self,
+        request: Request,
+        proxied: ProxiedRequest,
+        headers: list[tuple[str, str]],
+        body: AsyncRequestBody,
+        writer: asyncio.StreamWriter,
+    ) -> bool:
+        model, forward_path = proxied.model, proxied.forward_path
+        recorder = proxied.response_recorder()
+
+        logger.debug(f"Forwarding request -X {request.method} {forward_path} to port {model.port}")
+
+        with model.track_request():
+            pool = self._pool_for(model)
+            try:
+                conn, response = await self._send_upstream(pool, request.method, forward_path or "/", body, headers)
+            except ClientDisconnectedError as e:
+                proxied.client_disconnected(e)
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                raise proxied.upstream_failed(e) from e
+
+            reusable = False
+            try:
+                keep_alive, reusable = await relay_response(
+                    request, response, conn.reader, writer, proxied.timer, recorder
+                )
+                logger.debug(f"Received response from -X {request.method} {forward_path} on port {model.port}")
+            finally:
+                pool.release(conn, reusable)
+                proxied.finish(response.status)
+
+        if recorder is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, proxied.store_response, recorder)
+        return keep_alive
+
+    async def _wait_until_ready(self, model: ManagedModel) -> bool:
+        if model.state != ModelState.STARTING:
+            return model.state == ModelState.READY
+        # a single thread waits for a starting model on behalf of all of its requests
+        waiter = self._ready_waiters.get(model)
+        if waiter is None:
+            waiter = self._ready_waiters[model] = self._wait_in_thread(model)
+            waiter.add_done_callback(lambda _: self._ready_waiters.pop(model, None))
+        # a client going away must not cancel the wait of the others
+        return await asyncio.shield(waiter)
+
+    @staticmethod
+    def _wait_in_thread(model: ManagedModel) -> asyncio.Future[bool]:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[bool] = loop.create_future()
+
+        def resolve(ready: bool):
+            if not future.done():
+                future.set_result(ready)
+
+        def wait():
+            ready = model.wait_until_ready(STARTING_MODEL_WAIT_TIMEOUT)
+            try:
+                loop.call_soon_threadsafe(resolve, ready)
+            except RuntimeError:
+                # the event loop has been closed in the meantime
+                pass
+
+        # a daemon thread, unlike the executors, doesn't hold up the shutdown while the model loads
+        threading.Thread(target=wait, name=f"ready-wait-{model.port}", daemon=True).start()
+        return future
+
+    @staticmethod
+    async def _send_upstream(
+        pool: AsyncUpstreamConnectionPool,
+        method: str,
+        path: str,
+        body: AsyncRequestBody,
+        headers: list[tuple[str, str]],
+    ) -> tuple[AsyncUpstreamConnection, UpstreamResponse]:
+        conn, reused = await pool.acquire()
+        while True:
+            try:
+                await send_upstream_request(conn, method, path, body, headers)
+                quickack(conn.writer.get_extra_info("socket"))
+                return conn, await read_response_head(conn.reader)
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                # a streamed body has been consumed already and can't be sent again
+                if not reused or not (body is None or isinstance(body, bytes)):
+                    raise
+                # The server closed the pooled connection right when it was reused, so the
+                # request has not been processed and is retried once on a new connection
+                conn, reused = await pool.connect(), False
+            except BaseException:
+                conn.close()
+                raise
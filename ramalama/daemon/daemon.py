@@ -7,79 +7,53 @@ import signal
 import socket
 import socketserver
 import threading
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import timedelta
+from typing import Optional, Union
 
+from ramalama.cli import parse_size_option
 from ramalama.config import ActiveConfig
+from ramalama.daemon.async_server import AsyncRamalamaServer, raise_open_file_limit
+from ramalama.daemon.handler.daemon import DaemonAPIHandler
 from ramalama.daemon.handler.ramalama import RamalamaHandler
 from ramalama.daemon.logging import configure_logger, logger
 from ramalama.daemon.service.model_runner import ModelRunner
+from ramalama.daemon.service.preload import ModelPreloader
+from ramalama.daemon.service.services import DaemonServices
+from ramalama.daemon.unix_socket import bind_unix_socket, peer_address, remove_unix_socket
 from ramalama.log_levels import LogLevel
 
+# The threaded server uses a thread per connection, the asyncio one serves all connections
+# from a single event loop and scales to many thousands of concurrent streams
+SERVER_TYPES = ["threaded", "asyncio"]
+
 
 class ShutdownHandler:
     def __init__(self, server: "RamalamaServer") -> None:
         self.server = server
-        self.idle_check_timer: Optional[threading.Timer] = None
 
     def handle_kill(self, signum, frame):
-        if self.idle_check_timer:
-            self.idle_check_timer.cancel()
         self.server.shutdown()
 
-    def handle_alarm(self, signum, frame):
-        # check for expiration of all models, stopping them if necessary and
-        # stop shutdown server if no models are running
-        self.server.check_model_expiration()
-        if not self.server.model_runner.managed_models:
-            self.server.shutdown()
-            return
-
-        # register alarm again for next check (Unix only)
-        if hasattr(signal, 'alarm'):
-            signal.alarm(self.server.idle_check_interval.seconds)
-
     def __enter__(self):
         signal.signal(signal.SIGINT, self.handle_kill)
         signal.signal(signal.SIGTERM, self.handle_kill)
 
-        # SIGALRM is Unix-only, use threading.Timer on Windows as fallback
-        if hasattr(signal, 'SIGALRM'):
-            # set initial idle check to 300s == 5min to prevent service from stopping
-            # right after being started
-            signal.signal(signal.SIGALRM, self.handle_alarm)
-            signal.alarm(300)
-        else:
-            # On Windows, use a background thread for idle checks
-            self._start_idle_check_thread()
-
-    def _start_idle_check_thread(self, interval_seconds=300):
-        """Start a background thread for idle checking on Windows (no SIGALRM support)."""
-
-        def check_and_reschedule():
-            self.server.check_model_expiration()
-            if not self.server.model_runner.managed_models:
-                self.server.shutdown()
-                return
-            # Schedule next check
-            self.idle_check_timer = threading.Timer(self.server.idle_check_interval.seconds, check_and_reschedule)
-            self.idle_check_timer.daemon = True
-            self.idle_check_timer.start()
-
-        self.idle_check_timer = threading.Timer(interval_seconds, check_and_reschedule)
-        self.idle_check_timer.daemon = True
-        self.idle_check_timer.start()
-
     def __exit__(self, type, value, traceback):
-        if self.idle_check_timer is not None:
-            self.idle_check_timer.cancel()
+        pass
 
 
 class RamalamaServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
 
     def __init__(
-        self, host: str, port: int, model_store_path: str, idle_check_interval: timedelta, bind_and_activate=True
+        self,
+        host: str,
+        port: int,
+        model_store_path: str,
+        idle_check_interval: timedelta,
+        memory_budget: Optional[int] = None,
+        socket_path: Optional[str] = None,
+        bind_and_activate=True,
     ):
         # Use AF_INET6 for IPv6 addresses; on dual-stack systems :: accepts IPv4 too
         if ":" in host:
@@ -88,8 +62,18 @@ class RamalamaServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
         super().__init__((host, port), None, bind_and_activate)  # type: ignore
 
         self.model_store_path: str = model_store_path
-        self.model_runner: ModelRunner = ModelRunner()
+        self.model_runner: ModelRunner = ModelRunner(memory_budget)
         self.idle_check_interval: timedelta = idle_check_interval
+        daemon_config = ActiveConfig().daemon
+        self.services = DaemonServices(self.model_runner, model_store_path, idle_check_interval, daemon_config)
+        # local clients connect to the socket without the overhead of TCP
+        self.unix_server: Optional[RamalamaUnixServer] = None
+        if socket_path is not None:
+            try:
+                self.unix_server = RamalamaUnixServer(socket_path, int(daemon_config.socket_mode, 8), self)
+            except OSError:
+                self.server_close()
+                raise
 
     def server_bind(self):
         # Enable dual-stack so :: accepts IPv4 connections too
@@ -103,53 +87,134 @@ class RamalamaServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     def finish_request(self, request, client_address):
         RamalamaHandler(self.model_store_path, self.model_runner, request, client_address, self)
 
-    def check_model_expiration(self):
-        curr_time = datetime.now()
-        for name, m in self.model_runner.managed_models.items():
-            expiration_date = getattr(m, "expiration_date", None)
-            if expiration_date is None or expiration_date > curr_time:
-                continue
-
-            try:
-                logger.info(f"Stopping expired model '{name}'...")
-                self.model_runner.stop_model(m.id)
-            except Exception as e:
-                logger.error(f"Failed to stop expired model '{name}': {e}")
+    def serve_forever(self, poll_interval=0.5):
+        self.services.start()
+        if self.unix_server is not None:
+            threading.Thread(
+                target=self.unix_server.serve_forever, args=(poll_interval,), name="unix-socket", daemon=True
+            ).start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            if self.unix_server is not None:
+                self.unix_server.shutdown()
+            self.services.close()
+
+    def server_close(self):
+        super().server_close()
+        if self.unix_server is not None:
+            self.unix_server.server_close()
 
     def shutdown(self):
         logger.info("Shutting down ramalama daemon...")
-
-        for name, managed_model in self.model_runner.managed_models.items():
-            try:
-                logger.info(f"Stopping model runner {name}...")
-                self.model_runner.stop_model(managed_model.id)
-            except Exception as e:
-                logger.error(f"Error stopping model runner {name}: {e}")
+        self.services.stop()
 
         super().shutdown()
 
 
+# UnixStreamServer is missing on platforms without AF_UNIX, the socket is bound by bind_unix_socket
+class RamalamaUnixServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Serves the requests of local clients on a Unix domain socket, next to the TCP port of
+    the RamalamaServer whose models it shares. Access is controlled by the permissions of the
+    socket file."""
+
+    def __init__(self, path: str, mode: int, server: RamalamaServer):
+        super().__init__(path, None, bind_and_activate=False)  # type: ignore
+        self.socket_path: str = path
+        self.socket.close()
+        self.socket = bind_unix_socket(path, mode)
+        self.ramalama_server = server
+        try:
+            self.server_activate()
+        except OSError:
+            self.server_close()
+            raise
+
+    def finish_request(self, request, client_address):
+        server = self.ramalama_server
+        RamalamaHandler(server.model_store_path, server.model_runner, request, peer_address(request), self)
+
+    def server_close(self):
+        super().server_close()
+        remove_unix_socket(self.socket_path)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Ramalama Daemon")
     parser.add_argument("--host", type=str, default="::")
     parser.add_argument("--port", type=int, default=8080)
     parser.add_argument("--model-store-path", type=str, default="/models")
+    parser.add_argument("--memory-budget", type=parse_size_option, default=None)
+    parser.add_argument("--server-type", choices=SERVER_TYPES, default="threaded")
+    parser.add_argument("--socket", type=str, default=None)
 
     return parser.parse_args()
 
 
-def run(host: str = "::", port: int = 8080, model_store_path: str = "/models"):
+def run(
+    host: str = "::",
+    port: int = 8080,
+    model_store_path: str = "/models",
+    memory_budget: Optional[int] = None,
+    server_type: str = "threaded",
+    socket_path: Optional[str] = None,
+):
     configure_logger(ActiveConfig().log_level or LogLevel.DEBUG)
     host_str = f"[{host}]" if ":" in host else host
-    logger.debug(f"Starting Ramalama daemon on {host_str}:{port}...")
+    logger.debug(f"Starting Ramalama daemon on {host_str}:{port} using the {server_type} server...")
+    if socket_path is not None:
+        logger.debug(f"Listening on the Unix domain socket {socket_path} as well...")
+
+    server_class = AsyncRamalamaServer if server_type == "asyncio" else RamalamaServer
     try:
-        server = RamalamaServer(host, port, model_store_path, timedelta(seconds=10))
+        server = server_class(host, port, model_store_path, timedelta(seconds=10), memory_budget, socket_path)
     except OSError as e:
         if host != "::" or e.errno not in (errno.EAFNOSUPPORT, errno.EADDRNOTAVAIL, errno.EINVAL):
             raise
         host = "0.0.0.0"
         logger.debug(f"IPv6 not available, falling back to {host}:{port}...")
-        server = RamalamaServer(host, port, model_store_path, timedelta(seconds=10))
+        server = server_class(host, port, model_store_path, timedelta(seconds=10), memory_budget, socket_path)
+
+    config = ActiveConfig()
+    api_handler = DaemonAPIHandler(server.model_runner, model_store_path)
+    # adopted models are served already when they are preloaded
+    adopt_models(api_handler)
+    preloader = None
+    if config.daemon.preload:
+        preloader = ModelPreloader(server.model_runner, api_handler.serve, config.daemon, config.runtime)
+        server.model_runner.preloader = preloader
+        preloader.start()
+
+    try:
+        serve(server)
+    finally:
+        if preloader is not None:
+            preloader.stop()
+
+
+def adopt_models(api_handler: DaemonAPIHandler):
+    """Adopts the model servers left running by a previous daemon."""
+    model_runner = api_handler.model_runner
+    if model_runner.state_file is None:
+        return
+    records = sorted(model_runner.state_file.load(), key=lambda record: record.replica)
+    for record in records:
+        try:
+            api_handler.adopt(record)
+        except Exception as e:
+            logger.error(f"Failed to adopt model server {record.pid} of {record.id}: {e}")
+    # drops the model servers which are gone
+    model_runner.save_state()
+
+
+def serve(server: Union[RamalamaServer, AsyncRamalamaServer]):
+    if isinstance(server, AsyncRamalamaServer):
+        # signals are handled by the event loop
+        raise_open_file_limit()
+        with server:
+            server.serve_forever()
+        return
+
     with server:
         with ShutdownHandler(server):
             server_thread = threading.Thread(target=server.serve_forever, daemon=True)
@@ -159,4 +224,4 @@ def run(host: str = "::", port: int = 8080, model_store_path: str = "/models"):
 
 if __name__ == '__main__':
     args = parse_args()
-    run(args.host, args.port, args.model_store_path)
+    run(args.host, args.port, args.model_store_path, args.memory_budget, args.server_type, args.socket)
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import json
 from dataclasses import dataclass
+from typing import Optional
 
 from ramalama.config import BaseConfig
 from ramalama.daemon.dto.errors import MissingArgumentError
@@ -12,11 +13,22 @@ class ServeRequest:
     model_name: str
     runtime: str
     exec_args: dict[str, str]
+    # pinned models are never evicted nor stopped when idle
+    pinned: bool = False
+    # seconds the model is kept loaded without requests, the daemon default if None
+    idle_timeout: Optional[int] = None
+    # replicas started right away, more are started up to max_replicas when requests queue up
+    replicas: int = 1
+    max_replicas: Optional[int] = None
 
     def to_dict(self) -> dict:
         return {
             "model_name": self.model_name,
             "runtime": self.runtime,
+            "pinned": self.pinned,
+            "idle_timeout": self.idle_timeout,
+            "replicas": self.replicas,
+            "max_replicas": self.max_replicas,
             "exec_args": dict(
                 [
                     (key, value) for key, value in self.exec_args.items() if type(value) is str
@@ -61,10 +73,25 @@ class ServeRequest:
             },
         }
 
+        idle_timeout = data_dict.get("idle_timeout", None)
+        if idle_timeout is not None and (not isinstance(idle_timeout, int) or idle_timeout <= 0):
+            raise ValueError(f"idle_timeout must be a positive number of seconds: {idle_timeout}")
+
+        replicas = data_dict.get("replicas", 1)
+        if not isinstance(replicas, int) or replicas < 1:
+            raise ValueError(f"replicas must be a positive number: {replicas}")
+        max_replicas = data_dict.get("max_replicas", None)
+        if max_replicas is not None and (not isinstance(max_replicas, int) or max_replicas < replicas):
+            raise ValueError(f"max_replicas must be a number of at least {replicas}: {max_replicas}")
+
         return ServeRequest(
             model_name=model_name,
             runtime=runtime,
             exec_args=exec_args,
+            pinned=data_dict.get("pinned", False) is True,
+            idle_timeout=idle_timeout,
+            replicas=replicas,
+            max_replicas=max_replicas,
         )
 
 
@@ -83,6 +110,35 @@ class ServeResponse:
         return json.dumps(self.to_dict(), indent=4, sort_keys=True)
 
 
+# Seconds the requests in flight on a replaced model server may take to finish by default
+SWAP_DRAIN_TIMEOUT = 60
+
+
+@dataclass
+class SwapServeRequest:
+    """Replaces the model served at the path of the model of the serve request with it."""
+
+    serve_request: ServeRequest
+    # seconds the requests in flight on the replaced model server may take to finish
+    drain_timeout: float = SWAP_DRAIN_TIMEOUT
+
+    @staticmethod
+    def from_string(data: str) -> "SwapServeRequest":
+        serve_request = ServeRequest.from_string(data)
+
+        drain_timeout = json.loads(data).get("drain_timeout", SWAP_DRAIN_TIMEOUT)
+        if isinstance(drain_timeout, bool) or not isinstance(drain_timeout, (int, float)) or drain_timeout < 0:
+            raise ValueError(f"drain_timeout must be a non-negative number of seconds: {drain_timeout}")
+
+        return SwapServeRequest(serve_request=serve_request, drain_timeout=drain_timeout)
+
+    def to_dict(self) -> dict:
+        return {**self.serve_request.to_dict(), "drain_timeout": self.drain_timeout}
+
+    def serialize(self) -> str:
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True)
+
+
 @dataclass
 class StopServeRequest:
     model_name: str
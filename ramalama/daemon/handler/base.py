@@ -53,6 +53,7 @@ class APIHandler(ABC):
                     size_vram=0,
                     digest=m.id.replace("sha-", ""),
                     cmd=" ".join(m.run_cmd),
+                    state=str(m.state),
                 )
             )
 
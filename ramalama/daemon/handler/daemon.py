@@ -1,22 +1,51 @@
 from __future__ import annotations
 
+import argparse
 import http.server
 import json
-from datetime import datetime, timedelta
+import os
+import time
+from datetime import timedelta
+from http.client import HTTPConnection
+from typing import Any, Callable, Optional
 
 from ramalama.arg_types import StoreArgs
 from ramalama.cli import parse_args_from_cmd
 from ramalama.common import generate_sha256
 from ramalama.config import ActiveConfig
-from ramalama.daemon.dto.model import ModelDetailsResponse, ModelResponse, model_list_to_dict
-from ramalama.daemon.dto.serve import ServeRequest, ServeResponse, StopServeRequest
+from ramalama.daemon.dto.serve import ServeRequest, ServeResponse, StopServeRequest, SwapServeRequest
 from ramalama.daemon.handler.base import APIHandler
 from ramalama.daemon.handler.proxy import ModelProxyHandler
 from ramalama.daemon.logging import DEFAULT_LOG_DIR, logger
-from ramalama.daemon.service.model_runner import ManagedModel, ModelRunner, generate_model_id
-from ramalama.model_store.global_store import GlobalModelStore
-from ramalama.plugins.loader import assemble_command
-from ramalama.transports.transport_factory import TransportFactory
+from ramalama.daemon.service.admission import AdmissionController, parallel_slots
+from ramalama.daemon.service.footprint import estimate_footprint
+from ramalama.daemon.service.model_listing import etag_matches, get_listing_cache
+from ramalama.daemon.service.model_runner import (
+    UPSTREAM_HOST,
+    ManagedModel,
+    MemoryBudgetExceededError,
+    ModelNotReadyError,
+    ModelRunner,
+)
+from ramalama.daemon.service.replicas import ReplicaScaling, replica_cpus
+from ramalama.daemon.service.state import AdoptedProcess, ModelRecord, process_matches
+from ramalama.plugins.loader import assemble_command, get_runtime
+from ramalama.transports.base import local_model_paths
+from ramalama.transports.transport_factory import CLASS_MODEL_TYPES, TransportFactory
+
+
+def build_ready_check(args: argparse.Namespace, port: int, model_name: str) -> Callable[[], bool]:
+    """Returns a readiness probe of a model server using the check of its runtime plugin."""
+    plugin = get_runtime(args.runtime)
+
+    def ready_check() -> bool:
+        conn = HTTPConnection(UPSTREAM_HOST, port, timeout=3)
+        try:
+            return plugin.service_ready_check(conn, args, model_name)
+        finally:
+            conn.close()
+
+    return ready_check
 
 
 class DaemonAPIHandler(APIHandler):
@@ -34,6 +63,9 @@ class DaemonAPIHandler(APIHandler):
         if handler.path.startswith(f"{DaemonAPIHandler.PATH_PREFIX}/ps"):
             self._handle_get_running_models(handler)
             return
+        if handler.path.startswith(f"{DaemonAPIHandler.PATH_PREFIX}/ready"):
+            self._handle_get_ready(handler)
+            return
 
         raise Exception("Unsupported GET request path")
 
@@ -47,6 +79,9 @@ class DaemonAPIHandler(APIHandler):
         if handler.path.startswith(f"{DaemonAPIHandler.PATH_PREFIX}/stop"):
             self._handle_post_stop(handler)
             return
+        if handler.path.startswith(f"{DaemonAPIHandler.PATH_PREFIX}/swap"):
+            self._handle_post_swap(handler)
+            return
 
         raise Exception("Unsupported POST request path")
 
@@ -57,55 +92,36 @@ class DaemonAPIHandler(APIHandler):
         pass
 
     def _handle_get_tags(self, handler: http.server.SimpleHTTPRequestHandler):
-        # get args for querying
-        arg_engine = "podman"
-        arg_show_container = False
-        arg_show_all = True
-
-        collected_models = []
-        for model_name, model_files in (
-            GlobalModelStore(self.model_store_path).list_models(arg_engine, arg_show_container).items()
-        ):
-            local_timezone = datetime.now().astimezone().tzinfo
-
-            is_partially_downloaded = any(file.is_partial for file in model_files)
-            if not arg_show_all and is_partially_downloaded:
-                continue
-
-            size_sum = 0
-            last_modified = 0.0
-            for file in model_files:
-                size_sum += file.size
-                last_modified = max(file.modified, last_modified)
-
-            model = TransportFactory(
-                model_name, StoreArgs(engine=arg_engine, container=arg_show_container, store=self.model_store_path)
-            ).create()
-            full_model_name = f"{model.model_type}://{model.model_organization}/{model.model_name}:{model.model_tag}"
-            #
-            # TODO: # Get model details via inspect
-            #
-            collected_models.append(
-                ModelResponse(
-                    name=model.model_name,
-                    organization=model.model_organization,
-                    tag=model.model_tag,
-                    source=model.model_type,
-                    model=full_model_name,
-                    modified_at=datetime.fromtimestamp(last_modified, tz=local_timezone).isoformat(),
-                    size=size_sum,
-                    is_partial=is_partially_downloaded,
-                    digest=generate_sha256(full_model_name, with_sha_prefix=False),
-                    details=ModelDetailsResponse(
-                        format="", family="", families=[], parameter_size="", quantization_level=""
-                    ),
-                )
-            )
+        body, etag = get_listing_cache(self.model_store_path).get()
+        if etag_matches(handler.headers.get("If-None-Match"), etag):
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.end_headers()
+            handler.wfile.flush()
+            return
 
         handler.send_response(200)
         handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        handler.wfile.write(body)
+        handler.wfile.flush()
+
+    def _handle_get_ready(self, handler: http.server.SimpleHTTPRequestHandler):
+        preloader = self.model_runner.preloader
+        models: list[dict[str, Any]] = []
+        if preloader is None:
+            ready = True
+        else:
+            ready, models = preloader.readiness()
+
+        body = json.dumps({"ready": ready, "models": models}, indent=4).encode("utf-8")
+        handler.send_response(200 if ready else 503)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
         handler.end_headers()
-        handler.wfile.write(json.dumps(model_list_to_dict(collected_models), indent=4).encode("utf-8"))
+        handler.wfile.write(body)
         handler.wfile.flush()
 
     def _handle_post_serve(self, handler: http.server.SimpleHTTPRequestHandler):
@@ -115,13 +131,196 @@ class DaemonAPIHandler(APIHandler):
 
         logger.debug(f"Received serve request: {serve_request.serialize()}")
 
+        try:
+            managed_model = self.serve(serve_request)
+        except MemoryBudgetExceededError as e:
+            logger.error(str(e))
+            handler.send_error(503, str(e))
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.end_headers()
+        response = ServeResponse(managed_model.id, ModelProxyHandler.build_proxy_path(managed_model.model))
+        handler.wfile.write(json.dumps(response.to_dict(), indent=4).encode("utf-8"))
+        handler.wfile.flush()
+
+    def serve(self, serve_request: ServeRequest) -> ManagedModel:
+        """Creates and starts the model server of a serve request, along with the further
+        replicas requested. The model might still be starting when this returns. A model which
+        is served already, e.g. adopted from a previous daemon, is returned as it is."""
+        served = self.model_runner.served_models.get(
+            ModelProxyHandler.build_proxy_path(self._create_model(serve_request.model_name))
+        )
+        if served is not None:
+            return served
+
+        managed_model = self._create_replica(serve_request, 0)
+        try:
+            self.model_runner.add_model(managed_model)
+        except Exception:
+            self.model_runner.release_port(managed_model.port)
+            raise
+
+        serve_path = ModelProxyHandler.build_proxy_path(managed_model.model)
+        try:
+            self.model_runner.start_model(managed_model.id, serve_path)
+        except Exception:
+            self.model_runner.stop_model(managed_model.id)
+            raise
+
+        if self._set_scaling(serve_request, serve_path):
+            for _ in range(1, serve_request.replicas):
+                try:
+                    self.model_runner.add_replica(serve_path)
+                except Exception as e:
+                    # the autoscaler retries to start the missing replicas
+                    logger.error(f"Failed to start replica of {serve_request.model_name}: {e}")
+        return managed_model
+
+    def _set_scaling(self, serve_request: ServeRequest, serve_path: str) -> bool:
+        """Sets how the replicas of the model are created if there may be several of them."""
+        scaling = self._replica_scaling(serve_request)
+        if scaling is None:
+            return False
+        self.model_runner.set_scaling(serve_path, scaling)
+        return True
+
+    def _replica_scaling(self, serve_request: ServeRequest, generation: int = 0) -> Optional[ReplicaScaling]:
+        max_replicas = serve_request.max_replicas or serve_request.replicas
+        if max_replicas <= 1:
+            return None
+        return ReplicaScaling(
+            lambda replica: self._create_replica(serve_request, replica, generation),
+            serve_request.replicas,
+            max_replicas,
+        )
+
+    def _handle_post_swap(self, handler: http.server.SimpleHTTPRequestHandler):
+        content_length = int(handler.headers["Content-Length"])
+        payload = handler.rfile.read(content_length).decode("utf-8")
+        swap_request = SwapServeRequest.from_string(payload)
+
+        logger.debug(f"Received swap request: {swap_request.serialize()}")
+
+        try:
+            managed_model = self.swap(swap_request)
+        except (MemoryBudgetExceededError, ModelNotReadyError) as e:
+            logger.error(str(e))
+            handler.send_error(503, str(e))
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.end_headers()
+        response = ServeResponse(managed_model.id, ModelProxyHandler.build_proxy_path(managed_model.model))
+        handler.wfile.write(json.dumps(response.to_dict(), indent=4).encode("utf-8"))
+        handler.wfile.flush()
+
+    def swap(self, swap_request: SwapServeRequest) -> ManagedModel:
+        """Replaces the model served at the path of the requested one, e.g. another tag or
+        quantization of it, without dropping requests. The new model server is started alongside
+        the old ones and the requests are routed to it once it is ready. The old ones are stopped
+        when they finished their requests in flight or the drain timeout passed. If the new model
+        server doesn't become ready, it is stopped and the old ones keep serving.
+
+        All of it runs synchronously on the thread handling the API request, which returns once
+        the old model servers are stopped."""
+        serve_request = swap_request.serve_request
+        serve_path = ModelProxyHandler.build_proxy_path(self._create_model(serve_request.model_name))
+        replicas = self.model_runner.get_replicas(serve_path)
+        if not replicas:
+            return self.serve(serve_request)
+
+        generation = max(m.generation for m in replicas) + 1
+        managed_model = self._create_replica(serve_request, 0, generation)
+        try:
+            self.model_runner.add_model(managed_model)
+        except Exception:
+            self.model_runner.release_port(managed_model.port)
+            raise
+        try:
+            self.model_runner.start_standby(managed_model.id, serve_path)
+            if not managed_model.wait_until_ready(managed_model.ready_timeout):
+                raise ModelNotReadyError(
+                    f"Model {managed_model.id} replacing the one served at {serve_path} is {managed_model.state}"
+                )
+            replaced = self.model_runner.swap_served_model(
+                serve_path, managed_model.id, self._replica_scaling(serve_request, generation)
+            )
+        except Exception:
+            self.model_runner.stop_model(managed_model.id)
+            raise
+
+        logger.info(f"Model served at {serve_path} swapped to {managed_model.id}, draining {len(replaced)} replicas")
+        deadline = time.monotonic() + swap_request.drain_timeout
+        for m in replaced:
+            if not m.wait_until_idle(max(deadline - time.monotonic(), 0)):
+                logger.warning(f"Requests of replaced model {m.id} did not finish within {swap_request.drain_timeout}s")
+            try:
+                self.model_runner.stop_model(m.id)
+            except RuntimeError:
+                # stopped in the meantime, e.g. when idle
+                pass
+
+        for _ in range(1, serve_request.replicas):
+            try:
+                self.model_runner.add_replica(serve_path)
+            except Exception as e:
+                # the autoscaler retries to start the missing replicas
+                logger.error(f"Failed to start replica of {serve_request.model_name}: {e}")
+        return managed_model
+
+    def adopt(self, record: ModelRecord) -> bool:
+        """Adopts the model server of a previous daemon if it is still running the same command.
+        It is probed for readiness like a new one and terminated if it doesn't become ready.
+        Returns whether the model server was adopted."""
+        if not process_matches(record.pid, record.run_cmd):
+            logger.info(f"Model server {record.pid} of {record.id} is gone, not adopting it")
+            return False
+        if not self.model_runner.reserve_port(record.port):
+            logger.warning(f"Port {record.port} of model server {record.pid} of {record.id} is taken already")
+            return False
+
+        serve_request = ServeRequest.from_string(json.dumps(record.serve_request))
+        try:
+            managed_model = self._create_managed_model(serve_request, record.port, record.replica, record.generation)
+            # the command might be assembled differently by this version of the daemon
+            managed_model.run_cmd = record.run_cmd
+            self.model_runner.add_model(managed_model)
+        except Exception:
+            self.model_runner.release_port(record.port)
+            raise
+
+        logger.info(f"Adopting model server {record.pid} of {managed_model.id} listening on port {record.port}")
+        try:
+            self.model_runner.start_model(managed_model.id, record.serve_path, AdoptedProcess(record.pid))
+        except Exception:
+            self.model_runner.stop_model(managed_model.id)
+            raise
+        self._set_scaling(serve_request, record.serve_path)
+        return True
+
+    def _create_replica(self, serve_request: ServeRequest, replica: int, generation: int = 0) -> ManagedModel:
         port = self.model_runner.next_available_port()
-        model = TransportFactory(
-            serve_request.model_name,
+        try:
+            return self._create_managed_model(serve_request, port, replica, generation)
+        except Exception:
+            self.model_runner.release_port(port)
+            raise
+
+    def _create_model(self, model_name: str) -> CLASS_MODEL_TYPES:
+        return TransportFactory(
+            model_name,
             StoreArgs(store=self.model_store_path, engine=None, container=False),
             transport=ActiveConfig().transport,
         ).create()
 
+    def _create_managed_model(
+        self, serve_request: ServeRequest, port: int, replica: int = 0, generation: int = 0
+    ) -> ManagedModel:
+        model = self._create_model(serve_request.model_name)
+
         # Use the RamaLama CLI parser to get a namespace with all variables and their
         # default values, which is then used to assemble the final inference engine command
         ramalama_cmd = ["ramalama", "--runtime", serve_request.runtime, "serve", model.model_name, "--port", str(port)]
@@ -129,20 +328,52 @@ class DaemonAPIHandler(APIHandler):
             ramalama_cmd.extend([arg, val])
         _, args = parse_args_from_cmd(ramalama_cmd)
         # always log to file at the model-specific location
-        args.logfile = f"{DEFAULT_LOG_DIR}/{model.model_organization}_{model.model_name}_{model.model_tag}.log"
+        log_name = f"{model.model_organization}_{model.model_name}_{model.model_tag}"
+        if replica > 0:
+            log_name += f"_{replica}"
+        args.logfile = f"{DEFAULT_LOG_DIR}/{log_name}.log"
+        # replicas share the CPUs, each one runs a thread per CPU it is pinned to
+        cpus = replica_cpus(replica, serve_request.max_replicas or serve_request.replicas)
+        if cpus and not any(arg in serve_request.exec_args for arg in ("--threads", "-t")):
+            args.threads = len(cpus)
         inference_engine_command = assemble_command(args)
 
-        logger.info(f"Starting model runner for {serve_request.model_name} with command: {inference_engine_command}")
-        managed_model = ManagedModel(model, inference_engine_command, port, timedelta(seconds=30))
-        serve_path = ModelProxyHandler.build_proxy_path(model)
-        self.model_runner.add_model(managed_model)
-        self.model_runner.start_model(managed_model.id, serve_path)
+        try:
+            model_paths = local_model_paths(model)
+        except Exception as e:
+            logger.debug(f"Failed to get model paths of {serve_request.model_name}: {e}")
+            model_paths = []
+        footprint = estimate_footprint(model_paths, args.ctx_size) if model_paths else 0
+        # the files in the store are named by the digest of their contents
+        digest = None
+        if model_paths:
+            digest = generate_sha256("\n".join(os.path.realpath(path) for path in model_paths), with_sha_prefix=False)
 
-        handler.send_response(200)
-        handler.send_header("Content-Type", "application/json")
-        handler.end_headers()
-        handler.wfile.write(json.dumps(ServeResponse(managed_model.id, serve_path).to_dict(), indent=4).encode("utf-8"))
-        handler.wfile.flush()
+        # requests beyond the parallel slots of the server would only queue up inside of it
+        daemon_config = ActiveConfig().daemon
+        max_concurrent = parallel_slots(inference_engine_command) or daemon_config.max_concurrent_requests
+        admission = None
+        if max_concurrent > 0:
+            admission = AdmissionController(max_concurrent, daemon_config.max_queued_requests)
+
+        logger.info(f"Starting model runner for {serve_request.model_name} with command: {inference_engine_command}")
+        managed_model = ManagedModel(
+            model,
+            inference_engine_command,
+            port,
+            timedelta(seconds=serve_request.idle_timeout or daemon_config.idle_timeout),
+            footprint,
+            ready_check=build_ready_check(args, port, model.model_alias),
+            ready_timeout=get_runtime(args.runtime).service_ready_check_timeout,
+            pinned=serve_request.pinned,
+            admission=admission,
+            replica=replica,
+            cpus=cpus,
+            digest=digest,
+            generation=generation,
+        )
+        managed_model.serve_request = serve_request
+        return managed_model
 
     def _handle_post_stop(self, handler: http.server.SimpleHTTPRequestHandler):
         content_length = int(handler.headers["Content-Length"])
@@ -151,14 +382,8 @@ class DaemonAPIHandler(APIHandler):
 
         logger.debug(f"Received stop serve request: {stop_serve_request.serialize()}")
 
-        model = TransportFactory(
-            stop_serve_request.model_name,
-            StoreArgs(store=self.model_store_path, engine=None, container=False),
-            transport=ActiveConfig().transport,
-        ).create()
-
-        mid = generate_model_id(model)
-        self.model_runner.stop_model(mid)
+        model = self._create_model(stop_serve_request.model_name)
+        self.model_runner.stop_served_model(ModelProxyHandler.build_proxy_path(model))
 
         handler.send_response(200)
         handler.end_headers()
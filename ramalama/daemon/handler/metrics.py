@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import http.server
+
+from ramalama.daemon.handler.base import APIHandler
+from ramalama.daemon.service.metrics import OPENMETRICS_CONTENT_TYPE
+from ramalama.daemon.service.model_runner import ModelRunner
+
+
+class MetricsHandler(APIHandler):
+    PATH_PREFIX = "/metrics"
+
+    def __init__(self, model_runner: ModelRunner):
+        super().__init__(model_runner)
+
+    def handle_get(self, handler: http.server.SimpleHTTPRequestHandler):
+        body = self.model_runner.metrics.render().encode("utf-8")
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        handler.wfile.flush()
+
+    def handle_head(self, handler: http.server.SimpleHTTPRequestHandler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        handler.end_headers()
+
+    def handle_post(self, handler: http.server.SimpleHTTPRequestHandler):
+        handler.send_error(405, "Metrics can only be scraped with GET")
+
+    def handle_put(self, handler: http.server.SimpleHTTPRequestHandler):
+        handler.send_error(405, "Metrics can only be scraped with GET")
+
+    def handle_delete(self, handler: http.server.SimpleHTTPRequestHandler):
+        handler.send_error(405, "Metrics can only be scraped with GET")
@@ -1,14 +1,401 @@
 from __future__ import annotations
 
+import http.client
 import http.server
+import io
+import socket
 import urllib.parse
-import urllib.request
+from concurrent.futures import Future
+from contextlib import AbstractContextManager
+from typing import Iterable, Iterator, Optional, Union
 
 from ramalama.daemon.handler.base import APIHandler
 from ramalama.daemon.logging import logger
-from ramalama.daemon.service.model_runner import ModelRunner
+from ramalama.daemon.service.admission import QueueFullError, QueueTimeoutError
+from ramalama.daemon.service.affinity import hinted_body, prefix_hash, prompt_prefix
+from ramalama.daemon.service.coalescing import EMBEDDING_PATHS, embedding_inputs
+from ramalama.daemon.service.connection_pool import UpstreamConnectionPool
+from ramalama.daemon.service.metrics import RequestTimer
+from ramalama.daemon.service.model_runner import ManagedModel, ModelRunner
+from ramalama.daemon.service.response_cache import (
+    CachedResponse,
+    ResponseRecorder,
+    parse_json_request,
+    response_cache_key,
+)
 from ramalama.transports.transport_factory import CLASS_MODEL_TYPES
 
+HOP_BY_HOP_HEADERS = frozenset(
+    [
+        'connection',
+        'keep-alive',
+        'proxy-authenticate',
+        'proxy-authorization',
+        'te',
+        'trailers',
+        'transfer-encoding',
+        'upgrade',
+    ]
+)
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+# Seconds a request for a starting model waits for it to become ready
+STARTING_MODEL_WAIT_TIMEOUT = 120
+
+# Seconds clients are asked to wait before retrying a request for a model which isn't ready
+READY_RETRY_AFTER = 5
+
+# Size of the blocks request and response bodies are relayed in
+RELAY_BLOCK_SIZE = 64 * 1024
+
+# Largest POST body read completely before it is forwarded, so the request can be inspected
+# for caching and routing. Larger bodies are streamed upstream as they arrive.
+MAX_INSPECTED_BODY_SIZE = 1024 * 1024
+
+# Status recorded for requests whose client went away before the request body was received,
+# as nginx does. It is never sent, the client connection is closed instead.
+CLIENT_CLOSED_REQUEST = 499
+
+# Content types streamed by the inference servers, relayed as soon as any data arrived
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+
+RequestBody = Union[bytes, Iterator[bytes], None]
+
+
+class ClientDisconnectedError(ConnectionError):
+    """Raised when a request body streamed upstream can't be read from the client any more."""
+
+
+def iter_body(rfile: io.BufferedIOBase, length: int) -> Iterator[bytes]:
+    remaining = length
+    while remaining > 0:
+        block = rfile.read(min(remaining, RELAY_BLOCK_SIZE))
+        if not block:
+            raise ConnectionError(f"Client closed connection with {remaining} bytes of the request body missing")
+        remaining -= len(block)
+        yield block
+
+
+def iter_chunked_body(rfile: io.BufferedIOBase) -> Iterator[bytes]:
+    """Decodes a request body sent with chunked transfer encoding."""
+    while True:
+        size_line = rfile.readline(1024)
+        if not size_line:
+            raise ConnectionError("Client closed connection within a chunked request body")
+        size = int(size_line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            break
+        yield from iter_body(rfile, size)
+        rfile.readline(1024)
+
+    # skip the trailer section up to the terminating empty line
+    while rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+        pass
+
+
+def client_body(blocks: Iterator[bytes]) -> Iterator[bytes]:
+    """Reports failures to read a streamed request body as ClientDisconnectedError, so they can
+    be told apart from failures of the upstream connection the body is written to."""
+    try:
+        yield from blocks
+    except (OSError, ValueError) as e:
+        raise ClientDisconnectedError(f"Failed to read the request body from the client: {e}") from e
+
+
+def read_request_body(handler: http.server.BaseHTTPRequestHandler, max_buffered: int = RELAY_BLOCK_SIZE) -> RequestBody:
+    """Returns the request body to forward upstream. Bodies up to max_buffered are read at once,
+    larger and chunked ones are streamed upstream as they arrive."""
+    if "chunked" in handler.headers.get("Transfer-Encoding", "").lower():
+        # http.client encodes an iterable body without a Content-Length with chunked encoding
+        return client_body(iter_chunked_body(handler.rfile))
+
+    length = int(handler.headers.get("Content-Length", 0))
+    if length == 0:
+        return None if "Content-Length" not in handler.headers else b""
+    if length <= max_buffered:
+        body = handler.rfile.read(length)
+        if len(body) < length:
+            raise ClientDisconnectedError("Client closed connection within the request body")
+        return body
+    return client_body(iter_body(handler.rfile, length))
+
+
+def _has_body(method: str, status: int) -> bool:
+    return method != "HEAD" and status >= 200 and status not in (204, 304)
+
+
+def relay_response(
+    handler: http.server.BaseHTTPRequestHandler,
+    response: http.client.HTTPResponse,
+    timer: Optional[RequestTimer] = None,
+    recorder: Optional[ResponseRecorder] = None,
+) -> bool:
+    """Relays the upstream response to the client in blocks without buffering it completely.
+
+    A response without a Content-Length is sent with chunked transfer encoding to HTTP/1.1 clients.
+    Returns whether the end of the response is delimited, so the client connection can be kept alive.
+    """
+    has_body = _has_body(handler.command, response.status)
+    has_length = response.getheader("Content-Length") is not None
+    chunked = has_body and not has_length and handler.request_version != "HTTP/1.0"
+
+    headers = [(key, value) for key, value in response.getheaders() if key.lower() not in HOP_BY_HOP_HEADERS]
+    if recorder is not None:
+        recorder.start(response.status, response.reason, headers)
+
+    handler.send_response(response.status)
+    for key, value in headers:
+        handler.send_header(key, value)
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    handler.end_headers()
+
+    if has_body:
+        content_type = response.getheader("Content-Type", "")
+        if content_type.startswith(STREAMING_CONTENT_TYPES):
+            # forward events right away instead of waiting for a block to fill up
+            blocks = iter(lambda: response.read1(RELAY_BLOCK_SIZE), b"")
+        else:
+            blocks = iter(lambda: response.read(RELAY_BLOCK_SIZE), b"")
+
+        for block in blocks:
+            if timer is not None:
+                timer.block_received(block)
+            if recorder is not None:
+                recorder.write(block)
+            if chunked:
+                handler.wfile.write(b"%x\r\n%b\r\n" % (len(block), block))
+            else:
+                handler.wfile.write(block)
+            handler.wfile.flush()
+        if chunked:
+            handler.wfile.write(b"0\r\n\r\n")
+    handler.wfile.flush()
+
+    return not has_body or has_length or chunked
+
+
+def replay_response(
+    handler: http.server.BaseHTTPRequestHandler, cached: CachedResponse, cache_hit: bool = True
+) -> bool:
+    """Sends a cached or otherwise complete response like relay_response, with the events of a
+    streamed response in chunks of their own. Returns whether the end of the response is delimited."""
+    has_body = _has_body(handler.command, cached.status)
+    chunked = has_body and not cached.has_length and handler.request_version != "HTTP/1.0"
+
+    handler.send_response(cached.status)
+    for key, value in cached.headers:
+        handler.send_header(key, value)
+    if cache_hit:
+        handler.send_header("X-Ramalama-Cache", "hit")
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    handler.end_headers()
+
+    if has_body:
+        for block in cached.blocks():
+            handler.wfile.write(b"%x\r\n%b\r\n" % (len(block), block) if chunked else block)
+        if chunked:
+            handler.wfile.write(b"0\r\n\r\n")
+    handler.wfile.flush()
+
+    return not has_body or cached.has_length or chunked
+
+
+def forwarded_headers(headers: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Returns the request headers to forward upstream. 100-continue is answered by the daemon."""
+    return [(key, value) for key, value in headers if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != "expect"]
+
+
+def send_retry_response(handler: http.server.SimpleHTTPRequestHandler, status: int, msg: str, retry_after: int):
+    """Rejects a request without reading its body, so the client connection is closed."""
+    handler.send_response(status, msg)
+    handler.send_header("Retry-After", str(retry_after))
+    handler.send_header("Content-Length", "0")
+    handler.send_header("Connection", "close")
+    handler.end_headers()
+    handler.close_connection = True
+
+
+def quickack(sock: Optional[socket.socket]) -> None:
+    # Servers commonly write the response headers and body separately. On a kept-alive connection
+    # Nagle's algorithm on their side then waits for our delayed ACK of the headers, which adds
+    # up to 40ms to every response. Quick ACK mode is reset by the kernel, so it is set per request.
+    if sock is not None and hasattr(socket, "TCP_QUICKACK"):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        except OSError:
+            pass
+
+
+def prefix_affinity(request: Optional[dict], length: int) -> Optional[int]:
+    """Returns the hash of the prompt prefix of a completion request, if it has a prompt."""
+    if request is None or length <= 0:
+        return None
+    prefix = prompt_prefix(request, length)
+    return prefix_hash(prefix) if prefix is not None else None
+
+
+class ProxyError(Exception):
+    """Raised when a proxied request fails before a response has been relayed. The client gets an
+    error response, with a Retry-After header if retry_after is set, and the connection is closed."""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class ProxiedRequest:
+    """The steps of proxying a request to a model server which don't depend on how the client is
+    served: resolving the route, choosing the replica, looking up the response cache, coalescing
+    embeddings, admission and the metrics. The threaded and the asyncio server read the request
+    and send the response, and call these steps in between.
+
+    The request is reserved on the replica it is routed to until it is closed, so the replica
+    isn't stopped, e.g. by a swap, while the request is still being received.
+    """
+
+    def __init__(self, model_runner: ModelRunner, method: str, path: str, referer: Optional[str], client: str):
+        self.model_runner = model_runner
+        self.method = method
+        self.path = path
+        self.client = client
+        self.proxy_path, self.forward_path = ModelProxyHandler.resolve_proxy_path(path, referer)
+
+        model = model_runner.get_served_model(self.proxy_path, reserve=True)
+        if model is None:
+            raise ProxyError(404, f"No model for path '{self.proxy_path}' found")
+        self.model: ManagedModel = model
+
+        self.payload: Optional[dict] = None
+        self.affinity: Optional[int] = None
+        self.cache_key: Optional[str] = None
+        self.timer: Optional[RequestTimer] = None
+        self._closed = False
+
+    def __enter__(self) -> "ProxiedRequest":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.model.release()
+
+    @property
+    def max_buffered_body(self) -> int:
+        """Size up to which the request body is read at once. POST bodies are inspected for
+        caching and routing, the others are streamed upstream right away."""
+        return MAX_INSPECTED_BODY_SIZE if self.method == "POST" else RELAY_BLOCK_SIZE
+
+    def route(self, body: object, authorization: Optional[str] = None) -> RequestTimer:
+        """Chooses the replica for the request body and starts timing the request. Responses
+        are only cached per credentials of the Authorization header."""
+        self.payload = parse_json_request(body) if self.method == "POST" else None
+        # requests sharing a prompt prefix go to the replica which has it cached
+        self.affinity = prefix_affinity(self.payload, self.model_runner.prefix_affinity_chars)
+        if self.affinity is not None:
+            replica = self.model_runner.get_served_model(self.proxy_path, self.affinity, reserve=True)
+            if replica is not None:
+                self.model.release()
+                self.model = replica
+        self.model.update_expiration_date()
+
+        if self.model_runner.response_cache is not None:
+            self.cache_key = response_cache_key(
+                self.model.digest, self.method, self.forward_path or "/", self.payload, authorization
+            )
+        self.timer = RequestTimer(
+            self.model_runner.metrics,
+            self.model.name,
+            self.model_runner.access_log,
+            (self.client, self.method, self.path),
+        )
+        return self.timer
+
+    def not_ready(self) -> ProxyError:
+        assert self.timer is not None
+        self.timer.finish(503)
+        return ProxyError(
+            503,
+            f"Model for path '{self.proxy_path}' is {self.model.state}, not ready to receive requests",
+            READY_RETRY_AFTER,
+        )
+
+    def cached_response(self) -> Optional[CachedResponse]:
+        """Returns the cached response of the request, if any. Might read it from disk."""
+        cache = self.model_runner.response_cache
+        if cache is None or self.cache_key is None:
+            return None
+        assert self.timer is not None
+        cached = cache.get(self.cache_key)
+        self.timer.cache_lookup(cached is not None)
+        if cached is not None:
+            logger.debug(f"Replaying cached response of -X {self.method} {self.forward_path}")
+            self.timer.block_received(cached.body)
+        return cached
+
+    def coalesce_embeddings(self, headers: list[tuple[str, str]]) -> Optional[Future[Optional[CachedResponse]]]:
+        """Submits an embeddings request to be sent upstream together with the ones of other
+        clients. Without a response the batch failed, and the request is sent on its own."""
+        coalescer = self.model.embedding_coalescer
+        if coalescer is None or self.payload is None or self.forward_path not in EMBEDDING_PATHS:
+            return None
+        inputs = embedding_inputs(self.payload)
+        if inputs is None:
+            return None
+        return coalescer.submit(self.forward_path, self.payload, inputs, dict(headers), self.client)
+
+    def coalesced(self, batched: CachedResponse):
+        assert self.timer is not None
+        self.timer.block_received(batched.body)
+
+    def hinted_body(self) -> AbstractContextManager[Optional[bytes]]:
+        return hinted_body(self.model, self.payload, self.affinity)
+
+    def rejected(self, e: Union[QueueFullError, QueueTimeoutError]) -> ProxyError:
+        assert self.timer is not None
+        if isinstance(e, QueueFullError):
+            self.timer.finish(429)
+            return ProxyError(429, f"Too many requests for the model of path '{self.proxy_path}': {e}", e.retry_after)
+        self.timer.finish(503)
+        return ProxyError(503, f"Model for path '{self.proxy_path}' is busy: {e}", READY_RETRY_AFTER)
+
+    def upstream_failed(self, e: Exception) -> ProxyError:
+        assert self.timer is not None
+        self.timer.upstream_failed()
+        self.timer.finish(502)
+        return ProxyError(502, f"Failed to forward request to the model server of '{self.model.name}': {e}")
+
+    def client_disconnected(self, e: ClientDisconnectedError):
+        """The client went away while its request body was sent upstream. The model server is
+        not at fault, so no upstream error is recorded."""
+        assert self.timer is not None
+        self.timer.finish(CLIENT_CLOSED_REQUEST)
+        logger.debug(f"Client {self.client} closed the connection of -X {self.method} {self.path}: {e}")
+
+    def response_recorder(self) -> Optional[ResponseRecorder]:
+        cache = self.model_runner.response_cache
+        if cache is None or self.cache_key is None:
+            return None
+        return ResponseRecorder(cache.max_entry_size)
+
+    def store_response(self, recorder: ResponseRecorder):
+        """Caches the recorded response, if it is complete. Might write it to disk."""
+        cache = self.model_runner.response_cache
+        cached = recorder.response()
+        if cache is not None and self.cache_key is not None and cached is not None:
+            cache.put(self.cache_key, cached)
+
+    def finish(self, status: int):
+        assert self.timer is not None
+        self.timer.finish(status)
+
 
 class ModelProxyHandler(APIHandler):
     PATH_PREFIX = "/model"
@@ -22,6 +409,15 @@ class ModelProxyHandler(APIHandler):
     def build_proxy_path(model: CLASS_MODEL_TYPES) -> str:
         return f"{ModelProxyHandler.PATH_PREFIX}/{model.model_organization}/{model.model_name}"
 
+    @staticmethod
+    def resolve_proxy_path(path: str, referer: Optional[str] = None) -> tuple[str, str]:
+        """Returns the proxy path of the served model and the path to forward to its server.
+        Requests referred by a page of the model server are resolved relative to the referer."""
+        if referer is not None:
+            proxy_path = urllib.parse.urlparse(referer).path
+            return proxy_path, path.replace("/".join(proxy_path.split("/")[:-1]), "", 1)
+        return path, ""
+
     def handle_get(self, handler: http.server.SimpleHTTPRequestHandler, is_referred: bool = False):
         if handler.path == f"{ModelProxyHandler.PATH_PREFIX}":
             self._handle_get_running_models(handler)
@@ -44,8 +440,7 @@ class ModelProxyHandler(APIHandler):
 
     def _forward_request(self, handler: http.server.SimpleHTTPRequestHandler, is_referred: bool = False):
 
-        forward_path = ""
-        proxy_path = ""
+        referer = None
         if is_referred:
             logger.debug("request is referred")
             if "Referer" not in handler.headers:
@@ -53,54 +448,121 @@ class ModelProxyHandler(APIHandler):
                 logger.error(msg)
                 handler.send_error(500, msg)
                 return
-            proxy_path = urllib.parse.urlparse(handler.headers["Referer"]).path
-            forward_path = handler.path.replace("/".join(proxy_path.split("/")[:-1]), "", 1)
+            referer = handler.headers["Referer"]
         else:
             logger.debug("request is not referred")
-            proxy_path = handler.path
-            forward_path = handler.path.replace(proxy_path, "", 1)
 
-        model = self.model_runner.served_models.get(proxy_path, None)
-        if model is None:
-            msg = f"No model for path '{proxy_path}' found"
-            logger.error(msg)
-            handler.send_error(404, msg)
+        client = handler.client_address[0] if handler.client_address else ""
+        try:
+            with ProxiedRequest(self.model_runner, handler.command, handler.path, referer, client) as proxied:
+                self._proxy(handler, proxied)
+        except ClientDisconnectedError:
+            handler.close_connection = True
+        except ProxyError as e:
+            logger.error(e.message)
+            if e.retry_after is not None:
+                send_retry_response(handler, e.status, e.message, e.retry_after)
+            else:
+                handler.send_error(e.status, e.message)
+
+    def _proxy(self, handler: http.server.SimpleHTTPRequestHandler, proxied: ProxiedRequest):
+        body = read_request_body(handler, proxied.max_buffered_body)
+        timer = proxied.route(body, handler.headers.get("Authorization"))
+        model = proxied.model
+        # requests for a model which is still loading are held back until it is ready
+        if not model.wait_until_ready(STARTING_MODEL_WAIT_TIMEOUT):
+            raise proxied.not_ready()
+
+        cached = proxied.cached_response()
+        if cached is not None:
+            self._replay(handler, proxied, cached)
             return
-        model.update_expiration_date()
-
-        target_url = f"http://127.0.0.1:{model.port}{forward_path}"
-        method = handler.command
-        headers = handler.headers
-        data = None
-
-        if 'Content-Length' in headers:
-            length = int(headers['Content-Length'])
-            data = handler.rfile.read(length)
-
-        logger.debug(f"Forwarding request -X {method} {target_url}\nHEADER: {headers} \nDATA: {data!r}")
-
-        request = urllib.request.Request(target_url, data=data, headers=dict(headers), method=method)
-        with urllib.request.urlopen(request) as response:
-            handler.send_response(response.status)
-
-            hop_by_hop_headers = [
-                'connection',
-                'keep-alive',
-                'proxy-authenticate',
-                'proxy-authorization',
-                'te',
-                'trailers',
-                'transfer-encoding',
-                'upgrade',
-            ]
-            for key, value in response.getheaders():
-                if key.lower() in hop_by_hop_headers:
-                    continue
-                handler.send_header(key, value)
-
-            handler.end_headers()
-            for line in response:
-                handler.wfile.write(line)
-            handler.wfile.flush()
 
-            logger.debug(f"Received response from -X {method} {target_url}\nRESPONSE: ")
+        # embeddings requests of the clients are sent upstream together
+        headers = forwarded_headers(handler.headers.items())
+        coalesced = proxied.coalesce_embeddings(headers)
+        batched = coalesced.result() if coalesced is not None else None
+        if batched is not None:
+            proxied.coalesced(batched)
+            self._replay(handler, proxied, batched, cache_hit=False)
+            return
+
+        try:
+            with model.admit(proxied.client) as waited, proxied.hinted_body() as hinted:
+                timer.admitted(waited)
+                self._relay(handler, proxied, dict(headers), body if hinted is None else hinted)
+        except (QueueFullError, QueueTimeoutError) as e:
+            raise proxied.rejected(e) from e
+
+    @staticmethod
+    def _replay(
+        handler: http.server.SimpleHTTPRequestHandler,
+        proxied: ProxiedRequest,
+        response: CachedResponse,
+        cache_hit: bool = True,
+    ):
+        delimited = replay_response(handler, response, cache_hit)
+        handler.close_connection = not (delimited and getattr(handler, "client_keep_alive", False))
+        proxied.finish(response.status)
+
+    def _relay(
+        self,
+        handler: http.server.SimpleHTTPRequestHandler,
+        proxied: ProxiedRequest,
+        headers: dict[str, str],
+        body: RequestBody,
+    ):
+        model, method, forward_path = proxied.model, handler.command, proxied.forward_path
+        if isinstance(body, bytes):
+            # the body might have been rewritten with hints for the model server
+            headers = {key: value for key, value in headers.items() if key.lower() != "content-length"}
+            headers["Content-Length"] = str(len(body))
+        recorder = proxied.response_recorder()
+
+        logger.debug(f"Forwarding request -X {method} {forward_path} to port {model.port}\nHEADER: {headers}")
+
+        with model.track_request():
+            try:
+                conn, response = self._send_upstream(model.connection_pool, method, forward_path or "/", body, headers)
+            except ClientDisconnectedError as e:
+                proxied.client_disconnected(e)
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                raise proxied.upstream_failed(e) from e
+
+            reusable = False
+            try:
+                delimited = relay_response(handler, response, proxied.timer, recorder)
+                # the connection can only be reused once the response has been consumed completely
+                reusable = not response.will_close
+                handler.close_connection = not (delimited and getattr(handler, "client_keep_alive", False))
+                logger.debug(f"Received response from -X {method} {forward_path} on port {model.port}")
+            finally:
+                response.close()
+                model.connection_pool.release(conn, reusable)
+                proxied.finish(response.status)
+
+        if recorder is not None:
+            proxied.store_response(recorder)
+
+    @staticmethod
+    def _send_upstream(
+        pool: UpstreamConnectionPool, method: str, path: str, body: RequestBody, headers: dict[str, str]
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        conn, reused = pool.acquire()
+        while True:
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                quickack(conn.sock)
+                return conn, conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                # a streamed body has been consumed already and can't be sent again
+                if not reused or not (body is None or isinstance(body, bytes)):
+                    raise
+                # The server closed the pooled connection right when it was reused, so the
+                # request has not been processed and is retried once on a new connection
+                conn, reused = pool.connect(), False
+            except Exception:
+                conn.close()
+                raise
@@ -3,14 +3,19 @@ from __future__ import annotations
 import http.server
 import traceback
 import urllib.error
+from typing import Callable
 
 from ramalama.daemon.handler.daemon import DaemonAPIHandler
+from ramalama.daemon.handler.metrics import MetricsHandler
 from ramalama.daemon.handler.proxy import ModelProxyHandler
 from ramalama.daemon.logging import logger
 from ramalama.daemon.service.model_runner import ModelRunner
 
 
 class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 is required to relay responses of unknown length with chunked transfer encoding
+    protocol_version = "HTTP/1.1"
+
     def __init__(self, model_store_path: str, model_runner: ModelRunner, request, client_address, server):
         self.request = request
         self.client_address = client_address
@@ -18,10 +23,17 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
 
         self.model_store_path = model_store_path
         self.model_runner = model_runner
+        self.client_keep_alive = False
 
         self.setup()
         try:
-            self.handle()
+            self.handle_safely(self.handle)
+        finally:
+            self.finish()
+
+    def handle_safely(self, handle: Callable[[], None]):
+        try:
+            handle()
         except urllib.error.HTTPError as e:
             self.send_error(e.code, e.reason)
             logger.error(f"Error handling request: {e}")
@@ -30,8 +42,16 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(500, f"Internal Server Error: {e}")
             logger.error(f"Error handling request: {e}")
             logger.debug(f"{traceback.format_exc()}")
-        finally:
-            self.finish()
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+
+        # Responses of the daemon API are delimited by closing the connection, only proxied
+        # responses with a known length or chunked encoding keep it alive if the client wants to
+        self.client_keep_alive = not self.close_connection
+        self.close_connection = True
+        return True
 
     def do_GET(self):
         logger.debug(f"Handling GET request for path: {self.path}")
@@ -45,6 +65,10 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             DaemonAPIHandler(self.model_runner, self.model_store_path).handle_get(self)
             return
 
+        if self.path == MetricsHandler.PATH_PREFIX and referer is None:
+            MetricsHandler(self.model_runner).handle_get(self)
+            return
+
         is_referred = referer is not None
         if self.path.startswith(ModelProxyHandler.PATH_PREFIX) or is_referred:
             ModelProxyHandler(self.model_runner).handle_get(self, is_referred)
@@ -61,9 +85,14 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             DaemonAPIHandler(self.model_runner, self.model_store_path).handle_head(self)
             return
 
+        if self.path == MetricsHandler.PATH_PREFIX and referer is None:
+            MetricsHandler(self.model_runner).handle_head(self)
+            return
+
         is_referred = referer is not None
         if self.path.startswith(ModelProxyHandler.PATH_PREFIX) or is_referred:
             ModelProxyHandler(self.model_runner).handle_head(self, is_referred)
+            return
 
         self.send_response(200)
         self.send_header("Content-Type", "text/plain")
@@ -82,6 +111,10 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             DaemonAPIHandler(self.model_runner, self.model_store_path).handle_post(self)
             return
 
+        if self.path == MetricsHandler.PATH_PREFIX and referer is None:
+            MetricsHandler(self.model_runner).handle_post(self)
+            return
+
         is_referred = referer is not None
         if self.path.startswith(ModelProxyHandler.PATH_PREFIX) or is_referred:
             ModelProxyHandler(self.model_runner).handle_post(self, is_referred)
@@ -98,6 +131,10 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             DaemonAPIHandler(self.model_runner, self.model_store_path).handle_put(self)
             return
 
+        if self.path == MetricsHandler.PATH_PREFIX and referer is None:
+            MetricsHandler(self.model_runner).handle_put(self)
+            return
+
         is_referred = referer is not None
         if self.path.startswith(ModelProxyHandler.PATH_PREFIX) or is_referred:
             ModelProxyHandler(self.model_runner).handle_put(self, is_referred)
@@ -114,6 +151,10 @@ class RamalamaHandler(http.server.SimpleHTTPRequestHandler):
             DaemonAPIHandler(self.model_runner, self.model_store_path).handle_delete(self)
             return
 
+        if self.path == MetricsHandler.PATH_PREFIX and referer is None:
+            MetricsHandler(self.model_runner).handle_delete(self)
+            return
+
         is_referred = referer is not None
         if self.path.startswith(ModelProxyHandler.PATH_PREFIX) or is_referred:
             ModelProxyHandler(self.model_runner).handle_delete(self, is_referred)
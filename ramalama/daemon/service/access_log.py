@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, BinaryIO, Optional
+
+from ramalama.daemon.logging import logger
+
+if TYPE_CHECKING:
+    from ramalama.config import DaemonConfig
+
+MiB = 1024 * 1024
+
+# Entries waiting to be written at most, further ones are dropped instead of blocking requests
+ACCESS_LOG_QUEUE_SIZE = 10000
+
+# Trailing bytes of a response body kept to find the token counts of the final event in
+RESPONSE_TAIL_SIZE = 4096
+
+# Token counts of OpenAI compatible responses and of the native llama-server endpoints
+_TOKEN_FIELDS = {
+    "prompt_tokens": re.compile(rb'"(?:prompt_tokens|tokens_evaluated)"\s*:\s*(\d+)'),
+    "completion_tokens": re.compile(rb'"(?:completion_tokens|tokens_predicted)"\s*:\s*(\d+)'),
+}
+
+
+def token_counts(tail: bytes) -> dict[str, int]:
+    """Returns the token counts reported at the end of a response body. The usage of a streamed
+    response is part of its final event, so the last counts found are the ones of the response."""
+    counts = {}
+    for field, pattern in _TOKEN_FIELDS.items():
+        matches = pattern.findall(tail)
+        if matches:
+            counts[field] = int(matches[-1])
+    return counts
+
+
+@dataclass
+class AccessRecord:
+    # seconds since the epoch the request was received at
+    time: float
+    client: str
+    method: str
+    path: str
+    model: str
+    status: int
+    # bytes of the response body
+    size: int
+    # seconds until the first byte of the response, and until the whole of it, was received
+    ttfb: float
+    duration: float
+    queue_wait: float
+    # the end of the response body, parsed for the token counts by the writer
+    tail: bytes = b""
+
+    def to_dict(self) -> dict:
+        entry = {
+            "time": datetime.fromtimestamp(self.time, timezone.utc).isoformat(timespec="milliseconds"),
+            "client": self.client,
+            "method": self.method,
+            "path": self.path,
+            "model": self.model,
+            "status": self.status,
+            "bytes": self.size,
+            "ttfb_ms": round(self.ttfb * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "queue_ms": round(self.queue_wait * 1000, 3),
+        }
+        entry.update(token_counts(self.tail))
+        return entry
+
+
+class AccessLog:
+    """Writes an entry per proxied request to a file of JSON lines.
+
+    Requests only put their record into a bounded queue, a background thread formats and writes
+    them, so a slow disk never delays a response. When the queue is full, records are dropped.
+    The file is rotated once it exceeds max_bytes, keeping up to backups rotated files with the
+    suffixes .1 to .N, the highest one being the oldest.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int, queue_size: int = ACCESS_LOG_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._queue: queue.Queue[Optional[AccessRecord]] = queue.Queue(queue_size)
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Writes the queued records and closes the file."""
+        if self._thread is None:
+            return
+        # the sentinel waits for a free place, the writer is draining the queue
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def log(self, record: AccessRecord) -> bool:
+        """Queues the record to be written. Returns False if it was dropped since the queue is full."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                try:
+                    self._write(json.dumps(record.to_dict(), separators=(",", ":")) + "\n")
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to write the access log to {self.path}: {e}")
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, line: str):
+        data = line.encode("utf-8")
+        if self._file is None:
+            self._open()
+        if self._size > 0 and self._size + len(data) > self.max_bytes:
+            self._rotate()
+            self._open()
+        assert self._file is not None
+        self._file.write(data)
+        self._size += len(data)
+        # flushed while there is nothing else to write, so entries show up right away when idle
+        if self._queue.empty():
+            self._file.flush()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        assert self._file is not None
+        self._file.close()
+        self._file = None
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+def create_access_log(config: DaemonConfig) -> Optional[AccessLog]:
+    if not config.access_log:
+        return None
+    return AccessLog(config.access_log, config.access_log_max_size_mb * MiB, config.access_log_backups)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+# Seconds a queued request waits for a free slot before it is rejected
+QUEUE_WAIT_TIMEOUT = 300
+
+# Weight of the latest request in the moving average of the time a slot is held
+HOLD_TIME_SMOOTHING = 0.2
+
+
+def parallel_slots(cmd: list[str]) -> Optional[int]:
+    """Returns the number of parallel slots set in the command of a llama-server, if any."""
+    slots = None
+    for i, arg in enumerate(cmd):
+        value = None
+        if arg in ("--parallel", "-np") and i + 1 < len(cmd):
+            value = cmd[i + 1]
+        elif arg.startswith("--parallel="):
+            value = arg.split("=", 1)[1]
+        if value is not None:
+            try:
+                slots = int(value)
+            except ValueError:
+                pass
+    return slots if slots is not None and slots > 0 else None
+
+
+@asynccontextmanager
+async def admit_unlimited() -> AsyncIterator[float]:
+    yield 0.0
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a request can't be admitted since the queue of waiting requests is full."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueTimeoutError(RuntimeError):
+    """Raised when a queued request didn't get a free slot in time."""
+
+
+class _Waiter:
+    __slots__ = ("client", "grant", "granted")
+
+    def __init__(self, client: str, grant: Callable[[], None]):
+        self.client = client
+        self.grant = grant
+        self.granted = False
+
+
+def _grant(future: asyncio.Future[None]):
+    # a request which timed out or was cancelled has stopped waiting already
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """Limits the number of requests a model server processes at the same time.
+
+    Requests exceeding the limit wait in a bounded queue with a FIFO queue per client. Free
+    slots are handed out round-robin between the clients, so a client sending many requests
+    at once doesn't delay the requests of the others. Slots are granted by callbacks, which
+    lets threads and coroutines of the asyncio server wait for the same model.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+
+        self._active = 0
+        self._queued = 0
+        # waiting requests by client, in the order the clients are served
+        self._queues: dict[str, deque[_Waiter]] = {}
+        self._hold_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        """Estimates the seconds until a request sent now could be admitted."""
+        return max(1, math.ceil(self._hold_time * (self._queued + 1) / self.max_concurrent))
+
+    def _enqueue(self, client: str, grant: Callable[[], None]) -> Optional[_Waiter]:
+        """Takes a free slot and returns None, or queues the request until grant is called."""
+        with self._lock:
+            if self._active < self.max_concurrent and self._queued == 0:
+                self._active += 1
+                return None
+            if self._queued >= self.max_queued:
+                raise QueueFullError(f"{self._queued} requests are waiting for the model already", self.retry_after())
+            waiter = _Waiter(client, grant)
+            self._queues.setdefault(client, deque()).append(waiter)
+            self._queued += 1
+            return waiter
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """Removes a waiting request from the queue. Returns False if it has been granted a
+        slot in the meantime, which the caller has to use or release."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.client]
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.client]
+            self._queued -= 1
+            return True
+
+    def _release(self, hold_time: Optional[float] = None):
+        with self._lock:
+            if hold_time is not None:
+                self._hold_time += HOLD_TIME_SMOOTHING * (hold_time - self._hold_time)
+            if not self._queues:
+                self._active -= 1
+                return
+            # the slot passes to the next client in turn, which moves to the end of the round
+            client = next(iter(self._queues))
+            queue = self._queues.pop(client)
+            waiter = queue.popleft()
+            if queue:
+                self._queues[client] = queue
+            self._queued -= 1
+            waiter.granted = True
+        waiter.grant()
+
+    @contextmanager
+    def admit(self, client: str, timeout: float = QUEUE_WAIT_TIMEOUT) -> Iterator[float]:
+        """Holds a slot for the duration of a request, yielding the seconds it waited for it."""
+        start = time.monotonic()
+        granted = threading.Event()
+        waiter = self._enqueue(client, granted.set)
+        if waiter is not None and not granted.wait(timeout) and self._cancel(waiter):
+            raise QueueTimeoutError(f"Request waited more than {timeout}s for a free slot")
+
+        admitted = time.monotonic()
+        try:
+            yield admitted - start
+        finally:
+            self._release(time.monotonic() - admitted)
+
+    @asynccontextmanager
+    async def admit_async(self, client: str, timeout: float = QUEUE_WAIT_TIMEOUT) -> AsyncIterator[float]:
+        """Like admit, but waits for a slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(_grant, granted)
+
+        waiter = self._enqueue(client, grant)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), timeout)
+            except asyncio.TimeoutError:
+                if self._cancel(waiter):
+                    raise QueueTimeoutError(f"Request waited more than {timeout}s for a free slot") from None
+            except asyncio.CancelledError:
+                if not self._cancel(waiter):
+                    # the slot was granted right when the request was cancelled
+                    self._release()
+                raise
+
+        admitted = loop.time()
+        try:
+            yield admitted - start
+        finally:
+            self._release(loop.time() - admitted)
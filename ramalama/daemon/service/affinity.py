@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+if TYPE_CHECKING:
+    from ramalama.daemon.service.model_runner import ManagedModel
+
+# Characters of the prompt hashed to route requests sharing it to the same replica and slot
+PREFIX_AFFINITY_CHARS = 1024
+
+# Roles of the leading messages of a chat which make up its shared prefix
+PREFIX_ROLES = ("system", "developer")
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # content parts of the OpenAI API, images don't contribute to the prefix
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def prompt_prefix(request: dict, length: int = PREFIX_AFFINITY_CHARS) -> Optional[str]:
+    """Returns the leading characters of the prompt of a completion request, or None if it has none.
+
+    The chat template isn't known to the daemon, so chats are rendered by concatenating the roles
+    and contents of their leading system messages, or of their first message if there are none.
+    Requests sharing their system prompt then share their prefix, whatever the user asks.
+    """
+    prompt = request.get("prompt")
+    if isinstance(prompt, str):
+        text = prompt
+    elif isinstance(prompt, list) and prompt:
+        # tokens or a batch of prompts
+        text = json.dumps(prompt[0] if isinstance(prompt[0], (str, list)) else prompt)
+    elif isinstance(request.get("messages"), list) and request["messages"]:
+        messages = [m for m in request["messages"] if isinstance(m, dict)]
+        leading = []
+        for message in messages:
+            if message.get("role") not in PREFIX_ROLES:
+                break
+            leading.append(message)
+        text = "".join(f"<{m.get('role')}>{_content_text(m.get('content'))}" for m in (leading or messages[:1]))
+    else:
+        return None
+    return text[:length] if text else None
+
+
+def prefix_hash(prefix: str) -> int:
+    return int.from_bytes(hashlib.blake2b(prefix.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def preferred_replica(affinity: int, replicas: list[ManagedModel]) -> ManagedModel:
+    """Picks the replica for a prefix by rendezvous hashing, so only the prefixes of a replica
+    which is added or removed move to another one."""
+
+    def weight(model: ManagedModel) -> int:
+        return prefix_hash(f"{affinity}:{model.replica}")
+
+    return max(replicas, key=weight)
+
+
+def add_slot_hints(request: dict, slot: Optional[int]) -> dict:
+    """Asks llama-server to keep the prompt cached, in the slot of its prefix if one is given.
+    Hints set by the client are left as they are."""
+    request.setdefault("cache_prompt", True)
+    if slot is not None:
+        request.setdefault("id_slot", slot)
+    return request
+
+
+class SlotTracker:
+    """Tracks the slots of a llama-server which requests have been pinned to.
+
+    A request pinned to a slot waits for it even when other slots are free, so a request is
+    only pinned to the slot of its prefix while no other request is. Otherwise llama-server
+    picks the idle slot with the most similar cached prompt itself.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._busy: set[int] = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def claim(self, affinity: int) -> Iterator[Optional[int]]:
+        slot = affinity % self.slots
+        with self._lock:
+            claimed = slot not in self._busy
+            if claimed:
+                self._busy.add(slot)
+        try:
+            yield slot if claimed else None
+        finally:
+            if claimed:
+                with self._lock:
+                    self._busy.discard(slot)
+
+
+@contextmanager
+def hinted_body(model: ManagedModel, request: Optional[dict], affinity: Optional[int]) -> Iterator[Optional[bytes]]:
+    """Yields the body of a request to forward with slot hints for llama-server, or None if the
+    body is forwarded as it is. The slot of the prefix stays claimed until the context exits."""
+    if request is None or affinity is None or not model.slot_hints:
+        yield None
+        return
+    with model.claim_slot(affinity) as slot:
+        yield json.dumps(add_slot_hints(dict(request), slot)).encode("utf-8")
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import http.client
+import json
+import threading
+from concurrent.futures import Future, InvalidStateError
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.response_cache import CachedResponse
+
+if TYPE_CHECKING:
+    from ramalama.daemon.service.model_runner import ManagedModel
+
+# Paths of the OpenAI compatible embeddings endpoint of the model servers
+EMBEDDING_PATHS = ("/v1/embeddings", "/embeddings")
+
+# Inputs of the clients sent upstream in a single embeddings request at most
+MAX_BATCH_INPUTS = 64
+
+# Request headers which have to match for requests to be coalesced, since the model server acts on them
+KEY_HEADERS = ("authorization", "content-type")
+
+# Response headers replaced for every client, whose response has a body of its own
+REPLACED_HEADERS = frozenset(["content-length", "connection", "keep-alive", "transfer-encoding"])
+
+
+def _is_tokens(value: Any) -> bool:
+    return (
+        isinstance(value, list) and bool(value) and all(isinstance(t, int) and not isinstance(t, bool) for t in value)
+    )
+
+
+def embedding_inputs(request: Optional[dict]) -> Optional[list]:
+    """Returns the inputs of an embeddings request, a text or tokens or a list of them, or None
+    if it has none which can be batched with other requests."""
+    value = request.get("input") if request is not None else None
+    if isinstance(value, str) or _is_tokens(value):
+        return [value]
+    if isinstance(value, list) and value and all(isinstance(v, str) or _is_tokens(v) for v in value):
+        return value
+    return None
+
+
+def batch_key(path: str, request: dict, headers: dict[str, str]) -> str:
+    """Requests are coalesced if they only differ in their inputs."""
+    fields = {key: value for key, value in request.items() if key != "input"}
+    relevant = sorted((key.lower(), value) for key, value in headers.items() if key.lower() in KEY_HEADERS)
+    return json.dumps([path, fields, relevant], sort_keys=True, separators=(",", ":"))
+
+
+def split_embeddings(response: dict, counts: list[int], sizes: list[int]) -> list[dict]:
+    """Splits the response to a batch into the responses to the requests it coalesced, which
+    contributed counts inputs of sizes each. The tokens used by the batch are apportioned by the
+    size of the inputs of a request, since the model server only reports their total."""
+    data = sorted(response["data"], key=lambda item: item["index"])
+    if len(data) != sum(counts):
+        raise ValueError(f"Expected {sum(counts)} embeddings, got {len(data)}")
+
+    usage = response.get("usage")
+    total_size = sum(sizes) or 1
+    responses = []
+    start = 0
+    for count, size in zip(counts, sizes):
+        part = dict(response)
+        part["data"] = [{**item, "index": i} for i, item in enumerate(data[start : start + count])]
+        if isinstance(usage, dict):
+            part["usage"] = {
+                key: round(value * size / total_size) if isinstance(value, int) else value
+                for key, value in usage.items()
+            }
+        responses.append(part)
+        start += count
+    return responses
+
+
+def _size(inputs: list) -> int:
+    return sum(len(value) for value in inputs)
+
+
+class _Waiter:
+    __slots__ = ("inputs", "future")
+
+    def __init__(self, inputs: list, future: Future):
+        self.inputs = inputs
+        self.future = future
+
+
+class _Batch:
+    def __init__(self, key: str, path: str, request: dict, headers: dict[str, str], client: str):
+        self.key = key
+        self.path = path
+        # the fields of the requests besides their inputs, which are the same for all of them
+        self.request = request
+        self.headers = headers
+        # the client of the first request waits for a free slot on behalf of the batch
+        self.client = client
+        self.waiters: list[_Waiter] = []
+        self.inputs = 0
+        self.full = threading.Event()
+
+
+def _resolve(future: Future, response: Optional[CachedResponse]):
+    try:
+        future.set_result(response)
+    except InvalidStateError:
+        # the client went away while the batch was sent
+        pass
+
+
+class EmbeddingCoalescer:
+    """Coalesces the embeddings requests of the clients of a model server.
+
+    Tiny requests, as sent by RAG ingestion and search, spend most of their time in HTTP and
+    scheduling overhead. Requests which only differ in their inputs are collected for the batch
+    window or until the batch holds max_inputs, and sent upstream as one request with all of the
+    inputs. The embeddings in the response are handed back to the waiting clients. A batch takes
+    a single slot of the model server.
+
+    Clients get a future of their response. It is None if the batch failed, e.g. since one of
+    the inputs was too long, and the request has to be sent on its own to get its own error.
+    """
+
+    def __init__(self, model: ManagedModel, window: float, max_inputs: int = MAX_BATCH_INPUTS):
+        self.model = model
+        self.window = window
+        self.max_inputs = max_inputs
+        # called with the number of requests of every batch sent upstream
+        self.on_batch: Optional[Callable[[int], None]] = None
+
+        self._open: dict[str, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, path: str, request: dict, inputs: list, headers: dict[str, str], client: str
+    ) -> Future[Optional[CachedResponse]]:
+        future: Future[Optional[CachedResponse]] = Future()
+        key = batch_key(path, request, headers)
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None and batch.inputs + len(inputs) > self.max_inputs:
+                self._close(batch)
+                batch = None
+            if batch is None:
+                fields = {k: v for k, v in request.items() if k != "input"}
+                batch = _Batch(key, path, fields, headers, client)
+                self._open[key] = batch
+                threading.Thread(target=self._run, args=(batch,), name="embedding-batch", daemon=True).start()
+            batch.waiters.append(_Waiter(inputs, future))
+            batch.inputs += len(inputs)
+            if batch.inputs >= self.max_inputs:
+                self._close(batch)
+        return future
+
+    def _close(self, batch: _Batch):
+        if self._open.get(batch.key) is batch:
+            del self._open[batch.key]
+        batch.full.set()
+
+    def _run(self, batch: _Batch):
+        batch.full.wait(self.window)
+        with self._lock:
+            self._close(batch)
+
+        response = None
+        try:
+            if self.on_batch is not None:
+                self.on_batch(len(batch.waiters))
+            response = self._send(batch)
+        except Exception as e:
+            logger.debug(f"Batch of {len(batch.waiters)} embeddings requests failed: {e}")
+        finally:
+            responses: list[Optional[CachedResponse]] = [None] * len(batch.waiters)
+            if response is not None and response.status == 200:
+                responses = self._split(batch, response)
+            elif response is not None and len(batch.waiters) == 1:
+                # the error is the one of the only request
+                responses = [response]
+            elif response is not None:
+                logger.debug(f"Batch of {len(batch.waiters)} embeddings requests failed with {response.status}")
+            for waiter, part in zip(batch.waiters, responses):
+                _resolve(waiter.future, part)
+
+    def _send(self, batch: _Batch) -> CachedResponse:
+        body = json.dumps({**batch.request, "input": [v for w in batch.waiters for v in w.inputs]}).encode("utf-8")
+        headers = {key: value for key, value in batch.headers.items() if key.lower() != "content-length"}
+        headers["Content-Length"] = str(len(body))
+
+        with self.model.admit(batch.client), self.model.track_request():
+            pool = self.model.connection_pool
+            conn, reused = pool.acquire()
+            try:
+                try:
+                    conn.request("POST", batch.path, body=body, headers=headers)
+                    response = conn.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # the server closed the pooled connection right when it was reused
+                    conn = pool.connect()
+                    conn.request("POST", batch.path, body=body, headers=headers)
+                    response = conn.getresponse()
+                data = response.read()
+            except BaseException:
+                conn.close()
+                raise
+            pool.release(conn, not response.will_close)
+
+        response_headers = [(key, value) for key, value in response.getheaders() if key.lower() not in REPLACED_HEADERS]
+        response_headers.append(("Content-Length", str(len(data))))
+        return CachedResponse(response.status, response.reason, response_headers, data)
+
+    def _split(self, batch: _Batch, response: CachedResponse) -> list[Optional[CachedResponse]]:
+        try:
+            parts = split_embeddings(
+                json.loads(response.body),
+                [len(w.inputs) for w in batch.waiters],
+                [_size(w.inputs) for w in batch.waiters],
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            logger.debug(f"Failed to split the response to a batch of embeddings requests: {e}")
+            return [None] * len(batch.waiters)
+
+        headers = [(key, value) for key, value in response.headers if key.lower() != "content-length"]
+        responses: list[Optional[CachedResponse]] = []
+        for part in parts:
+            body = json.dumps(part).encode("utf-8")
+            responses.append(
+                CachedResponse(response.status, response.reason, headers + [("Content-Length", str(len(body)))], body)
+            )
+        return responses
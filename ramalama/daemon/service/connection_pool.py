@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import http.client
+import socket
+import threading
+from collections import deque
+from typing import Optional
+
+
+class UpstreamConnectionPool:
+    """Pool of persistent HTTP/1.1 connections to the inference server of a managed model.
+
+    Idle connections are kept for reuse to avoid the connect latency and the TIME_WAIT sockets
+    of a new connection per proxied request. Before an idle connection is handed out again it
+    is checked for having been closed by the server in the meantime.
+    """
+
+    def __init__(self, host: str, port: int, max_idle: int = 16, timeout: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+
+        self._idle: deque[http.client.HTTPConnection] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def is_healthy(conn: http.client.HTTPConnection) -> bool:
+        # An idle keep-alive connection must not have anything to read. If it is readable,
+        # the server either closed it (EOF) or sent unexpected data, so it can't be reused.
+        sock = conn.sock
+        if sock is None:
+            return False
+        timeout = sock.gettimeout()
+        try:
+            sock.settimeout(0)
+            sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(timeout)
+        return False
+
+    def connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """Returns a connection and whether it is a reused one."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self.connect(), False
+            if self.is_healthy(conn):
+                return conn, True
+            conn.close()
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool = True) -> None:
+        with self._lock:
+            if reusable and not self._closed and conn.sock is not None and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @property
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+
+class AsyncUpstreamConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def is_healthy(self) -> bool:
+        # the event loop keeps reading idle connections, so a closed one has seen its EOF already
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncUpstreamConnectionPool:
+    """Pool of persistent connections to the inference server of a managed model for the
+    asyncio daemon. It is only used from the thread running the event loop and needs no locking."""
+
+    def __init__(self, host: str, port: int, max_idle: int = 16):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+
+        self._idle: deque[AsyncUpstreamConnection] = deque()
+        self._closed = False
+
+    async def connect(self) -> AsyncUpstreamConnection:
+        return AsyncUpstreamConnection(*await asyncio.open_connection(self.host, self.port))
+
+    async def acquire(self) -> tuple[AsyncUpstreamConnection, bool]:
+        """Returns a connection and whether it is a reused one."""
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_healthy():
+                return conn, True
+            conn.close()
+        return await self.connect(), False
+
+    def release(self, conn: AsyncUpstreamConnection, reusable: bool = True) -> None:
+        if reusable and not self._closed and conn.is_healthy() and len(self._idle) < self.max_idle:
+            self._idle.append(conn)
+            return
+        conn.close()
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    def close(self) -> None:
+        self._closed = True
+        while self._idle:
+            self._idle.pop().close()
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Optional
+
+from ramalama.daemon.logging import logger
+from ramalama.model_inspect.gguf_info import GGUFModelMetadata
+from ramalama.model_inspect.gguf_parser import GGUFInfoParser
+
+# llama.cpp keeps the KV cache in F16 by default
+KV_CACHE_BYTES_PER_ELEMENT = 2
+
+
+def _max_value(value: Any) -> Optional[int]:
+    # some architectures define the number of KV heads per layer
+    if isinstance(value, list):
+        return max(value) if value else None
+    return value
+
+
+def estimate_kv_cache_size(metadata: GGUFModelMetadata, ctx_size: int = 0) -> int:
+    """Estimates the size of the KV cache from the GGUF metadata of a model. A ctx_size of 0 uses
+    the context length the model has been trained with, like llama.cpp does."""
+    arch = metadata.get("general.architecture")
+    if not arch:
+        return 0
+
+    n_layer = metadata.get(f"{arch}.block_count")
+    n_embd = metadata.get(f"{arch}.embedding_length")
+    n_head = _max_value(metadata.get(f"{arch}.attention.head_count"))
+    if not n_layer or not n_embd or not n_head:
+        return 0
+
+    n_head_kv = _max_value(metadata.get(f"{arch}.attention.head_count_kv")) or n_head
+    key_length = metadata.get(f"{arch}.attention.key_length") or n_embd // n_head
+    value_length = metadata.get(f"{arch}.attention.value_length") or n_embd // n_head
+    n_ctx = ctx_size or metadata.get(f"{arch}.context_length") or 0
+
+    return n_layer * n_ctx * n_head_kv * (key_length + value_length) * KV_CACHE_BYTES_PER_ELEMENT
+
+
+def estimate_footprint(model_paths: list[str], ctx_size: int = 0) -> int:
+    """Estimates the memory needed to serve a model, which is the size of its weights plus
+    the KV cache for the context."""
+    footprint = 0
+    metadata: Optional[GGUFModelMetadata] = None
+    for path in model_paths:
+        if os.path.isdir(path):
+            # safetensor models are served from their snapshot directory
+            footprint += sum(entry.stat().st_size for entry in os.scandir(path) if entry.name.endswith(".safetensors"))
+            continue
+        if not os.path.isfile(path):
+            continue
+        footprint += os.path.getsize(path)
+
+        # only the first shard of a split model carries the full metadata
+        if metadata is None and GGUFInfoParser.is_model_gguf(path):
+            try:
+                metadata = GGUFInfoParser.parse_metadata(path)
+            except Exception as ex:
+                logger.debug(f"Failed to read metadata of '{path}' for the KV cache estimation: {ex}")
+
+    if metadata is not None:
+        footprint += estimate_kv_cache_size(metadata, ctx_size)
+    return footprint
@@ -0,0 +1,426 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+from ramalama.daemon.service.access_log import RESPONSE_TAIL_SIZE, AccessLog, AccessRecord
+
+if TYPE_CHECKING:
+    from ramalama.daemon.service.model_runner import ModelRunner
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+INTER_CHUNK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+MODEL_START_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+Labels = tuple[str, ...]
+Sample = tuple[str, dict[str, str], float]
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_sample(name: str, labels: dict[str, str], value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    label_str = ",".join(f'{key}="{_escape_label_value(val)}"' for key, val in labels.items())
+    return f"{name}{{{label_str}}} {_format_value(value)}"
+
+
+class MetricFamily:
+    type = "unknown"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames: Labels = tuple(labelnames)
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError("Not implemented")
+
+    def render(self) -> Iterator[str]:
+        yield f"# TYPE {self.name} {self.type}"
+        yield f"# HELP {self.name} {self.help}"
+        for suffix, labels, value in self.samples():
+            yield format_sample(f"{self.name}{suffix}", labels, value)
+
+
+class ShardedMetricFamily(MetricFamily):
+    """Metric family updated without locks on the request path.
+
+    Every thread updates its own shard of values, so increments never contend and can't get
+    lost. Only collecting the values for a scrape takes a lock, it merges the shards and folds
+    those of finished threads into the retired values, bounding the number of shards by the
+    number of live threads.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._local = threading.local()
+        self._shards: list[tuple[threading.Thread, dict[Labels, list[float]]]] = []
+        self._retired: dict[Labels, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def _new_cell(self) -> list[float]:
+        raise NotImplementedError("Not implemented")
+
+    def _cell(self, labels: Labels) -> list[float]:
+        try:
+            cells = self._local.cells
+        except AttributeError:
+            cells = self._register_shard()
+        cell = cells.get(labels)
+        if cell is None:
+            if len(labels) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects the labels {self.labelnames}, got {labels}")
+            cell = cells[labels] = self._new_cell()
+        return cell
+
+    def _register_shard(self) -> dict[Labels, list[float]]:
+        cells: dict[Labels, list[float]] = {}
+        with self._lock:
+            self._retire_finished_threads()
+            self._shards.append((threading.current_thread(), cells))
+        self._local.cells = cells
+        return cells
+
+    @staticmethod
+    def _merge(into: dict[Labels, list[float]], cells: dict[Labels, list[float]]):
+        for labels, cell in cells.items():
+            merged = into.get(labels)
+            if merged is None:
+                into[labels] = list(cell)
+            else:
+                for i, value in enumerate(cell):
+                    merged[i] += value
+
+    def _retire_finished_threads(self):
+        live = []
+        for thread, cells in self._shards:
+            if thread.is_alive():
+                live.append((thread, cells))
+            else:
+                # a finished thread doesn't update its shard anymore
+                self._merge(self._retired, cells)
+        self._shards = live
+
+    def collect(self) -> dict[Labels, list[float]]:
+        with self._lock:
+            self._retire_finished_threads()
+            collected = {labels: list(cell) for labels, cell in self._retired.items()}
+            for _, cells in self._shards:
+                # copying is atomic, the owning thread might add cells concurrently
+                self._merge(collected, {labels: list(cell) for labels, cell in cells.copy().items()})
+        return collected
+
+
+class Counter(ShardedMetricFamily):
+    type = "counter"
+
+    def _new_cell(self) -> list[float]:
+        return [0.0]
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        self._cell(labels)[0] += amount
+
+    def value(self, labels: Labels = ()) -> float:
+        cell = self.collect().get(labels)
+        return cell[0] if cell else 0
+
+    def total(self) -> float:
+        return sum(cell[0] for cell in self.collect().values())
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, cell in sorted(self.collect().items()):
+            yield "_total", dict(zip(self.labelnames, labels)), cell[0]
+
+
+class Histogram(ShardedMetricFamily):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+
+    def _new_cell(self) -> list[float]:
+        # the count of every bucket and the +Inf bucket, followed by the sum of the observations
+        return [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, labels: Labels = ()):
+        cell = self._cell(labels)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def count(self, labels: Labels = ()) -> float:
+        cell = self.collect().get(labels)
+        return sum(cell[:-1]) if cell else 0
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, cell in sorted(self.collect().items()):
+            label_dict = dict(zip(self.labelnames, labels))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), cell[:-1]):
+                cumulative += count
+                yield "_bucket", {**label_dict, "le": "+Inf" if math.isinf(bound) else repr(float(bound))}, cumulative
+            yield "_count", label_dict, cumulative
+            yield "_sum", label_dict, cell[-1]
+
+
+def _sum_by_labels(values: Iterable[tuple[Labels, float]]) -> list[tuple[Labels, float]]:
+    sums: dict[Labels, float] = {}
+    for labels, value in values:
+        sums[labels] = sums.get(labels, 0) + value
+    return sorted(sums.items())
+
+
+class CallbackGauge(MetricFamily):
+    """Gauge sampled from the current state of the daemon when scraped."""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Iterable[tuple[Labels, float]]],
+        labelnames: Iterable[str] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, value in self.callback():
+            yield "", dict(zip(self.labelnames, labels)), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families: list[MetricFamily] = []
+
+    def register(self, family: MetricFamily) -> MetricFamily:
+        self.families.append(family)
+        return family
+
+    def render(self) -> str:
+        """Renders all metrics in the OpenMetrics text format."""
+        lines = [line for family in self.families for line in family.render()]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class DaemonMetrics(MetricsRegistry):
+    def __init__(self, model_runner: "ModelRunner"):
+        super().__init__()
+
+        self.requests = Counter(
+            "ramalama_daemon_requests", "Proxied requests by model and status code", ["model", "code"]
+        )
+        self.request_duration = Histogram(
+            "ramalama_daemon_request_duration_seconds", "Duration of proxied requests", ["model"]
+        )
+        self.time_to_first_byte = Histogram(
+            "ramalama_daemon_time_to_first_byte_seconds",
+            "Time until the first block of the response body of a proxied request was received",
+            ["model"],
+        )
+        self.inter_chunk = Histogram(
+            "ramalama_daemon_inter_chunk_seconds",
+            "Time between two blocks of a streamed response body",
+            ["model"],
+            INTER_CHUNK_BUCKETS,
+        )
+        self.upstream_errors = Counter(
+            "ramalama_daemon_upstream_errors", "Requests which could not be forwarded to the model server", ["model"]
+        )
+        self.model_start_duration = Histogram(
+            "ramalama_daemon_model_start_duration_seconds",
+            "Time from starting a model server until it was ready",
+            ["model"],
+            MODEL_START_BUCKETS,
+        )
+        self.queue_wait = Histogram(
+            "ramalama_daemon_queue_wait_seconds",
+            "Time a proxied request waited for a free slot of the model server",
+            ["model"],
+        )
+        self.evictions = Counter(
+            "ramalama_daemon_evictions", "Models stopped to stay within the memory budget", ["model"]
+        )
+        self.model_crashes = Counter(
+            "ramalama_daemon_model_crashes", "Model servers which exited unexpectedly", ["model"]
+        )
+        self.response_cache_lookups = Counter(
+            "ramalama_daemon_response_cache_lookups",
+            "Lookups of cacheable requests in the response cache by result",
+            ["model", "result"],
+        )
+        self.access_log_dropped = Counter(
+            "ramalama_daemon_access_log_dropped", "Access log entries dropped since the writer fell behind"
+        )
+        self.embedding_batch_size = Histogram(
+            "ramalama_daemon_embedding_batch_size",
+            "Embeddings requests coalesced into a single request to the model server",
+            ["model"],
+            BATCH_SIZE_BUCKETS,
+        )
+        for family in [
+            self.requests,
+            self.request_duration,
+            self.time_to_first_byte,
+            self.inter_chunk,
+            self.upstream_errors,
+            self.model_start_duration,
+            self.queue_wait,
+            self.evictions,
+            self.model_crashes,
+            self.response_cache_lookups,
+            self.embedding_batch_size,
+            self.access_log_dropped,
+        ]:
+            self.register(family)
+
+        # the replicas of a model are reported together
+        self.register(
+            CallbackGauge(
+                "ramalama_daemon_requests_in_flight",
+                "Proxied requests in flight by model",
+                lambda: _sum_by_labels(((m.name,), m.in_flight) for m in model_runner.managed_models.values()),
+                ["model"],
+            )
+        )
+        self.register(
+            CallbackGauge(
+                "ramalama_daemon_requests_queued",
+                "Proxied requests waiting for a free slot by model",
+                lambda: _sum_by_labels(
+                    ((m.name,), m.admission.queued)
+                    for m in model_runner.managed_models.values()
+                    if m.admission is not None
+                ),
+                ["model"],
+            )
+        )
+        self.register(
+            CallbackGauge(
+                "ramalama_daemon_models",
+                "Managed model servers by model and state",
+                lambda: _sum_by_labels(((m.name, str(m.state)), 1) for m in model_runner.managed_models.values()),
+                ["model", "state"],
+            )
+        )
+        self.register(
+            CallbackGauge(
+                "ramalama_daemon_memory_used_bytes",
+                "Estimated memory used by the served models",
+                lambda: [((), model_runner.memory_used)],
+            )
+        )
+
+
+class RequestTimer:
+    """Records the latencies of a proxied request. The first block of the response body marks the
+    time to the first byte, the time between the following ones the inter-chunk latency.
+
+    With an access log, the request is logged once it finished, along with the size of the
+    response and the end of its body holding the token counts. Only the record is built on the
+    request path, it is formatted and written by the access log.
+    """
+
+    __slots__ = (
+        "metrics",
+        "labels",
+        "start",
+        "first_block",
+        "last_block",
+        "access_log",
+        "request",
+        "received_at",
+        "queue_wait",
+        "size",
+        "tail",
+    )
+
+    def __init__(
+        self,
+        metrics: DaemonMetrics,
+        model: str,
+        access_log: Optional[AccessLog] = None,
+        request: tuple[str, str, str] = ("", "", ""),
+    ):
+        self.metrics = metrics
+        self.labels: Labels = (model,)
+        self.start = time.monotonic()
+        self.first_block: Optional[float] = None
+        self.last_block: Optional[float] = None
+        self.access_log = access_log
+        # the client, method and path of the request
+        self.request = request
+        self.received_at = time.time()
+        self.queue_wait = 0.0
+        self.size = 0
+        self.tail = b""
+
+    def block_received(self, block: bytes = b""):
+        now = time.monotonic()
+        if self.last_block is None:
+            self.metrics.time_to_first_byte.observe(now - self.start, self.labels)
+            self.first_block = now
+        else:
+            self.metrics.inter_chunk.observe(now - self.last_block, self.labels)
+        self.last_block = now
+        if self.access_log is not None:
+            self.size += len(block)
+            self.tail = (self.tail + block[-RESPONSE_TAIL_SIZE:])[-RESPONSE_TAIL_SIZE:]
+
+    def admitted(self, queue_wait: float):
+        self.metrics.queue_wait.observe(queue_wait, self.labels)
+        self.queue_wait = queue_wait
+
+    def cache_lookup(self, hit: bool):
+        self.metrics.response_cache_lookups.inc((self.labels[0], "hit" if hit else "miss"))
+
+    def upstream_failed(self):
+        self.metrics.upstream_errors.inc(self.labels)
+
+    def finish(self, status: int):
+        now = time.monotonic()
+        if self.last_block is None:
+            # a response without a body is complete with its head
+            self.metrics.time_to_first_byte.observe(now - self.start, self.labels)
+        self.metrics.request_duration.observe(now - self.start, self.labels)
+        self.metrics.requests.inc((self.labels[0], str(status)))
+
+        if self.access_log is None:
+            return
+        client, method, path = self.request
+        record = AccessRecord(
+            self.received_at,
+            client,
+            method,
+            path,
+            self.labels[0],
+            status,
+            self.size,
+            (self.first_block or now) - self.start,
+            now - self.start,
+            self.queue_wait,
+            self.tail,
+        )
+        if not self.access_log.log(record):
+            self.metrics.access_log_dropped.inc()
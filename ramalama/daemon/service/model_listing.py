@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from ramalama.arg_types import StoreArgs
+from ramalama.common import generate_sha256
+from ramalama.daemon.dto.model import ModelDetailsResponse, ModelResponse, model_list_to_dict
+from ramalama.daemon.logging import logger
+from ramalama.model_inspect.gguf_parser import GGUFInfoParser
+from ramalama.model_store.global_store import GlobalModelStore, ModelFile
+from ramalama.transports.base import local_model_paths
+from ramalama.transports.transport_factory import TransportFactory
+
+# Seconds after which the listing is checked for changes of the store even if its generation
+# is unchanged, e.g. when the store has been modified by an older version of ramalama
+LISTING_MAX_AGE = 30
+
+# Names of the llama_ftype values stored as general.file_type in GGUF models
+GGUF_FILE_TYPES = {
+    0: "F32",
+    1: "F16",
+    2: "Q4_0",
+    3: "Q4_1",
+    7: "Q8_0",
+    8: "Q5_0",
+    9: "Q5_1",
+    10: "Q2_K",
+    11: "Q3_K_S",
+    12: "Q3_K_M",
+    13: "Q3_K_L",
+    14: "Q4_K_S",
+    15: "Q4_K_M",
+    16: "Q5_K_S",
+    17: "Q5_K_M",
+    18: "Q6_K",
+    19: "IQ2_XXS",
+    20: "IQ2_XS",
+    21: "Q2_K_S",
+    22: "IQ3_XS",
+    23: "IQ3_XXS",
+    24: "IQ1_S",
+    25: "IQ4_NL",
+    26: "IQ3_S",
+    27: "IQ3_M",
+    28: "IQ2_S",
+    29: "IQ2_M",
+    30: "IQ4_XS",
+    31: "IQ1_M",
+    32: "BF16",
+    36: "TQ1_0",
+    37: "TQ2_0",
+    38: "MXFP4_MOE",
+}
+
+EMPTY_DETAILS = ModelDetailsResponse(format="", family="", families=[], parameter_size="", quantization_level="")
+
+
+def read_model_details(model_paths: list[str]) -> ModelDetailsResponse:
+    """Reads the details of a model from the metadata of its GGUF file or the config of a
+    safetensor model, which is served from its snapshot directory."""
+    if not model_paths:
+        return EMPTY_DETAILS
+
+    path = model_paths[0]
+    if os.path.isdir(path):
+        family = ""
+        try:
+            with open(os.path.join(path, "config.json")) as f:
+                family = json.load(f).get("model_type", "")
+        except (OSError, ValueError, AttributeError):
+            pass
+        return ModelDetailsResponse(
+            format="safetensors",
+            family=family,
+            families=[family] if family else [],
+            parameter_size="",
+            quantization_level="",
+        )
+
+    if not GGUFInfoParser.is_model_gguf(path):
+        return EMPTY_DETAILS
+    metadata = GGUFInfoParser.parse_metadata(path)
+    family = metadata.get("general.architecture") or ""
+    return ModelDetailsResponse(
+        format="gguf",
+        family=family,
+        families=[family] if family else [],
+        parameter_size=metadata.get("general.size_label") or "",
+        quantization_level=GGUF_FILE_TYPES.get(metadata.get("general.file_type"), ""),
+    )
+
+
+class _ListingEntry:
+    def __init__(self, files: list[ModelFile], response: ModelResponse):
+        self.files = files
+        self.response = response
+
+
+class ModelListingCache:
+    """Cache of the model listing served at /api/tags.
+
+    Listing the store and creating a model for every entry is too expensive to be repeated for
+    every poll of a client. The serialized listing is rebuilt once the generation of the store
+    changed, which pull and rm update, and only the entries of models with changed files are
+    created again. A listing with partially downloaded models is checked on every request, since
+    downloads grow without updating the generation.
+    """
+
+    def __init__(self, model_store_path: str, max_age: float = LISTING_MAX_AGE):
+        self.model_store_path = model_store_path
+        self.max_age = max_age
+
+        self._store = GlobalModelStore(model_store_path)
+        self._entries: dict[str, _ListingEntry] = {}
+        self._generation: Optional[tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._has_partial = False
+        self._body = b""
+        self._etag = ""
+        self._lock = threading.Lock()
+
+    def get(self) -> tuple[bytes, str]:
+        """Returns the serialized listing and its entity tag."""
+        with self._lock:
+            generation = self._store.generation()
+            is_stale = (
+                generation != self._generation
+                or self._has_partial
+                or time.monotonic() - self._checked_at > self.max_age
+            )
+            if is_stale:
+                self._refresh(generation)
+            return self._body, self._etag
+
+    def _refresh(self, generation: tuple[int, int]):
+        self._generation = generation
+        self._checked_at = time.monotonic()
+
+        entries: dict[str, _ListingEntry] = {}
+        for model_name, model_files in self._store.list_models("podman", False).items():
+            entry = self._entries.get(model_name)
+            if entry is None or entry.files != model_files:
+                try:
+                    entry = _ListingEntry(model_files, self._build_response(model_name, model_files))
+                except Exception as e:
+                    logger.error(f"Failed to list model '{model_name}': {e}")
+                    continue
+            entries[model_name] = entry
+        self._entries = entries
+        self._has_partial = any(file.is_partial for entry in entries.values() for file in entry.files)
+
+        responses = [entry.response for entry in entries.values()]
+        self._body = json.dumps(model_list_to_dict(responses), indent=4).encode("utf-8")
+        self._etag = f'"{generate_sha256(self._body.decode("utf-8"), with_sha_prefix=False)[:32]}"'
+
+    def _build_response(self, model_name: str, model_files: list[ModelFile]) -> ModelResponse:
+        local_timezone = datetime.now().astimezone().tzinfo
+        is_partially_downloaded = any(file.is_partial for file in model_files)
+
+        size_sum = 0
+        last_modified = 0.0
+        for file in model_files:
+            size_sum += file.size
+            last_modified = max(file.modified, last_modified)
+
+        model = TransportFactory(
+            model_name, StoreArgs(engine="podman", container=False, store=self.model_store_path)
+        ).create()
+        full_model_name = f"{model.model_type}://{model.model_organization}/{model.model_name}:{model.model_tag}"
+
+        details = EMPTY_DETAILS
+        if not is_partially_downloaded:
+            try:
+                model_paths = local_model_paths(model)
+                details = read_model_details(model_paths)
+            except Exception as e:
+                logger.debug(f"Failed to read the details of model '{model_name}': {e}")
+
+        return ModelResponse(
+            name=model.model_name,
+            organization=model.model_organization,
+            tag=model.model_tag,
+            source=model.model_type,
+            model=full_model_name,
+            modified_at=datetime.fromtimestamp(last_modified, tz=local_timezone).isoformat(),
+            size=size_sum,
+            is_partial=is_partially_downloaded,
+            digest=generate_sha256(full_model_name, with_sha_prefix=False),
+            details=details,
+        )
+
+
+_listing_caches: dict[str, ModelListingCache] = {}
+_listing_caches_lock = threading.Lock()
+
+
+def get_listing_cache(model_store_path: str) -> ModelListingCache:
+    with _listing_caches_lock:
+        cache = _listing_caches.get(model_store_path)
+        if cache is None:
+            cache = _listing_caches[model_store_path] = ModelListingCache(model_store_path)
+        return cache
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluates an If-None-Match header with the weak comparison of RFC 9110."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -1,17 +1,61 @@
 from __future__ import annotations
 
+import os
 import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncContextManager, Callable, ContextManager, Iterator, Optional, Union
 
 from ramalama.common import generate_sha256
+from ramalama.compat import StrEnum
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.admission import AdmissionController, admit_unlimited, parallel_slots
+from ramalama.daemon.service.affinity import PREFIX_AFFINITY_CHARS, SlotTracker, preferred_replica
+from ramalama.daemon.service.coalescing import MAX_BATCH_INPUTS, EmbeddingCoalescer
+from ramalama.daemon.service.connection_pool import UpstreamConnectionPool
+from ramalama.daemon.service.metrics import DaemonMetrics
+from ramalama.daemon.service.port_allocator import PortAllocator
+from ramalama.daemon.service.state import AdoptedProcess, DaemonStateFile
 from ramalama.transports.transport_factory import CLASS_MODEL_TYPES
 
+if TYPE_CHECKING:
+    from ramalama.daemon.dto.serve import ServeRequest
+    from ramalama.daemon.service.access_log import AccessLog
+    from ramalama.daemon.service.preload import ModelPreloader
+    from ramalama.daemon.service.replicas import ReplicaScaling
+    from ramalama.daemon.service.response_cache import ResponseCache
+
+UPSTREAM_HOST = "127.0.0.1"
+
+# Interval between two readiness probes of a starting model server
+READY_PROBE_INTERVAL = 0.5
+
+ModelProcess = Union[subprocess.Popen, AdoptedProcess]
+
 
 def generate_model_id(model: CLASS_MODEL_TYPES) -> str:
     return generate_sha256(f"{model.model_name}-{model.model_tag}-{model.model_organization}", with_sha_prefix=False)
 
 
+class MemoryBudgetExceededError(RuntimeError):
+    """Raised when a model does not fit into the memory budget, even after evicting idle models."""
+
+
+class ModelNotReadyError(RuntimeError):
+    """Raised when a model server did not become ready to receive requests."""
+
+
+class ModelState(StrEnum):
+    STARTING = "starting"
+    READY = "ready"
+    DRAINING = "draining"
+    STOPPED = "stopped"
+    # the model server exited unexpectedly, it is restarted by the supervisor
+    FAILED = "failed"
+
+
 class ManagedModel:
     def __init__(
         self,
@@ -19,85 +63,624 @@ class ManagedModel:
         run_cmd: list[str],
         port: int,
         expires_after: timedelta = timedelta(minutes=5),
+        footprint: int = 0,
+        ready_check: Optional[Callable[[], bool]] = None,
+        ready_timeout: float = 180,
+        pinned: bool = False,
+        admission: Optional[AdmissionController] = None,
+        replica: int = 0,
+        cpus: Optional[list[int]] = None,
+        digest: Optional[str] = None,
+        generation: int = 0,
     ):
         self.model = model
-        self.id = generate_model_id(model)
+        # replicas of a model share its model ID, the first one is identified by it as well
+        self.model_id = generate_model_id(model)
+        self.replica = replica
+        self.id = self.model_id if replica == 0 else f"{self.model_id}-{replica}"
+        # a model hot swapping one with the same model ID runs alongside of it until it took over
+        self.generation = generation
+        if generation > 0:
+            self.id = f"{self.id}-v{generation}"
+        # identifies the contents of the model files, the model ID if they are unknown
+        self.digest = digest or self.model_id
         self.run_cmd: list[str] = run_cmd
         self.port: int = port
+        # CPUs the model server is pinned to, all available ones if None
+        self.cpus = cpus
+        # set by the ModelRunner when the model is served
+        self.serve_path: Optional[str] = None
+        # the request the model is served for, persisted so a restarted daemon can adopt it
+        self.serve_request: Optional["ServeRequest"] = None
 
         self.expires_after = expires_after
         self.expiration_date: Optional[datetime] = None
+        # pinned models are neither evicted nor stopped when expired
+        self.pinned = pinned
 
-        self.process: Optional[subprocess.Popen] = None
+        # estimated memory used by the model server in bytes
+        self.footprint: int = footprint
+        self.last_used: float = time.monotonic()
+        self._in_flight: int = 0
+        # requests routed to the model which haven't finished, counted from before their body is
+        # read, so the model isn't stopped while they are on their way to it
+        self._routed: int = 0
+        # limits the requests processed at the same time, unlimited if None
+        self.admission = admission
+        # llama-server accepts hints which slot caches the prompt of a request
+        self.slot_hints = bool(run_cmd) and os.path.basename(run_cmd[0]) == "llama-server"
+        slots = parallel_slots(run_cmd)
+        self.slots = SlotTracker(slots) if self.slot_hints and slots is not None else None
+        # batches the embeddings requests of the clients, set by the ModelRunner if enabled
+        self.embedding_coalescer: Optional[EmbeddingCoalescer] = None
 
-    def start(self):
+        # probes whether the model server is ready to receive requests, it is assumed to be
+        # ready right after being started if there is no check
+        self.ready_check = ready_check
+        self.ready_timeout = ready_timeout
+        self.state: ModelState = ModelState.STOPPED
+        # called with the seconds the model server took to become ready
+        self.on_ready: Optional[Callable[[float], None]] = None
+        self.started_at: Optional[float] = None
+        # guards the state and the in flight counter, waiters are notified on every change
+        self._condition = threading.Condition()
+
+        self.process: Optional[ModelProcess] = None
+        self.connection_pool = UpstreamConnectionPool(UPSTREAM_HOST, port)
+
+    def start(self, process: Optional[AdoptedProcess] = None):
+        """Starts the model server, or adopts the given one of a previous daemon which is probed
+        for readiness like a new one."""
         if self.process is not None:
             raise RuntimeError(f"Model {self.id} is already running.")
         self.update_expiration_date()
-        self.process = subprocess.Popen(self.run_cmd)
+        self.connection_pool = UpstreamConnectionPool(UPSTREAM_HOST, self.port)
+        self.started_at = time.monotonic()
+        if process is not None:
+            self.process = process
+        else:
+            # a session of its own keeps the server running when the daemon is interrupted or killed
+            self.process = subprocess.Popen(self.run_cmd, start_new_session=True)
+        if process is None and self.cpus and hasattr(os, "sched_setaffinity"):
+            # the server starts its threads after loading the model, which inherit the affinity
+            try:
+                os.sched_setaffinity(self.process.pid, self.cpus)
+            except OSError as e:
+                logger.warning(f"Failed to pin model server of {self.id} to CPUs {self.cpus}: {e}")
+
+        if self.ready_check is None:
+            self._set_state(ModelState.READY)
+            return
+        self._set_state(ModelState.STARTING)
+        threading.Thread(
+            target=self._probe_readiness, args=(self.process,), name=f"ready-probe-{self.port}", daemon=True
+        ).start()
 
     def stop(self):
+        # the exit of the server is expected from here on
+        self._set_state(ModelState.STOPPED)
+        # pooled connections point to the server being stopped and must not be reused
+        self.connection_pool.close()
         if self.process:
             self.process.terminate()
             self.process.wait()
             self.process = None
 
+    def mark_failed(self, process: ModelProcess) -> bool:
+        """Marks the model as failed after its server exited unexpectedly, so no more requests are
+        routed to it. Returns False if the process has been stopped or replaced in the meantime."""
+        with self._condition:
+            if self.process is not process or self.state == ModelState.STOPPED:
+                return False
+            self.state = ModelState.FAILED
+            self._condition.notify_all()
+        # pooled connections point to the exited server
+        self.connection_pool.close()
+        return True
+
+    def restart(self):
+        """Starts the server of a failed model again, on the same port."""
+        if self.process is not None and self.process.poll() is None:
+            raise RuntimeError(f"Model server of {self.id} is still running.")
+        self.process = None
+        self.start()
+
+    @property
+    def name(self) -> str:
+        return f"{self.model.model_organization}/{self.model.model_name}:{self.model.model_tag}"
+
+    def _set_state(self, state: ModelState):
+        if state == ModelState.READY and self.started_at is not None and self.on_ready is not None:
+            self.on_ready(time.monotonic() - self.started_at)
+        with self._condition:
+            self.state = state
+            self._condition.notify_all()
+
+    def _probe_readiness(self, process: ModelProcess):
+        assert self.ready_check is not None
+
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            # the model might have been stopped or restarted in the meantime
+            if self.process is not process or self.state != ModelState.STARTING:
+                return
+            if process.poll() is not None:
+                logger.error(f"Model server of {self.id} exited with code {process.returncode} while starting")
+                self.mark_failed(process)
+                return
+
+            try:
+                if self.ready_check():
+                    logger.info(f"Model {self.id} is ready")
+                    self._set_state(ModelState.READY)
+                    return
+            except Exception as e:
+                logger.debug(f"Readiness probe of model {self.id} failed, retrying... Error: {e}")
+            time.sleep(READY_PROBE_INTERVAL)
+
+        logger.error(f"Model {self.id} did not become ready within {self.ready_timeout}s")
+        if self.process is process:
+            process.terminate()
+            self._set_state(ModelState.STOPPED)
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Blocks while the model is starting. Returns whether the model is ready."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.state != ModelState.STARTING, timeout)
+            return self.state == ModelState.READY
+
+    def start_draining(self):
+        """Stops the model from accepting new requests, the ones in flight keep being served."""
+        with self._condition:
+            if self.state != ModelState.STOPPED:
+                self.state = ModelState.DRAINING
+                self._condition.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Stops the model from accepting new requests and waits for the ones in flight to finish.
+        Returns whether all requests finished within the timeout."""
+        self.start_draining()
+        return self.wait_until_idle(timeout)
+
+    def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the requests routed to the model to finish, the ones in flight, waiting for a
+        slot or still being received. Returns whether all of them finished within the timeout."""
+        with self._condition:
+            # queued requests are counted as in flight once admitted and notify when finished
+            return self._condition.wait_for(lambda: self.idle, timeout)
+
     def update_expiration_date(self):
         self.expiration_date = datetime.now() + self.expires_after
 
+    def is_expired(self, now: datetime) -> bool:
+        """Whether the model has been idle for longer than it is kept loaded. Pinned models,
+        models still starting and models with requests routed to them never expire."""
+        if self.pinned or self.state == ModelState.STARTING or not self.idle:
+            return False
+        return self.expiration_date is not None and self.expiration_date <= now
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def outstanding(self) -> int:
+        """Number of requests in flight and waiting for a free slot."""
+        return self._in_flight + (self.admission.queued if self.admission is not None else 0)
+
+    @property
+    def idle(self) -> bool:
+        """Whether no requests are routed to the model, including the ones whose route has been
+        resolved but which aren't admitted yet."""
+        return self._routed == 0 and self.outstanding == 0
+
+    def reserve(self):
+        """Counts a request as routed to the model until it is released, see ModelRunner.get_served_model."""
+        with self._condition:
+            self._routed += 1
+
+    def release(self):
+        with self._condition:
+            self._routed -= 1
+            self._condition.notify_all()
+
+    @property
+    def saturated(self) -> bool:
+        """Whether all slots of the model server are taken, so further requests have to wait."""
+        return self.admission is not None and self.outstanding >= self.admission.max_concurrent
+
+    def claim_slot(self, affinity: int) -> ContextManager[Optional[int]]:
+        """Claims the slot of a prompt prefix for a request, see SlotTracker.claim."""
+        if self.slots is None:
+            return nullcontext()
+        return self.slots.claim(affinity)
+
+    def admit(self, client: str) -> ContextManager[float]:
+        """Waits for a free slot of the model server, see AdmissionController.admit."""
+        if self.admission is None:
+            return nullcontext(0.0)
+        return self.admission.admit(client)
+
+    def admit_async(self, client: str) -> AsyncContextManager[float]:
+        if self.admission is None:
+            return admit_unlimited()
+        return self.admission.admit_async(client)
+
+    @contextmanager
+    def track_request(self) -> Iterator[None]:
+        """Counts a proxied request as in flight for its duration and marks the model as used."""
+        with self._condition:
+            self._in_flight += 1
+        self.last_used = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+            self.last_used = time.monotonic()
+            # the idle time starts when the last request finished
+            self.update_expiration_date()
+
+
+def select_replica(replicas: list[ManagedModel], affinity: Optional[int] = None) -> Optional[ManagedModel]:
+    """Chooses the replica for a request, see ModelRunner.get_served_model."""
+    if not replicas:
+        return None
+    candidates = [m for m in replicas if m.state in (ModelState.READY, ModelState.STARTING)]
+    if not candidates:
+        return replicas[0]
+    least_loaded = min(candidates, key=lambda m: (m.state != ModelState.READY, m.outstanding))
+    if affinity is None or len(candidates) == 1:
+        return least_loaded
+
+    preferred = preferred_replica(affinity, [m for m in candidates if m.state == ModelState.READY] or candidates)
+    if preferred.saturated and least_loaded.outstanding < preferred.outstanding:
+        return least_loaded
+    return preferred
+
 
 class ModelRunner:
-    def __init__(self) -> None:
+    def __init__(self, memory_budget: Optional[int] = None) -> None:
         self._models: dict[str, ManagedModel] = {}
-        self._serve_path_model_id_map: dict[str, str] = {}
+        # IDs of the replicas serving a model by their serve path
+        self._serve_path_model_ids: dict[str, list[str]] = {}
+        # how the replicas of a model are created and scaled by their serve path
+        self._scaling: dict[str, "ReplicaScaling"] = {}
+        # IDs of the models started to take over a serve path, which aren't routed to yet
+        self._standby_ids: set[str] = set()
+        # IDs of the models replaced at their serve path, which finish their requests until stopped
+        self._replaced_ids: set[str] = set()
+        # guards the model maps, request threads of the daemon start and stop models concurrently
+        self._lock = threading.Lock()
 
         self._port_range: tuple[int, int] = (8081, 9080)
-        self._used_ports: set[int] = set()
+        self._ports = PortAllocator(*self._port_range, host=UPSTREAM_HOST)
+
+        # total memory in bytes the running models may use, unlimited if None
+        self.memory_budget: Optional[int] = memory_budget
+        self.metrics = DaemonMetrics(self)
+        # launches the models configured to be served at start, if any
+        self.preloader: Optional["ModelPreloader"] = None
+        self.response_cache: Optional["ResponseCache"] = None
+        # logs every proxied request, not logged if None
+        self.access_log: Optional["AccessLog"] = None
+        # characters of the prompts hashed for prefix affinity, 0 disables it
+        self.prefix_affinity_chars = PREFIX_AFFINITY_CHARS
+        # seconds embeddings requests are collected for a batch, 0 disables coalescing
+        self.embedding_batch_window: float = 0
+        self.embedding_batch_size = MAX_BATCH_INPUTS
+        # lists the running model servers for the next daemon to adopt, not persisted if None
+        self.state_file: Optional[DaemonStateFile] = None
+        # orders the writes of the state file, so an older list never overwrites a newer one
+        self._state_lock = threading.Lock()
 
     @property
     def managed_models(self) -> dict[str, ManagedModel]:
-        return self._models
+        with self._lock:
+            return dict(self._models)
 
     @property
     def served_models(self) -> dict[str, ManagedModel]:
-        return {path: self._models[id] for path, id in self._serve_path_model_id_map.items() if id in self._models}
+        """The first replica of every served model by its serve path."""
+        with self._lock:
+            return {path: self._models[ids[0]] for path, ids in self._serve_path_model_ids.items()}
+
+    def get_replicas(self, serve_path: str) -> list[ManagedModel]:
+        with self._lock:
+            return [self._models[id] for id in self._serve_path_model_ids.get(serve_path, [])]
+
+    def get_served_model(
+        self, serve_path: str, affinity: Optional[int] = None, reserve: bool = False
+    ) -> Optional[ManagedModel]:
+        """Returns the replica serving the model with the fewest outstanding requests. Replicas
+        which are ready are preferred over starting ones, stopping replicas aren't chosen.
+
+        Requests with the hash of a prompt prefix as affinity go to the same replica as the other
+        requests sharing it, whose server has the prefix cached, unless all of its slots are
+        taken while another replica is less loaded.
+
+        With reserve, the request is counted as routed to the replica until it is released, so
+        the replica isn't stopped, e.g. since it is swapped or evicted, before the request
+        reached it. The route is resolved and reserved at once, a swap takes effect either
+        before or after.
+        """
+        with self._lock:
+            replicas = [self._models[id] for id in self._serve_path_model_ids.get(serve_path, [])]
+            model = select_replica(replicas, affinity)
+            if model is not None and reserve:
+                model.reserve()
+            return model
 
     def next_available_port(self) -> int:
-        for port in range(self._port_range[0], self._port_range[1] + 1):
-            if port not in self._used_ports:
-                self._used_ports.add(port)
-                return port
-        raise RuntimeError(f"No available ports in range {self._port_range[0]}-{self._port_range[1]}.")
+        return self._ports.allocate()
+
+    def reserve_port(self, port: int) -> bool:
+        return self._ports.reserve(port)
+
+    def release_port(self, port: int):
+        self._ports.release(port)
 
     def add_model(self, model: ManagedModel):
-        if model.id in self._models:
-            raise RuntimeError(f"Model with ID {model.id} already exists.")
+        with self._lock:
+            if model.id in self._models:
+                raise RuntimeError(f"Model with ID {model.id} already exists.")
+
+            self._models[model.id] = model
+
+    def start_model(self, model_id: str, serve_path: str, process: Optional[AdoptedProcess] = None):
+        """Starts the model server of a model added before and serves it at the path, adopting
+        the given process of a previous daemon instead of starting a new one."""
+        with self._lock:
+            if model_id not in self._models:
+                raise RuntimeError(f"Model with ID {model_id} does not exist.")
+            model = self._models[model_id]
+            served_ids = self._serve_path_model_ids.get(serve_path, [])
+            # further replicas of a model are served at the same path
+            if model_id in served_ids or any(self._models[id].model_id != model.model_id for id in served_ids):
+                raise RuntimeError(f"Model with ID {model_id} already served at {serve_path}")
+
+            evicted = self._select_evictions(model)
+            for m in evicted:
+                self._remove(m.id)
+            self._serve_path_model_ids.setdefault(serve_path, []).append(model_id)
+            model.serve_path = serve_path
+
+        try:
+            self._launch(model, evicted, process)
+        except Exception:
+            with self._lock:
+                self._remove_serve_path(model_id)
+            raise
+        self.save_state()
+
+    def start_standby(self, model_id: str, serve_path: str):
+        """Starts the model server of a model added before, which is to take over the serve path
+        from the replicas serving it, without routing requests to it yet. The replicas keep their
+        memory until they are stopped, so the model has to fit into the budget alongside them."""
+        with self._lock:
+            if model_id not in self._models:
+                raise RuntimeError(f"Model with ID {model_id} does not exist.")
+            model = self._models[model_id]
+            evicted = self._select_evictions(model, set(self._serve_path_model_ids.get(serve_path, [])))
+            for m in evicted:
+                self._remove(m.id)
+            self._standby_ids.add(model_id)
+
+        try:
+            self._launch(model, evicted)
+        except Exception:
+            with self._lock:
+                self._standby_ids.discard(model_id)
+            raise
+
+    def swap_served_model(
+        self, serve_path: str, model_id: str, scaling: Optional["ReplicaScaling"] = None
+    ) -> list[ManagedModel]:
+        """Routes the requests for the serve path to the standby model at once, replacing the
+        replicas serving it so far along with their scaling. The replaced replicas are returned,
+        they keep serving the requests routed to them before until they are stopped."""
+        with self._lock:
+            if model_id not in self._standby_ids:
+                raise RuntimeError(f"Model with ID {model_id} is not started to take over {serve_path}")
+            self._standby_ids.discard(model_id)
+            replaced = [self._models[id] for id in self._serve_path_model_ids.get(serve_path, [])]
+            self._serve_path_model_ids[serve_path] = [model_id]
+            self._replaced_ids.update(m.id for m in replaced)
+            self._models[model_id].serve_path = serve_path
+            if scaling is not None:
+                self._scaling[serve_path] = scaling
+            else:
+                self._scaling.pop(serve_path, None)
+        self.save_state()
+        return replaced
 
-        self._models[model.id] = model
+    def _launch(self, model: ManagedModel, evicted: list[ManagedModel], process: Optional[AdoptedProcess] = None):
+        # stopping and starting processes takes a while and is done without holding the lock
+        for m in evicted:
+            logger.info(f"Evicting least recently used model {m.id} to free {m.footprint} bytes")
+            self._stop(m)
+            self.metrics.evictions.inc((m.name,))
+        model.on_ready = lambda duration: self.metrics.model_start_duration.observe(duration, (model.name,))
+        if self.embedding_batch_window > 0:
+            model.embedding_coalescer = EmbeddingCoalescer(
+                model, self.embedding_batch_window, self.embedding_batch_size
+            )
+            model.embedding_coalescer.on_batch = lambda n: self.metrics.embedding_batch_size.observe(n, (model.name,))
+        model.start(process)
 
-    def start_model(self, model_id: str, serve_path: str):
-        if model_id not in self._models:
-            raise RuntimeError(f"Model with ID {model_id} does not exist.")
-        if serve_path in self._serve_path_model_id_map:
-            raise RuntimeError(f"Model with ID {model_id} already served at {serve_path}")
+    def restart_model(self, model: ManagedModel) -> bool:
+        """Restarts the server of a failed model. Returns False if the model has been stopped and
+        removed in the meantime."""
+        with self._lock:
+            # the model might have been stopped while it waited to be restarted
+            if self._models.get(model.id) is not model or model.state != ModelState.FAILED:
+                return False
+            if model.id in self._replaced_ids:
+                # the model is about to be stopped, its requests failed with it
+                return False
+            model.restart()
+        self.save_state()
+        return True
 
-        self._models[model_id].start()
-        self._serve_path_model_id_map[serve_path] = model_id
+    def set_scaling(self, serve_path: str, scaling: "ReplicaScaling"):
+        with self._lock:
+            self._scaling[serve_path] = scaling
+
+    @property
+    def scaling(self) -> dict[str, "ReplicaScaling"]:
+        with self._lock:
+            return dict(self._scaling)
+
+    def add_replica(self, serve_path: str) -> ManagedModel:
+        """Starts another replica of the model served at the path, using its scaling."""
+        with self._lock:
+            scaling = self._scaling.get(serve_path)
+            if scaling is None:
+                raise RuntimeError(f"Model served at {serve_path} can't be scaled")
+            used = {self._models[id].replica for id in self._serve_path_model_ids.get(serve_path, [])}
+            free = [replica for replica in range(scaling.max_replicas) if replica not in used]
+            if not free:
+                raise RuntimeError(f"Model served at {serve_path} has {scaling.max_replicas} replicas already")
+
+        model = scaling.create_replica(free[0])
+        try:
+            self.add_model(model)
+        except Exception:
+            self.release_port(model.port)
+            raise
+        try:
+            self.start_model(model.id, serve_path)
+        except Exception:
+            self.stop_model(model.id)
+            raise
+        return model
+
+    @property
+    def evictions(self) -> int:
+        return int(self.metrics.evictions.total())
+
+    @property
+    def memory_used(self) -> int:
+        with self._lock:
+            return self._memory_used()
+
+    def _memory_used(self) -> int:
+        served = sum(self._models[id].footprint for ids in self._serve_path_model_ids.values() for id in ids)
+        return served + sum(self._models[id].footprint for id in self._standby_ids | self._replaced_ids)
+
+    def _select_evictions(self, model: ManagedModel, keep: Optional[set[str]] = None) -> list[ManagedModel]:
+        """Selects the least recently used idle models to stop so the model fits into the memory
+        budget. Pinned models, models with requests routed to them and the models to keep are
+        never evicted, nor are replicas of the model itself."""
+        if self.memory_budget is None:
+            return []
+        if model.footprint > self.memory_budget:
+            raise MemoryBudgetExceededError(
+                f"Model {model.id} needs {model.footprint} bytes, exceeding the memory budget of {self.memory_budget}"
+            )
+
+        served_ids = {id for ids in self._serve_path_model_ids.values() for id in ids}
+        candidates = sorted(
+            (
+                m
+                for m in self._models.values()
+                if m.model_id != model.model_id and m.id in served_ids and m.id not in (keep or ())
+            ),
+            key=lambda m: m.last_used,
+        )
+        evicted: list[ManagedModel] = []
+        required = self._memory_used() + model.footprint - self.memory_budget
+        for candidate in candidates:
+            if required <= 0:
+                break
+            if candidate.pinned or not candidate.idle:
+                continue
+            evicted.append(candidate)
+            required -= candidate.footprint
+
+        if required > 0:
+            raise MemoryBudgetExceededError(
+                f"Model {model.id} does not fit into the memory budget of {self.memory_budget} bytes, "
+                f"{required} bytes are held by pinned models or models with requests in flight"
+            )
+        return evicted
+
+    def _remove_serve_path(self, model_id: str):
+        for path, ids in list(self._serve_path_model_ids.items()):
+            if model_id not in ids:
+                continue
+            ids.remove(model_id)
+            if not ids:
+                # the last replica is gone, a new serve request starts over
+                del self._serve_path_model_ids[path]
+                self._scaling.pop(path, None)
+
+    def _remove(self, model_id: str) -> ManagedModel:
+        self._remove_serve_path(model_id)
+        self._standby_ids.discard(model_id)
+        self._replaced_ids.discard(model_id)
+        return self._models.pop(model_id)
+
+    def _stop(self, model: ManagedModel):
+        model.stop()
+        # the port is only reused once the server listening on it has exited
+        self._ports.release(model.port)
 
     def stop_model(self, model_id: str):
-        if model_id not in self._models:
-            raise RuntimeError(f"Model with ID {model_id} does not exist.")
+        with self._lock:
+            if model_id not in self._models:
+                raise RuntimeError(f"Model with ID {model_id} does not exist.")
+            m = self._remove(model_id)
+
+        self._stop(m)
+        self.save_state()
+
+    def save_state(self):
+        if self.state_file is None:
+            return
+        with self._state_lock:
+            self.state_file.save([m for m in self.managed_models.values() if m.state != ModelState.STOPPED])
+
+    def detach_models(self) -> list[ManagedModel]:
+        """Forgets all models without stopping their servers, which stay listed in the state file
+        for the next daemon to adopt."""
+        with self._lock:
+            models = list(self._models.values())
+            self._models.clear()
+            self._serve_path_model_ids.clear()
+            self._scaling.clear()
+            self._standby_ids.clear()
+            self._replaced_ids.clear()
+        for m in models:
+            m.connection_pool.close()
+        return models
+
+    def stop_served_model(self, serve_path: str):
+        """Stops all replicas of the model served at the path."""
+        replicas = self.get_replicas(serve_path)
+        if not replicas:
+            raise RuntimeError(f"No model served at {serve_path}")
+        for m in replicas:
+            self.stop_model(m.id)
 
-        id_to_path = {id: path for path, id in self._serve_path_model_id_map.items()}
-        if model_id in id_to_path:
-            path = id_to_path[model_id]
-            del self._serve_path_model_id_map[path]
+    def stop_expired_models(self):
+        """Stops the models which have been idle for longer than they are kept loaded. The
+        replicas of a model are stopped together once all of them expired, removing single
+        idle replicas is up to scaling."""
+        curr_time = datetime.now()
+        for name, m in self.managed_models.items():
+            if not m.is_expired(curr_time):
+                continue
+            if m.serve_path is not None and not all(r.is_expired(curr_time) for r in self.get_replicas(m.serve_path)):
+                continue
 
-        m = self._models[model_id]
-        m.stop()
-        self._used_ports.discard(m.port)
-        del self._models[model_id]
+            try:
+                logger.info(f"Stopping expired model '{name}'...")
+                self.stop_model(m.id)
+            except Exception as e:
+                logger.error(f"Failed to stop expired model '{name}': {e}")
 
     def stop(self):
-        for id in list(self._models.keys()):
+        for id in list(self.managed_models.keys()):
             self.stop_model(id)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import socket
+import threading
+from collections import deque
+
+
+def is_port_free(host: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind((host, port))
+        except OSError:
+            return False
+        return True
+
+
+class PortAllocator:
+    """Thread-safe allocator of the ports the model servers listen on.
+
+    Free ports are kept in a FIFO list, so a port is allocated in constant time and a released
+    port is reused last, giving sockets of the stopped server time to close. Only the port
+    handed out is bind-tested, ports taken by other processes are moved to the end of the list.
+    """
+
+    def __init__(self, start: int, end: int, host: str = "127.0.0.1"):
+        self.host = host
+        self._free: deque[int] = deque(range(start, end + 1))
+        self._used: set[int] = set()
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self._lock:
+            for _ in range(len(self._free)):
+                port = self._free.popleft()
+                if is_port_free(self.host, port):
+                    self._used.add(port)
+                    return port
+                self._free.append(port)
+        raise RuntimeError("No available ports left for model servers.")
+
+    def reserve(self, port: int) -> bool:
+        """Marks the port of a model server which is running already as used. Returns False if
+        it is allocated already."""
+        with self._lock:
+            if port in self._used:
+                return False
+            if port in self._free:
+                self._free.remove(port)
+            self._used.add(port)
+            return True
+
+    def release(self, port: int) -> None:
+        with self._lock:
+            if port in self._used:
+                self._used.remove(port)
+                self._free.append(port)
+
+    @property
+    def used(self) -> set[int]:
+        with self._lock:
+            return set(self._used)
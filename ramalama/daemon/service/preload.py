@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from ramalama.config import DaemonConfig, PreloadModelConfig
+from ramalama.daemon.dto.serve import ServeRequest
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.model_runner import ManagedModel, ModelRunner, ModelState
+
+
+def build_serve_request(config: PreloadModelConfig, default_runtime: str) -> ServeRequest:
+    exec_args = {f"--{option.replace('_', '-')}": str(value) for option, value in config.options.items()}
+    return ServeRequest(
+        model_name=config.model,
+        runtime=config.runtime or default_runtime,
+        exec_args=exec_args,
+        pinned=config.pinned,
+        idle_timeout=config.idle_timeout,
+        replicas=config.replicas,
+        max_replicas=config.max_replicas,
+    )
+
+
+class _PreloadEntry:
+    def __init__(self, name: str, serve_request: ServeRequest):
+        self.name = name
+        self.serve_request = serve_request
+        self.model: Optional[ManagedModel] = None
+        self.error: Optional[str] = None
+
+
+class ModelPreloader:
+    """Launches the models configured in the daemon section when the daemon starts.
+
+    The models are started in the background with a bounded number of them starting at the
+    same time, so the daemon accepts requests right away. The daemon is ready once every pinned
+    model is ready, which is reported at /api/ready for readiness gates of load balancers.
+    """
+
+    def __init__(
+        self,
+        model_runner: ModelRunner,
+        serve: Callable[[ServeRequest], ManagedModel],
+        config: DaemonConfig,
+        default_runtime: str,
+    ):
+        self.model_runner = model_runner
+        self.serve = serve
+        self.concurrency = config.preload_concurrency
+        self.entries = [
+            _PreloadEntry(name, build_serve_request(entry, default_runtime)) for name, entry in config.preload.items()
+        ]
+
+        self._done = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="model-preloader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="preload") as executor:
+            list(executor.map(self._preload, self.entries))
+        self._done.set()
+        logger.info("Preloading models finished")
+
+    def _preload(self, entry: _PreloadEntry):
+        if self._stopped.is_set():
+            return
+
+        logger.info(f"Preloading model '{entry.serve_request.model_name}'...")
+        try:
+            model = self.serve(entry.serve_request)
+        except Exception as e:
+            logger.error(f"Failed to preload model '{entry.serve_request.model_name}': {e}")
+            entry.error = str(e)
+            return
+
+        with self._lock:
+            if not self._stopped.is_set():
+                entry.model = model
+        if entry.model is None:
+            # the daemon shut down while the model was starting
+            self._stop_model(model)
+            return
+
+        # waiting bounds the number of model servers loading their model at the same time
+        if not model.wait_until_ready(model.ready_timeout):
+            entry.error = f"Model did not become ready, it is {model.state}"
+            logger.error(f"Preloaded model '{entry.serve_request.model_name}' did not become ready")
+
+    def _stop_model(self, model: ManagedModel):
+        if self.model_runner.managed_models.get(model.id) is model:
+            try:
+                self.model_runner.stop_model(model.id)
+            except Exception as e:
+                logger.error(f"Failed to stop preloaded model '{model.name}': {e}")
+
+    def stop(self):
+        """Stops preloading and the preloaded models which are still running."""
+        with self._lock:
+            self._stopped.set()
+        for entry in self.entries:
+            if entry.model is not None:
+                self._stop_model(entry.model)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for all models to be preloaded. Returns whether preloading finished."""
+        return self._done.wait(timeout)
+
+    def readiness(self) -> tuple[bool, list[dict[str, Any]]]:
+        """Returns whether all pinned models are ready, along with the status of every preloaded model."""
+        managed_models = self.model_runner.managed_models
+        ready = True
+        models: list[dict[str, Any]] = []
+        for entry in self.entries:
+            model = entry.model
+            if model is None:
+                state = "failed" if entry.error is not None else "pending"
+            elif managed_models.get(model.id) is not model:
+                state = str(ModelState.STOPPED)
+            else:
+                state = str(model.state)
+
+            if entry.serve_request.pinned and state != ModelState.READY:
+                ready = False
+            status: dict[str, Any] = {
+                "name": entry.name,
+                "model": entry.serve_request.model_name,
+                "pinned": entry.serve_request.pinned,
+                "state": state,
+            }
+            if entry.error is not None:
+                status["error"] = entry.error
+            models.append(status)
+        return ready, models
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.model_runner import ModelRunner
+
+
+class IdleModelReaper:
+    """Stops the models which have been idle for longer than their idle timeout.
+
+    The check runs in a background thread, so it doesn't depend on signals, and only stops
+    individual models. The daemon keeps running and pinned models stay loaded.
+    """
+
+    def __init__(self, model_runner: ModelRunner, interval: float):
+        self.model_runner = model_runner
+        self.interval = interval
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="idle-model-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.model_runner.stop_expired_models()
+            except Exception as e:
+                logger.error(f"Failed to stop idle models: {e}")
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.model_runner import ManagedModel, ModelRunner, ModelState
+
+# Interval in seconds at which the replica counts are adjusted to the load
+AUTOSCALE_INTERVAL = 1.0
+
+# Seconds requests routed to a replica right before it was scaled down may take to finish
+SCALE_DOWN_DRAIN_TIMEOUT = 30
+
+
+def available_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def replica_cpus(replica: int, max_replicas: int, cpus: Optional[list[int]] = None) -> Optional[list[int]]:
+    """Returns the CPUs a replica is pinned to, splitting the available CPUs evenly between the
+    maximum number of replicas. A single replica and hosts with too few CPUs aren't pinned."""
+    if cpus is None:
+        cpus = available_cpus()
+    if max_replicas <= 1 or len(cpus) < max_replicas:
+        return None
+    share = len(cpus) // max_replicas
+    return cpus[replica * share : (replica + 1) * share]
+
+
+class ReplicaScaling:
+    """How the replicas of a served model are created and how many of them may run."""
+
+    def __init__(self, create_replica: Callable[[int], ManagedModel], min_replicas: int, max_replicas: int):
+        if not 1 <= min_replicas <= max_replicas:
+            raise ValueError(f"Invalid replica range {min_replicas} to {max_replicas}")
+        # creates the replica with the given index, listening on a port of its own
+        self.create_replica = create_replica
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+
+
+class ReplicaAutoscaler:
+    """Adjusts the number of replicas of the served models to their queue depth.
+
+    Another replica is started when the requests waiting for a free slot exceed the scale up
+    depth per replica, one at a time. A replica beyond the minimum is stopped once it has been
+    idle for the scale down delay. Since requests are routed to the replica with the fewest
+    outstanding requests and ties go to the first replicas, the last ones become idle first.
+    """
+
+    def __init__(
+        self,
+        model_runner: ModelRunner,
+        scale_up_queue_depth: int = 2,
+        scale_down_delay: float = 60,
+        interval: float = AUTOSCALE_INTERVAL,
+    ):
+        self.model_runner = model_runner
+        self.scale_up_queue_depth = scale_up_queue_depth
+        self.scale_down_delay = scale_down_delay
+        self.interval = interval
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-autoscaler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.scale()
+            except Exception as e:
+                logger.error(f"Failed to scale replicas: {e}")
+
+    def scale(self):
+        for serve_path, scaling in list(self.model_runner.scaling.items()):
+            # failed replicas are restarted by the supervisor and not replaced
+            replicas = [
+                m
+                for m in self.model_runner.get_replicas(serve_path)
+                if m.state in (ModelState.STARTING, ModelState.READY, ModelState.FAILED)
+            ]
+            if not replicas:
+                continue
+
+            if len(replicas) < scaling.min_replicas or self._should_scale_up(replicas, scaling):
+                logger.info(f"Starting another replica of the model served at {serve_path}")
+                try:
+                    self.model_runner.add_replica(serve_path)
+                except Exception as e:
+                    logger.error(f"Failed to start another replica of the model served at {serve_path}: {e}")
+                continue
+
+            idle = self._idle_replica(replicas, scaling)
+            if idle is not None:
+                logger.info(f"Stopping idle replica {idle.replica} of the model served at {serve_path}")
+                # a draining replica is neither routed to nor chosen again by the next pass, which
+                # doesn't wait for it to be stopped
+                idle.start_draining()
+                threading.Thread(
+                    target=self._stop_replica, args=(idle,), name=f"scale-down-{idle.port}", daemon=True
+                ).start()
+
+    def _stop_replica(self, replica: ManagedModel):
+        replica.wait_until_idle(SCALE_DOWN_DRAIN_TIMEOUT)
+        try:
+            self.model_runner.stop_model(replica.id)
+        except RuntimeError:
+            # the replica has been stopped in the meantime, e.g. along with the whole model
+            pass
+        except Exception as e:
+            logger.error(f"Failed to stop idle replica {replica.replica} of model {replica.name}: {e}")
+
+    def _should_scale_up(self, replicas: list[ManagedModel], scaling: ReplicaScaling) -> bool:
+        if len(replicas) >= scaling.max_replicas:
+            return False
+        # wait for a starting replica to take over load before starting yet another one
+        if any(m.state == ModelState.STARTING for m in replicas):
+            return False
+        queued = sum(m.admission.queued for m in replicas if m.admission is not None)
+        return queued >= self.scale_up_queue_depth * len(replicas)
+
+    def _idle_replica(self, replicas: list[ManagedModel], scaling: ReplicaScaling) -> Optional[ManagedModel]:
+        if len(replicas) <= scaling.min_replicas:
+            return None
+        now = time.monotonic()
+        last = max(replicas, key=lambda m: m.replica)
+        if last.idle and now - last.last_used >= self.scale_down_delay:
+            return last
+        return None
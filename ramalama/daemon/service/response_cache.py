@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from ramalama.common import generate_sha256
+from ramalama.daemon.logging import logger
+
+if TYPE_CHECKING:
+    from ramalama.config import DaemonConfig
+
+# Largest response cached, larger ones are relayed without being recorded
+MAX_ENTRY_SIZE = 8 * 1024 * 1024
+
+# Separators of the events of streamed responses by content type, replayed one chunk per event
+EVENT_SEPARATORS = {"text/event-stream": b"\n\n", "application/x-ndjson": b"\n"}
+
+MiB = 1024 * 1024
+
+
+def _canonical(value: object) -> object:
+    # JSON doesn't distinguish 0 and 0.0, the cache key shouldn't either
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def parse_json_request(body: object) -> Optional[dict]:
+    """Returns the JSON object sent as the body of a request, or None if it isn't one."""
+    if not isinstance(body, bytes) or not body:
+        return None
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return None
+    return request if isinstance(request, dict) else None
+
+
+def response_cache_key(
+    model_digest: str, method: str, path: str, request: Optional[dict], authorization: Optional[str] = None
+) -> Optional[str]:
+    """Returns the cache key of a request, or None if its response must not be cached.
+
+    Only JSON requests sampling greedily with temperature 0 and a fixed seed are deterministic.
+    The body is canonicalized, so the order of its fields, its whitespace and integral numbers
+    written as floats don't matter. Requests with credentials are only answered from the
+    responses to the same credentials.
+    """
+    if method != "POST" or request is None:
+        return None
+
+    temperature, seed = request.get("temperature"), request.get("seed")
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or temperature != 0:
+        return None
+    # llama.cpp draws a random seed for negative ones
+    if isinstance(seed, bool) or not isinstance(seed, (int, float)) or seed < 0:
+        return None
+    if isinstance(seed, float) and not seed.is_integer():
+        return None
+
+    canonical = json.dumps(_canonical(request), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return generate_sha256(f"{model_digest}\n{path}\n{authorization or ''}\n{canonical}", with_sha_prefix=False)
+
+
+class CachedResponse:
+    __slots__ = ("status", "reason", "headers", "body")
+
+    def __init__(self, status: int, reason: str, headers: list[tuple[str, str]], body: bytes):
+        self.status = status
+        self.reason = reason
+        # end-to-end headers of the upstream response
+        self.headers = headers
+        self.body = body
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(key) + len(value) for key, value in self.headers)
+
+    @property
+    def has_length(self) -> bool:
+        return any(key.lower() == "content-length" for key, _ in self.headers)
+
+    def blocks(self) -> Iterator[bytes]:
+        """Splits the body of a streamed response into its events, other bodies are a single block."""
+        content_type = next((value for key, value in self.headers if key.lower() == "content-type"), "")
+        separator = next((sep for prefix, sep in EVENT_SEPARATORS.items() if content_type.startswith(prefix)), None)
+        if separator is None:
+            if self.body:
+                yield self.body
+            return
+
+        start = 0
+        while start < len(self.body):
+            end = self.body.find(separator, start)
+            end = len(self.body) if end < 0 else end + len(separator)
+            yield self.body[start:end]
+            start = end
+
+    def serialize(self) -> bytes:
+        head = json.dumps({"status": self.status, "reason": self.reason, "headers": self.headers})
+        return head.encode("utf-8") + b"\n" + self.body
+
+    @staticmethod
+    def deserialize(data: bytes) -> "CachedResponse":
+        head, body = data.split(b"\n", 1)
+        fields = json.loads(head)
+        return CachedResponse(fields["status"], fields["reason"], [tuple(h) for h in fields["headers"]], body)
+
+
+class ResponseRecorder:
+    """Records a response while it is relayed to the client, giving up once it grows too large."""
+
+    def __init__(self, max_size: int = MAX_ENTRY_SIZE):
+        self.max_size = max_size
+        self.status = 0
+        self.reason = ""
+        self.headers: list[tuple[str, str]] = []
+        self._blocks: list[bytes] = []
+        self._size = 0
+
+    def start(self, status: int, reason: str, headers: list[tuple[str, str]]):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+    def write(self, block: bytes):
+        if self._size > self.max_size:
+            return
+        self._size += len(block)
+        if self._size > self.max_size:
+            self._blocks.clear()
+        else:
+            self._blocks.append(block)
+
+    def response(self) -> Optional[CachedResponse]:
+        """Returns the recorded response if it can be cached."""
+        if self.status != 200 or self._size > self.max_size:
+            return None
+        return CachedResponse(self.status, self.reason, self.headers, b"".join(self._blocks))
+
+
+class ResponseCache:
+    """Cache of the responses of deterministic requests to the model servers.
+
+    Responses are held in memory up to a total size, evicting the least recently used ones. With
+    a spill directory, evicted responses are written to disk, which is bounded in size as well,
+    and moved back into memory when they are requested again. Responses on disk outlive restarts
+    of the daemon, since their keys include the digest of the model files.
+    """
+
+    def __init__(self, max_size: int, spill_dir: Optional[str] = None, max_spill_size: int = 0):
+        self.max_size = max_size
+        self.max_entry_size = min(MAX_ENTRY_SIZE, max_size)
+        self.spill_dir = spill_dir
+        self.max_spill_size = max_spill_size
+
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._size = 0
+        # sizes of the responses on disk by key, least recently used first
+        self._spilled: OrderedDict[str, int] = OrderedDict()
+        self._spilled_size = 0
+        self._lock = threading.Lock()
+
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._load_spilled()
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._spilled)
+
+    def _load_spilled(self):
+        assert self.spill_dir is not None
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._spilled[key] = size
+            self._spilled_size += size
+        self._trim_spilled()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                return response
+            if key not in self._spilled:
+                return None
+
+            self._spilled_size -= self._spilled.pop(key)
+            path = self._spill_path(key)
+            try:
+                with open(path, "rb") as f:
+                    response = CachedResponse.deserialize(f.read())
+                os.remove(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Failed to read cached response {key}: {e}")
+                return None
+            self._insert(key, response)
+            return response
+
+    def put(self, key: str, response: CachedResponse):
+        if response.size > self.max_entry_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._insert(key, response)
+
+    def _insert(self, key: str, response: CachedResponse):
+        self._entries[key] = response
+        self._size += response.size
+        while self._size > self.max_size:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self._spill(evicted_key, evicted)
+
+    def _spill_path(self, key: str) -> str:
+        assert self.spill_dir is not None
+        return os.path.join(self.spill_dir, key)
+
+    def _spill(self, key: str, response: CachedResponse):
+        if self.spill_dir is None:
+            return
+        data = response.serialize()
+        if len(data) > self.max_spill_size:
+            return
+        path = self._spill_path(key)
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to write cached response {key} to disk: {e}")
+            return
+        self._spilled_size -= self._spilled.pop(key, 0)
+        self._spilled[key] = len(data)
+        self._spilled_size += len(data)
+        self._trim_spilled()
+
+    def _trim_spilled(self):
+        while self._spilled_size > self.max_spill_size:
+            key, size = self._spilled.popitem(last=False)
+            self._spilled_size -= size
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
+
+
+def create_response_cache(config: DaemonConfig) -> Optional[ResponseCache]:
+    if not config.response_cache:
+        return None
+    return ResponseCache(
+        config.response_cache_size_mb * MiB, config.response_cache_dir, config.response_cache_dir_size_mb * MiB
+    )
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.access_log import create_access_log
+from ramalama.daemon.service.model_runner import ModelRunner
+from ramalama.daemon.service.reaper import IdleModelReaper
+from ramalama.daemon.service.replicas import ReplicaAutoscaler
+from ramalama.daemon.service.response_cache import create_response_cache
+from ramalama.daemon.service.state import DaemonStateFile, state_file_path
+from ramalama.daemon.service.supervisor import ModelSupervisor
+
+if TYPE_CHECKING:
+    from ramalama.config import DaemonConfig
+
+
+class DaemonServices:
+    """The parts of the daemon which don't depend on how its clients are served, shared by the
+    threaded and the asyncio server: the settings of the model runner along with the response
+    cache and the access log, and the background threads reaping, scaling and restarting models.
+    """
+
+    def __init__(
+        self, model_runner: ModelRunner, model_store_path: str, idle_check_interval: timedelta, config: DaemonConfig
+    ):
+        self.model_runner = model_runner
+        self.keep_models_on_exit = config.keep_models_on_exit
+
+        model_runner.response_cache = create_response_cache(config)
+        model_runner.access_log = create_access_log(config)
+        model_runner.prefix_affinity_chars = config.prefix_affinity_chars
+        model_runner.embedding_batch_window = config.embedding_batch_window_ms / 1000
+        model_runner.embedding_batch_size = config.embedding_batch_size
+        model_runner.state_file = DaemonStateFile(state_file_path(model_store_path))
+
+        self.reaper = IdleModelReaper(model_runner, idle_check_interval.total_seconds())
+        self.autoscaler = ReplicaAutoscaler(model_runner, config.scale_up_queue_depth, config.scale_down_delay)
+        self.supervisor = ModelSupervisor(model_runner, config.max_restarts, config.restart_backoff)
+
+    def start(self):
+        self.reaper.start()
+        self.autoscaler.start()
+        self.supervisor.start()
+        if self.model_runner.access_log is not None:
+            self.model_runner.access_log.start()
+
+    def stop(self):
+        """Stops the background threads and then the models, unless they are kept running for
+        the next daemon to adopt."""
+        self._stop_threads()
+
+        if self.keep_models_on_exit:
+            logger.info("Leaving the model runners running for the next daemon to adopt...")
+            self.model_runner.detach_models()
+        for name, managed_model in list(self.model_runner.managed_models.items()):
+            try:
+                logger.info(f"Stopping model runner {name}...")
+                self.model_runner.stop_model(managed_model.id)
+            except Exception as e:
+                logger.error(f"Error stopping model runner {name}: {e}")
+
+    def close(self):
+        """Stops the background threads, if they are still running, and writes the remaining
+        entries of the access log once no more requests are served."""
+        self._stop_threads()
+        if self.model_runner.access_log is not None:
+            self.model_runner.access_log.close()
+
+    def _stop_threads(self):
+        self.supervisor.stop()
+        self.autoscaler.stop()
+        self.reaper.stop()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import json
+import os
+import signal
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+from ramalama.daemon.logging import logger
+
+if TYPE_CHECKING:
+    from ramalama.daemon.service.model_runner import ManagedModel
+
+# Name of the file in the model store listing the model servers of the daemon
+STATE_FILE_NAME = "daemon-state.json"
+
+STATE_VERSION = 1
+
+# Interval in seconds at which the exit of an adopted model server is polled
+EXIT_POLL_INTERVAL = 0.05
+
+
+def state_file_path(model_store_path: str) -> str:
+    return os.path.join(model_store_path, STATE_FILE_NAME)
+
+
+def is_process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists, but belongs to another user
+        return True
+    except OSError:
+        return False
+
+    # a zombie has exited already and only waits for its parent to reap it
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+def process_matches(pid: int, cmd: list[str]) -> bool:
+    """Whether the process is running the command, so a reused PID isn't mistaken for a model server.
+    Without procfs only whether the process is running is checked."""
+    if pid <= 0 or not cmd or not is_process_running(pid):
+        return False
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read()
+    except FileNotFoundError:
+        return sys.platform != "linux"
+    except OSError:
+        return False
+
+    args = [arg.decode("utf-8", "replace") for arg in cmdline.split(b"\0") if arg]
+    if len(args) < len(cmd):
+        return False
+    # scripts have their interpreter prepended, and the executable might have been resolved
+    args = args[len(args) - len(cmd) :]
+    return args[1:] == cmd[1:] and os.path.basename(args[0]) == os.path.basename(cmd[0])
+
+
+class AdoptedProcess:
+    """A model server started by a previous daemon, with the parts of the interface of Popen
+    the ModelRunner uses. It isn't a child of this daemon, so its exit is polled."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and not is_process_running(self.pid):
+            # the exit code of a process of another parent is unknown
+            self.returncode = 0
+        return self.returncode
+
+    def _signal(self, signum: int):
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Process {self.pid} did not exit within {timeout}s")
+            time.sleep(EXIT_POLL_INTERVAL)
+        assert self.returncode is not None
+        return self.returncode
+
+
+@dataclass
+class ModelRecord:
+    id: str
+    serve_path: str
+    pid: int
+    port: int
+    replica: int
+    run_cmd: list[str]
+    # the serve request the model server was started for, to create it the same way again
+    serve_request: dict[str, Any]
+    generation: int = 0
+
+
+class DaemonStateFile:
+    """Persists the model servers of the daemon, so a restarted daemon can adopt the ones still
+    running instead of loading their models again."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def save(self, models: list[ManagedModel]):
+        """Replaces the listed model servers, models without a serve request aren't adoptable."""
+        records = [
+            ModelRecord(
+                m.id, m.serve_path, m.process.pid, m.port, m.replica, m.run_cmd, m.serve_request.to_dict(), m.generation
+            )
+            for m in models
+            if m.serve_request is not None and m.serve_path is not None and m.process is not None
+        ]
+        data = json.dumps({"version": STATE_VERSION, "models": [asdict(r) for r in records]}, indent=4)
+        try:
+            with open(f"{self.path}.tmp", "w") as f:
+                f.write(data)
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save the state of the daemon to {self.path}: {e}")
+
+    def load(self) -> list[ModelRecord]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read the state of the daemon from {self.path}: {e}")
+            return []
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            logger.warning(f"Ignoring the state of the daemon in {self.path} of an unknown version")
+            return []
+
+        records = []
+        for entry in data.get("models", []):
+            try:
+                records.append(ModelRecord(**entry))
+            except TypeError as e:
+                logger.warning(f"Ignoring invalid model in the state of the daemon: {e}")
+        return records
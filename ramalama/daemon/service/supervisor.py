@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional
+
+from ramalama.daemon.logging import logger
+from ramalama.daemon.service.model_runner import ManagedModel, ModelRunner, ModelState
+
+# Interval in seconds at which the model servers are checked for having exited
+SUPERVISE_INTERVAL = 0.5
+
+# Upper bound of the delay in seconds before a crashed model server is restarted
+MAX_RESTART_BACKOFF = 60.0
+
+# Seconds within which the crashes of a model server count towards a crash loop
+CRASH_LOOP_WINDOW = 600.0
+
+
+def restart_backoff(crashes: int, backoff: float, max_backoff: float = MAX_RESTART_BACKOFF) -> float:
+    """Returns the delay before restarting a model server after its recent crashes, doubling with
+    every crash."""
+    return min(backoff * 2 ** max(crashes - 1, 0), max_backoff)
+
+
+class ModelSupervisor:
+    """Restarts the model servers which exited unexpectedly, e.g. crashed or were OOM-killed.
+
+    A model whose server exited is marked as failed, so requests aren't routed to its dead port
+    anymore and clients waiting for it are answered right away. It is restarted on the same port
+    after a delay doubling with every recent crash. A model crashing more than max_restarts times
+    within the crash loop window is given up on and stopped, a new serve request starts over.
+    """
+
+    def __init__(
+        self,
+        model_runner: ModelRunner,
+        max_restarts: int = 5,
+        backoff: float = 1.0,
+        interval: float = SUPERVISE_INTERVAL,
+    ):
+        self.model_runner = model_runner
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.interval = interval
+
+        # times of the recent crashes by model ID
+        self._crashes: dict[str, list[float]] = {}
+        # failed models by ID, along with the time they are restarted at
+        self._restarts: dict[str, tuple[ManagedModel, float]] = {}
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="model-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.supervise()
+            except Exception as e:
+                logger.error(f"Failed to supervise the model servers: {e}")
+
+    def supervise(self):
+        now = time.monotonic()
+        models = self.model_runner.managed_models
+        for model in models.values():
+            process = model.process
+            if process is None or process.poll() is None or model.state == ModelState.STOPPED:
+                continue
+            scheduled = self._restarts.get(model.id)
+            if scheduled is not None and scheduled[0] is model:
+                continue
+            if model.mark_failed(process):
+                self._crashed(model, process.returncode, now)
+
+        for model_id, (model, restart_at) in list(self._restarts.items()):
+            if restart_at > now:
+                continue
+            del self._restarts[model_id]
+            logger.info(f"Restarting the model server of {model_id}...")
+            try:
+                self.model_runner.restart_model(model)
+            except Exception as e:
+                logger.error(f"Failed to restart the model server of {model_id}: {e}")
+                # a failed start counts as another crash
+                self._crashed(model, None, now)
+
+        # forget the crashes of models which have been stopped
+        for model_id in list(self._crashes):
+            if model_id not in models and model_id not in self._restarts:
+                del self._crashes[model_id]
+
+    def _crashed(self, model: ManagedModel, returncode: Optional[int], now: float):
+        crashes = [t for t in self._crashes.get(model.id, []) if now - t < CRASH_LOOP_WINDOW] + [now]
+        self._crashes[model.id] = crashes
+        self.model_runner.metrics.model_crashes.inc((model.name,))
+
+        if len(crashes) > self.max_restarts:
+            logger.error(
+                f"Model server of {model.id} exited with code {returncode}, it crashed {len(crashes)} times "
+                f"within {CRASH_LOOP_WINDOW:.0f}s and is not restarted again"
+            )
+            self._crashes.pop(model.id, None)
+            try:
+                self.model_runner.stop_model(model.id)
+            except RuntimeError:
+                # stopped in the meantime
+                pass
+            return
+
+        delay = restart_backoff(len(crashes), self.backoff)
+        logger.error(f"Model server of {model.id} exited with code {returncode}, restarting it in {delay:.1f}s")
+        self._restarts[model.id] = (model, now + delay)
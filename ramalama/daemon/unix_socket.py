@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import errno
+import http.client
+import os
+import socket
+import stat
+import struct
+from typing import Optional, Union
+
+# Timeout in seconds of the check whether a daemon is listening on an existing socket
+STALE_SOCKET_TIMEOUT = 1
+
+
+def _is_listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(STALE_SOCKET_TIMEOUT)
+        try:
+            s.connect(path)
+        except OSError:
+            return False
+        return True
+
+
+def bind_unix_socket(path: str, mode: int) -> socket.socket:
+    """Binds a Unix domain socket at the path, which clients need the permissions of the mode
+    to connect to. The socket of a daemon which didn't shut down cleanly is replaced."""
+    try:
+        existing = os.lstat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        if not stat.S_ISSOCK(existing.st_mode):
+            raise OSError(errno.EEXIST, f"{path} exists and is not a socket")
+        if _is_listening(path):
+            raise OSError(errno.EADDRINUSE, f"Another daemon is listening on {path}")
+        os.unlink(path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        # no connections are accepted before the socket listens
+        os.chmod(path, mode)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def remove_unix_socket(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def peer_address(sock: Optional[socket.socket]) -> tuple[str, int]:
+    """Returns the address of the client of a Unix domain socket connection, which identifies it
+    like the IP address of a TCP client. Clients are told apart by their process where the
+    kernel reports it, otherwise all of them share an address."""
+    if sock is not None and hasattr(socket, "SO_PEERCRED"):
+        try:
+            creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        except OSError:
+            pass
+        else:
+            pid, uid, _ = struct.unpack("3i", creds)
+            return f"unix:{pid}", uid
+    return "unix", 0
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to a daemon listening on a Unix domain socket."""
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        # the host only ends up in the Host header
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def daemon_connection(
+    host: str, port: int, socket_path: Optional[str] = None, timeout: Optional[float] = None
+) -> Union[http.client.HTTPConnection, UnixHTTPConnection]:
+    """Returns a connection to the daemon, over its Unix domain socket if it listens on one and
+    over TCP otherwise. The socket saves the TCP overhead of every request."""
+    if socket_path and hasattr(socket, "AF_UNIX"):
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                return UnixHTTPConnection(socket_path, timeout)
+        except OSError:
+            pass
+    return http.client.HTTPConnection(host, port, timeout=timeout)
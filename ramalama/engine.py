@@ -489,6 +489,19 @@ def is_healthy(args, timeout: int = 3, model_name: Optional[str] = None):
             conn.close()
 
 
+def _wait_for_prewarm(args, timeout: float) -> bool:
+    """Waits for a background prewarm of the model weights, if any, so readiness reflects warmed weights."""
+    prewarmer = getattr(args, "prewarmer", None)
+    if prewarmer is None:
+        return True
+    if not prewarmer.wait(max(timeout, 0)):
+        logger.debug("Server is healthy, still waiting for model weights to be prewarmed...")
+        return False
+    if prewarmer.residency is not None:
+        logger.debug(f"Model weights are {prewarmer.residency:.1%} resident in page cache")
+    return True
+
+
 def wait_for_healthy(args, health_func: Callable[[Any], bool], timeout=None):
     """Waits for a container to become healthy by polling its endpoint."""
     if timeout is None:
@@ -505,7 +518,7 @@ def wait_for_healthy(args, health_func: Callable[[Any], bool], timeout=None):
         try:
             if display_dots:
                 perror('\r' + n * '.', end='', flush=True)
-            if health_func(args):
+            if health_func(args) and _wait_for_prewarm(args, timeout - (time.time() - start_time)):
                 if display_dots:
                     perror('\r' + n * ' ' + '\r', end='', flush=True)
                 return
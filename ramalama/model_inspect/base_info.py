@@ -1,24 +1,117 @@
 from __future__ import annotations
 
+import io
 import json
 import shutil
 import sys
 from dataclasses import dataclass
+from json.encoder import encode_basestring_ascii
+from typing import Any, Optional, TextIO
+
+# Number of leading items shown of large metadata arrays unless all information is requested
+MAX_ARRAY_ITEMS = 16
+
+JSON_INDENT = 4
+_JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
 
 
 def get_terminal_width():
     return shutil.get_terminal_size().columns if sys.stdout.isatty() else 80
 
 
-def adjust_new_line(line: str) -> str:
+def adjust_new_line(line: str, max_width: Optional[int] = None) -> str:
     filler = "..."
-    max_width = get_terminal_width()
+    if max_width is None:
+        max_width = get_terminal_width()
     adjusted_length = max_width - len(filler)
 
-    adjust_for_newline = 1 if line.endswith("\n") else 0
-    if len(line) - adjust_for_newline > max_width:
-        return line[: adjusted_length - adjust_for_newline] + filler + "\n" if adjust_for_newline == 1 else ""
-    return line if line.endswith("\n") else line + "\n"
+    line = line[:-1] if line.endswith("\n") else line
+    if len(line) > max_width:
+        return line[:adjusted_length] + filler + "\n"
+    return line + "\n"
+
+
+def truncate_array(value: Any, max_items: int = MAX_ARRAY_ITEMS) -> Any:
+    """Returns the leading items of large arrays followed by a marker of how many were omitted."""
+    if not isinstance(value, list) or len(value) <= max_items:
+        return value
+    return value[:max_items] + [f"... ({len(value) - max_items} more)"]
+
+
+class InfoWriter:
+    """Collects the lines of the human readable inspect output and joins them once at the end."""
+
+    def __init__(self) -> None:
+        self._lines: list[str] = []
+        self._max_width = get_terminal_width()
+
+    def write(self, line: str) -> None:
+        self._lines.append(adjust_new_line(line, self._max_width))
+
+    def getvalue(self) -> str:
+        return "".join(self._lines)
+
+
+def _encode_scalar(value: Any) -> str:
+    # bypasses the setup of a json encoder for the most common scalar types
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    return json.dumps(value)
+
+
+def write_json(sink: TextIO, value: Any, level: int = 0) -> None:
+    """Writes value to sink exactly like json.dumps(value, sort_keys=True, indent=4) would, objects
+    are encoded by their __dict__.
+
+    The indented encoder of the json module runs in pure Python, so containers are emitted
+    incrementally here and large arrays of scalars, e.g. token vocabularies, in a single pass of
+    the C encoder with the indentation as item separator.
+    """
+    if isinstance(value, _JSON_SCALAR_TYPES):
+        sink.write(_encode_scalar(value))
+        return
+    if not isinstance(value, (dict, list, tuple)):
+        value = value.__dict__
+    if not value:
+        sink.write("{}" if isinstance(value, dict) else "[]")
+        return
+
+    inner = "\n" + " " * (JSON_INDENT * (level + 1))
+    if isinstance(value, dict):
+        separator = "{" + inner
+        for key in sorted(value):
+            sink.write(separator)
+            sink.write(encode_basestring_ascii(key if isinstance(key, str) else str(key)))
+            sink.write(": ")
+            write_json(sink, value[key], level + 1)
+            separator = "," + inner
+        sink.write("\n" + " " * (JSON_INDENT * level) + "}")
+        return
+
+    if len(value) > MAX_ARRAY_ITEMS and all(isinstance(item, _JSON_SCALAR_TYPES) for item in value):
+        sink.write("[" + inner)
+        sink.write(json.dumps(value, separators=("," + inner, ": "))[1:-1])
+    else:
+        separator = "[" + inner
+        for item in value:
+            sink.write(separator)
+            write_json(sink, item, level + 1)
+            separator = "," + inner
+    sink.write("\n" + " " * (JSON_INDENT * level) + "]")
+
+
+def dump_json(value: Any) -> str:
+    sink = io.StringIO()
+    write_json(sink, value)
+    return sink.getvalue()
 
 
 @dataclass
@@ -40,10 +133,14 @@ class ModelInfoBase:
         if json:
             return self.to_json()
 
-        ret = adjust_new_line(f"{self.Name}\n")
-        ret = ret + adjust_new_line(f"   Path: {self.Path}\n")
-        ret = ret + adjust_new_line(f"   Registry: {self.Registry}")
-        return ret
+        writer = InfoWriter()
+        self.write_info(writer)
+        return writer.getvalue()
+
+    def write_info(self, writer: InfoWriter) -> None:
+        writer.write(f"{self.Name}")
+        writer.write(f"   Path: {self.Path}")
+        writer.write(f"   Registry: {self.Registry}")
 
     def to_json(self) -> str:
         return json.dumps(self.__dict__, sort_keys=True, indent=4)
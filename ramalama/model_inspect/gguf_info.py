@@ -4,7 +4,7 @@ from json import dumps
 from typing import Any, Dict, Optional, Union
 
 from ramalama.endian import GGUFEndian
-from ramalama.model_inspect.base_info import ModelInfoBase, Tensor, adjust_new_line
+from ramalama.model_inspect.base_info import InfoWriter, ModelInfoBase, Tensor, dump_json, truncate_array
 
 
 class GGUFModelMetadata:
@@ -14,14 +14,15 @@ class GGUFModelMetadata:
     def get(self, key: str) -> Any:
         return self.data.get(key)
 
-    def serialize(self, json: bool = False) -> str:
+    def serialize(self, json: bool = False, all: bool = False) -> str:
+        data = self.data if all else {key: truncate_array(value) for key, value in self.data.items()}
         if json:
-            return dumps(self.data, sort_keys=True, indent=4)
+            return dump_json(data)
 
-        ret = ""
-        for key, value in sorted(self.data.items()):
-            ret = ret + adjust_new_line(f"{key}: {value}")
-        return ret
+        writer = InfoWriter()
+        for key, value in sorted(data.items()):
+            writer.write(f"{key}: {value}")
+        return writer.getvalue()
 
 
 class GGUFModelInfo(ModelInfoBase):
@@ -60,34 +61,30 @@ class GGUFModelInfo(ModelInfoBase):
         if json:
             return self.to_json(all)
 
-        ret = super().serialize()
-        ret = ret + adjust_new_line(f"   Format: {GGUFModelInfo.MAGIC_NUMBER}")
-        ret = ret + adjust_new_line(f"   Version: {GGUFModelInfo.VERSION}")
-        ret = ret + adjust_new_line(f"   Endianness: {'little' if self.Endianness == GGUFEndian.LITTLE else 'big'}")
-        metadata_header = "   Metadata: "
-        if not all:
-            metadata_header = metadata_header + f"{len(self.Metadata.data)} entries"
-        ret = ret + adjust_new_line(metadata_header)
-        if all:
-            for key, value in sorted(self.Metadata.data.items()):
-                ret = ret + adjust_new_line(f"      {key}: {value}")
-        tensor_header = "   Tensors: "
+        writer = InfoWriter()
+        self.write_info(writer, all)
+        return writer.getvalue()
+
+    def write_info(self, writer: InfoWriter, all: bool = False) -> None:
+        super().write_info(writer)
+        writer.write(f"   Format: {GGUFModelInfo.MAGIC_NUMBER}")
+        writer.write(f"   Version: {GGUFModelInfo.VERSION}")
+        writer.write(f"   Endianness: {'little' if self.Endianness == GGUFEndian.LITTLE else 'big'}")
         if not all:
-            tensor_header = tensor_header + f"{len(self.Tensors)} entries"
-        ret = ret + adjust_new_line(tensor_header)
-        if all:
-            i = 0
-            for tensor in self.Tensors:
-                ret = ret + adjust_new_line(
-                    f"      {i}: {tensor.name, tensor.type, tensor.n_dimensions, tensor.offset}"
-                )
-                i = i + 1
+            writer.write(f"   Metadata: {len(self.Metadata.data)} entries")
+            writer.write(f"   Tensors: {len(self.Tensors)} entries")
+            return
 
-        return ret
+        writer.write("   Metadata: ")
+        for key, value in sorted(self.Metadata.data.items()):
+            writer.write(f"      {key}: {value}")
+        writer.write("   Tensors: ")
+        for i, tensor in enumerate(self.Tensors):
+            writer.write(f"      {i}: {tensor.name, tensor.type, tensor.n_dimensions, tensor.offset}")
 
     def to_json(self, all: bool = False) -> str:
         if all:
-            return dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+            return dump_json(self)
 
         d = {k: v for k, v in self.__dict__.items() if k != "Metadata" and k != "Tensors"}
         d["Metadata"] = len(self.Metadata.data)
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import array
 import io
+import mmap
 import struct
+from contextlib import contextmanager
 from enum import IntEnum
-from typing import Any, Dict, cast
+from typing import Any, Dict, Iterator, Union, cast
 
-from ramalama.endian import GGUFEndian
+from ramalama.endian import GGUFEndian, get_system_endianness
 from ramalama.logger import logger
 from ramalama.model_inspect.error import ParseError
 from ramalama.model_inspect.gguf_info import GGUFModelInfo, GGUFModelMetadata, Tensor
@@ -98,6 +101,22 @@ GGUF_VALUE_TYPE_FORMAT: Dict[GGUFValueType, str] = {
     GGUFValueType.FLOAT64: "d",
 }
 
+# Numeric array element types which can be decoded in bulk via array.array. The typecodes
+# match the struct format characters, their item size is verified at import time since
+# array.array uses native C sizes.
+GGUF_ARRAY_TYPECODES: Dict[GGUFValueType, str] = {
+    value_type: typecode
+    for value_type, typecode in GGUF_VALUE_TYPE_FORMAT.items()
+    if value_type != GGUFValueType.BOOL and array.array(typecode).itemsize == struct.calcsize(f"<{typecode}")
+}
+
+# Metadata key and default value of the tensor data alignment
+GGUF_ALIGNMENT_KEY = "general.alignment"
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# Either a regular binary file or a read-only memory map of the model file
+GGUFReader = Union[io.BufferedReader, mmap.mmap]
+
 GGUF_NUMBER_FORMATS: list[GGUFValueType] = [
     GGUFValueType.UINT8,
     GGUFValueType.INT8,
@@ -124,9 +143,7 @@ class GGUFInfoParser:
             return False
 
     @staticmethod
-    def read_string(
-        model: io.BufferedReader, model_endianness: GGUFEndian = GGUFEndian.LITTLE, length: int = -1
-    ) -> str:
+    def read_string(model: GGUFReader, model_endianness: GGUFEndian = GGUFEndian.LITTLE, length: int = -1) -> str:
         if length == -1:
             length = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
 
@@ -137,7 +154,7 @@ class GGUFInfoParser:
         return raw.decode("utf-8")
 
     @staticmethod
-    def read_number(model: io.BufferedReader, value_type: GGUFValueType, model_endianness: GGUFEndian) -> float | int:
+    def read_number(model: GGUFReader, value_type: GGUFValueType, model_endianness: GGUFEndian) -> float | int:
         if value_type not in GGUF_NUMBER_FORMATS:
             raise ParseError(f"Value type '{value_type}' not in format dict")
 
@@ -146,7 +163,7 @@ class GGUFInfoParser:
         return struct.unpack(typestring, model.read(struct.calcsize(typestring)))[0]
 
     @staticmethod
-    def read_bool(model: io.BufferedReader, model_endianness: GGUFEndian) -> bool:
+    def read_bool(model: GGUFReader, model_endianness: GGUFEndian) -> bool:
         prefix = '<' if model_endianness == GGUFEndian.LITTLE else '>'
         typestring = f"{prefix}{GGUF_VALUE_TYPE_FORMAT[GGUFValueType.BOOL]}"
         value = struct.unpack(typestring, model.read(struct.calcsize(typestring)))[0]
@@ -155,13 +172,13 @@ class GGUFInfoParser:
         return value == 1
 
     @staticmethod
-    def read_value_type(model: io.BufferedReader, model_endianness: GGUFEndian) -> GGUFValueType:
+    def read_value_type(model: GGUFReader, model_endianness: GGUFEndian) -> GGUFValueType:
         value_type = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT32, model_endianness))
         return GGUFValueType(value_type)
 
     @staticmethod
     def read_value(
-        model: io.BufferedReader, value_type: GGUFValueType, model_endianness: GGUFEndian
+        model: GGUFReader, value_type: GGUFValueType, model_endianness: GGUFEndian
     ) -> str | int | float | bool | list:
         value: Any
         if value_type in GGUF_NUMBER_FORMATS:
@@ -171,14 +188,91 @@ class GGUFInfoParser:
         elif value_type == GGUFValueType.STRING:
             value = GGUFInfoParser.read_string(model, model_endianness)
         elif value_type == GGUFValueType.ARRAY:
-            array_type = GGUFInfoParser.read_value_type(model, model_endianness)
-            array_length = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
-            value = [GGUFInfoParser.read_value(model, array_type, model_endianness) for _ in range(array_length)]
+            value = GGUFInfoParser.read_array(model, model_endianness)
         else:
             raise ParseError(f"Unknown type '{value_type}'")
 
         return value
 
+    @staticmethod
+    def read_array(model: GGUFReader, model_endianness: GGUFEndian) -> list:
+        array_type = GGUFInfoParser.read_value_type(model, model_endianness)
+        array_length = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
+
+        if array_type in GGUF_ARRAY_TYPECODES:
+            return GGUFInfoParser._read_number_array(model, array_type, array_length, model_endianness)
+        if array_type == GGUFValueType.BOOL:
+            return GGUFInfoParser._read_bool_array(model, array_length)
+        if array_type == GGUFValueType.STRING and isinstance(model, mmap.mmap):
+            return GGUFInfoParser._read_string_array(model, array_length, model_endianness)
+
+        # nested arrays and plain file readers are decoded element by element
+        return [GGUFInfoParser.read_value(model, array_type, model_endianness) for _ in range(array_length)]
+
+    @staticmethod
+    def _read_exact(model: GGUFReader, length: int) -> bytes:
+        raw = model.read(length)
+        if len(raw) < length:
+            raise ParseError(f"Unexpected EOF: wanted {length} bytes, got {len(raw)}")
+        return raw
+
+    @staticmethod
+    def _read_number_array(
+        model: GGUFReader, value_type: GGUFValueType, length: int, model_endianness: GGUFEndian
+    ) -> list:
+        values = array.array(GGUF_ARRAY_TYPECODES[value_type])
+        values.frombytes(GGUFInfoParser._read_exact(model, length * values.itemsize))
+        if model_endianness != get_system_endianness():
+            values.byteswap()
+        return values.tolist()
+
+    @staticmethod
+    def _read_bool_array(model: GGUFReader, length: int) -> list:
+        raw = GGUFInfoParser._read_exact(model, length)
+        if raw.translate(None, b"\x00\x01"):
+            raise ParseError("Invalid bool value in array")
+        return [value == 1 for value in raw]
+
+    @staticmethod
+    def _read_string_array(buffer: mmap.mmap, length: int, model_endianness: GGUFEndian) -> list:
+        # Decode all strings in a single pass over the mapped file instead of issuing
+        # two reads per element, this matters for vocabularies with >100k tokens.
+        unpack_length = struct.Struct(f"{'<' if model_endianness == GGUFEndian.LITTLE else '>'}Q").unpack_from
+        size = len(buffer)
+        pos = buffer.tell()
+        values: list[str] = []
+        append = values.append
+        for _ in range(length):
+            if pos + 8 > size:
+                raise ParseError("Unexpected EOF while reading string array")
+            (str_length,) = unpack_length(buffer, pos)
+            pos += 8
+            end = pos + str_length
+            if end > size:
+                raise ParseError(f"Unexpected EOF: wanted {str_length} bytes, got {size - pos}")
+            append(buffer[pos:end].decode("utf-8"))
+            pos = end
+        buffer.seek(pos)
+        return values
+
+    @staticmethod
+    @contextmanager
+    def _open_model(model_path: str) -> Iterator[GGUFReader]:
+        with open(model_path, "rb") as model_file:
+            buffer: mmap.mmap | None = None
+            try:
+                buffer = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as ex:
+                # e.g. empty files or file systems without mmap support
+                logger.debug(f"Failed to mmap '{model_path}', falling back to buffered reads: {ex}")
+
+            if buffer is None:
+                yield model_file
+                return
+
+            with buffer:
+                yield buffer
+
     @staticmethod
     def get_model_endianness(model_path: str) -> GGUFEndian:
         # Pin model endianness to Little Endian by default.
@@ -197,7 +291,7 @@ class GGUFInfoParser:
         return model_endianness
 
     @staticmethod
-    def _parse_metadata(reader: io.BufferedReader, model_endianness: GGUFEndian) -> Dict[str, Any]:
+    def _parse_metadata(reader: GGUFReader, model_endianness: GGUFEndian) -> Dict[str, Any]:
         metadata_kv_count = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, model_endianness))
         metadata = {}
         for _ in range(metadata_kv_count):
@@ -210,7 +304,7 @@ class GGUFInfoParser:
     def parse_metadata(model_path: str) -> GGUFModelMetadata:
         model_endianness = GGUFInfoParser.get_model_endianness(model_path)
 
-        with open(model_path, "rb") as model:
+        with GGUFInfoParser._open_model(model_path) as model:
             magic_number = GGUFInfoParser.read_string(model, model_endianness, 4)
             if magic_number != GGUFModelInfo.MAGIC_NUMBER:
                 raise ParseError(f"Invalid GGUF magic number '{magic_number}'")
@@ -222,33 +316,67 @@ class GGUFInfoParser:
             return GGUFModelMetadata(GGUFInfoParser._parse_metadata(model, model_endianness))
 
     @staticmethod
-    def parse(model_name: str, model_registry: str, model_path: str) -> GGUFModelInfo:
+    def _parse_tensors(reader: GGUFReader, tensor_count: int, model_endianness: GGUFEndian) -> list[Tensor]:
+        tensors: list[Tensor] = []
+        for _ in range(tensor_count):
+            name = GGUFInfoParser.read_string(reader, model_endianness)
+            n_dimensions = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT32, model_endianness))
+            dimensions: list[int] = []
+            for _ in range(n_dimensions):
+                dim = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, model_endianness))
+                dimensions.append(dim)
+            tensor_type = GGML_TYPE(
+                cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT32, model_endianness))
+            )
+
+            offset = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, model_endianness))
+            tensors.append(Tensor(name, n_dimensions, dimensions, tensor_type.name, offset))
+        return tensors
+
+    @staticmethod
+    def _parse_header(
+        reader: GGUFReader, model_endianness: GGUFEndian
+    ) -> tuple[int, Dict[str, Any], list[Tensor], int]:
+        """Parses the complete GGUF header and returns the version, metadata, tensor infos and the
+        absolute offset of the tensor data section."""
+        magic_number = GGUFInfoParser.read_string(reader, model_endianness, 4)
+        if magic_number != GGUFModelInfo.MAGIC_NUMBER:
+            raise ParseError(f"Invalid GGUF magic number '{magic_number}'")
+
+        gguf_version = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT32, model_endianness))
+
+        tensor_count = cast(int, GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, model_endianness))
+        metadata = GGUFInfoParser._parse_metadata(reader, model_endianness)
+        tensors = GGUFInfoParser._parse_tensors(reader, tensor_count, model_endianness)
+
+        alignment = metadata.get(GGUF_ALIGNMENT_KEY, GGUF_DEFAULT_ALIGNMENT)
+        position = reader.tell()
+        data_offset = position + (alignment - position % alignment) % alignment
+        return gguf_version, metadata, tensors, data_offset
+
+    @staticmethod
+    def get_tensor_data_ranges(model_path: str) -> list[tuple[int, int]]:
+        """Returns the absolute (start, end) byte ranges of all tensors in the model file ordered by offset.
+
+        A tensor range spans up to the start of the next tensor (including alignment padding), the
+        last one spans up to the end of the file."""
         model_endianness = GGUFInfoParser.get_model_endianness(model_path)
 
-        with open(model_path, "rb") as model:
-            magic_number = GGUFInfoParser.read_string(model, model_endianness, 4)
-            if magic_number != GGUFModelInfo.MAGIC_NUMBER:
-                raise ParseError(f"Invalid GGUF magic number '{magic_number}'")
+        with GGUFInfoParser._open_model(model_path) as model:
+            _, _, tensors, data_offset = GGUFInfoParser._parse_header(model, model_endianness)
+            model.seek(0, io.SEEK_END)
+            file_size = model.tell()
 
-            gguf_version = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT32, model_endianness))
+        starts = sorted(data_offset + tensor.offset for tensor in tensors)
+        ends = starts[1:] + [file_size]
+        return [(start, end) for start, end in zip(starts, ends) if start < end]
+
+    @staticmethod
+    def parse(model_name: str, model_registry: str, model_path: str) -> GGUFModelInfo:
+        model_endianness = GGUFInfoParser.get_model_endianness(model_path)
 
-            tensor_count = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
-            metadata = GGUFInfoParser._parse_metadata(model, model_endianness)
-
-            tensors: list[Tensor] = []
-            for _ in range(tensor_count):
-                name = GGUFInfoParser.read_string(model, model_endianness)
-                n_dimensions = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT32, model_endianness))
-                dimensions: list[int] = []
-                for _ in range(n_dimensions):
-                    dim = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
-                    dimensions.append(dim)
-                tensor_type = GGML_TYPE(
-                    cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT32, model_endianness))
-                )
-
-                offset = cast(int, GGUFInfoParser.read_number(model, GGUFValueType.UINT64, model_endianness))
-                tensors.append(Tensor(name, n_dimensions, dimensions, tensor_type.name, offset))
+        with GGUFInfoParser._open_model(model_path) as model:
+            gguf_version, metadata, tensors, _ = GGUFInfoParser._parse_header(model, model_endianness)
 
             return GGUFModelInfo(
                 model_name, model_registry, model_path, gguf_version, metadata, tensors, model_endianness
@@ -3,7 +3,7 @@ from __future__ import annotations
 import json
 from typing import Any, Dict
 
-from ramalama.model_inspect.base_info import ModelInfoBase, adjust_new_line
+from ramalama.model_inspect.base_info import InfoWriter, ModelInfoBase, dump_json
 
 
 class SafetensorModelInfo(ModelInfoBase):
@@ -22,27 +22,69 @@ class SafetensorModelInfo(ModelInfoBase):
         if json:
             return self.to_json(all)
 
+        writer = InfoWriter()
+        self.write_info(writer, all)
+        return writer.getvalue()
+
+    def write_info(self, writer: InfoWriter, all: bool = False) -> None:
         fmt = ""
         metadata = self.Header.get("__metadata__", {})
         if isinstance(metadata, dict):
             fmt = metadata.get("format", "")
 
-        ret = super().serialize()
-        ret = ret + adjust_new_line(f"   Format: {fmt}")
-        metadata_header = "   Header: "
+        super().write_info(writer)
+        writer.write(f"   Format: {fmt}")
         if not all:
-            metadata_header = metadata_header + f"{len(self.Header)} entries"
-        ret = ret + adjust_new_line(metadata_header)
-        if all:
-            for key, value in sorted(self.Header.items()):
-                ret = ret + adjust_new_line(f"      {key}: {value}")
+            writer.write(f"   Header: {len(self.Header)} entries")
+            return
 
-        return ret
+        writer.write("   Header: ")
+        for key, value in sorted(self.Header.items()):
+            writer.write(f"      {key}: {value}")
 
     def to_json(self, all: bool = False) -> str:
         if all:
-            return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+            return dump_json(self)
 
         d = {k: v for k, v in self.__dict__.items() if k != "Header"}
         d["Metadata"] = len(self.Header)
         return json.dumps(d, sort_keys=True, indent=4)
+
+
+def summarize_tensors(tensors: Dict[str, Any]) -> tuple[int, Dict[str, Dict[str, int]]]:
+    """Returns the total parameter count and a per dtype breakdown of tensor and parameter counts."""
+    total = 0
+    dtypes: Dict[str, Dict[str, int]] = {}
+    for tensor in tensors.values():
+        parameters = 1
+        for dim in tensor.get("shape", []):
+            parameters *= dim
+        total += parameters
+        breakdown = dtypes.setdefault(tensor.get("dtype", "unknown"), {"tensors": 0, "parameters": 0})
+        breakdown["tensors"] += 1
+        breakdown["parameters"] += parameters
+    return total, dtypes
+
+
+class ShardedSafetensorModelInfo(SafetensorModelInfo):
+    def __init__(
+        self,
+        Name: str,
+        Registry: str,
+        Path: str,
+        tensors: Dict[str, Any],
+        metadata: Dict[str, Any],
+        shards: list[str],
+    ):
+        super().__init__(Name, Registry, Path, {"__metadata__": metadata, **tensors})
+
+        self.Shards: list[str] = shards
+        self.Parameters, self.Dtypes = summarize_tensors(tensors)
+
+    def write_info(self, writer: InfoWriter, all: bool = False) -> None:
+        super().write_info(writer, all)
+        writer.write(f"   Shards: {len(self.Shards)}")
+        writer.write(f"   Parameters: {self.Parameters}")
+        writer.write("   Dtypes: ")
+        for dtype, breakdown in sorted(self.Dtypes.items()):
+            writer.write(f"      {dtype}: {breakdown['tensors']} tensors, {breakdown['parameters']} parameters")
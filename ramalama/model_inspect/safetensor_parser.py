@@ -1,15 +1,23 @@
 from __future__ import annotations
 
 import json
+import os
 import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
 
 import ramalama.console as console
 from ramalama.model_inspect.error import ParseError
-from ramalama.model_inspect.safetensor_info import SafetensorModelInfo
+from ramalama.model_inspect.safetensor_info import SafetensorModelInfo, ShardedSafetensorModelInfo
 
 # Based on safetensor format description:
 # https://github.com/huggingface/safetensors?tab=readme-ov-file#format
 
+SAFETENSORS_INDEX_SUFFIX = ".safetensors.index.json"
+
+# Shards are read concurrently since each of them can be located on a different disk
+MAX_HEADER_READ_WORKERS = 16
+
 
 class SafetensorInfoParser:
     @staticmethod
@@ -18,19 +26,65 @@ class SafetensorInfoParser:
         # There is no magic number or something similar, so we only rely on the naming of the file here
         return model_name.endswith(".safetensor") or model_name.endswith(".safetensors")
 
+    @staticmethod
+    def read_header(model_path: str) -> Dict[str, Any]:
+        with open(model_path, "rb") as model_file:
+            prefix = '<'
+            typestring = f"{prefix}Q"
+
+            raw_size = model_file.read(8)
+            if len(raw_size) < 8:
+                raise ParseError(f"Unexpected EOF: wanted 8 bytes, got {len(raw_size)}")
+            header_size = struct.unpack(typestring, raw_size)[0]
+            return json.loads(model_file.read(header_size))
+
     @staticmethod
     def parse(model_name: str, model_registry: str, model_path: str) -> SafetensorModelInfo:
         try:
-            with open(model_path, "rb") as model_file:
-                prefix = '<'
-                typestring = f"{prefix}Q"
+            header = SafetensorInfoParser.read_header(model_path)
+            return SafetensorModelInfo(model_name, model_registry, model_path, header)
+
+        except Exception as ex:
+            msg = f"Failed to parse safetensor model '{model_path}': {ex}"
+            console.warning(msg)
+            raise ParseError(msg)
+
+    @staticmethod
+    def parse_sharded(model_name: str, model_registry: str, index_path: str) -> ShardedSafetensorModelInfo:
+        """Parses a sharded safetensor model described by its model.safetensors.index.json.
+
+        The headers of all shards are read concurrently and merged into a single tensor table.
+        Shards are resolved relative to the directory of the index file.
+        """
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
 
-                header_size = struct.unpack(typestring, model_file.read(8))[0]
-                header = json.loads(model_file.read(header_size))
+            weight_map: Dict[str, str] = index.get("weight_map", {})
+            if not weight_map:
+                raise ParseError("Index contains no weight_map")
 
-                return SafetensorModelInfo(model_name, model_registry, model_path, header)
+            shard_names = sorted(set(weight_map.values()))
+            shard_dir = os.path.dirname(index_path)
+            shard_paths = [os.path.join(shard_dir, name) for name in shard_names]
+            with ThreadPoolExecutor(max_workers=min(MAX_HEADER_READ_WORKERS, len(shard_paths))) as executor:
+                headers = list(executor.map(SafetensorInfoParser.read_header, shard_paths))
+
+            tensors: Dict[str, Any] = {}
+            for shard_name, header in zip(shard_names, headers):
+                for tensor_name, tensor_info in header.items():
+                    if tensor_name == "__metadata__":
+                        continue
+                    tensors[tensor_name] = {**tensor_info, "shard": shard_name}
+
+            missing = [name for name in weight_map if name not in tensors]
+            if missing:
+                raise ParseError(f"{len(missing)} tensors of the index are missing in shards, e.g. '{missing[0]}'")
+
+            metadata = {**(headers[0].get("__metadata__") or {}), **(index.get("metadata") or {})}
+            return ShardedSafetensorModelInfo(model_name, model_registry, index_path, tensors, metadata, shard_names)
 
         except Exception as ex:
-            msg = f"Failed to parse safetensor model '{model_path}': {ex}"
+            msg = f"Failed to parse sharded safetensor model '{index_path}': {ex}"
             console.warning(msg)
             raise ParseError(msg)
@@ -3,3 +3,7 @@ from __future__ import annotations
 DIRECTORY_NAME_BLOBS = "blobs"
 DIRECTORY_NAME_REFS = "refs"
 DIRECTORY_NAME_SNAPSHOTS = "snapshots"
+
+# Replaced whenever a model is added to or removed from the store, so other processes can
+# cheaply detect changes of the store by its inode and mtime
+FILE_NAME_GENERATION = ".generation"
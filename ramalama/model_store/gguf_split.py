@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Optional
+
+from ramalama.endian import GGUFEndian
+from ramalama.logger import logger
+from ramalama.model_inspect.error import ParseError
+from ramalama.model_inspect.gguf_info import GGUFModelInfo
+from ramalama.model_inspect.gguf_parser import (
+    GGML_TYPE,
+    GGUF_ALIGNMENT_KEY,
+    GGUF_DEFAULT_ALIGNMENT,
+    GGUF_VALUE_TYPE_FORMAT,
+    GGUFInfoParser,
+    GGUFValueType,
+)
+
+# Metadata keys used by llama.cpp (gguf-split) to describe split models
+SPLIT_KEY_NO = "split.no"
+SPLIT_KEY_COUNT = "split.count"
+SPLIT_KEY_TENSORS_COUNT = "split.tensors.count"
+SPLIT_KEYS = (SPLIT_KEY_NO, SPLIT_KEY_COUNT, SPLIT_KEY_TENSORS_COUNT)
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Name of any shard of a split model, unlike SPLIT_MODEL_PATH_RE which only matches the first one
+SHARD_NAME_RE = re.compile(r'-\d{5}-of-\d{5}\.gguf$')
+
+
+def split_file_name(prefix: str, index: int, count: int) -> str:
+    """Returns the llama.cpp compatible name of a shard, index is 1-based."""
+    return f"{prefix}-{index:05d}-of-{count:05d}.gguf"
+
+
+def _pad(size: int, alignment: int) -> int:
+    return size + (alignment - size % alignment) % alignment
+
+
+@dataclass
+class GGUFTensorEntry:
+    name: str
+    dimensions: list[int]
+    type: int
+    # absolute offset and length (including alignment padding) of the tensor data in source_path
+    source_path: str
+    source_offset: int
+    size: int
+
+
+@dataclass
+class GGUFLayout:
+    path: str
+    endianness: GGUFEndian
+    version: int
+    alignment: int
+    metadata: Dict[str, Any]
+    # raw encoded key, value type and value of all metadata entries in file order
+    kv_entries: Dict[str, bytes]
+    tensors: list[GGUFTensorEntry]
+
+    @property
+    def prefix(self) -> str:
+        return '<' if self.endianness == GGUFEndian.LITTLE else '>'
+
+    @property
+    def split_count(self) -> int:
+        return int(self.metadata.get(SPLIT_KEY_COUNT, 0))
+
+
+def read_gguf_layout(model_path: str) -> GGUFLayout:
+    """Reads the header of a GGUF file, keeping the raw metadata entries so they can be copied
+    as-is and the location of every tensor's data. Tensor data itself is not read."""
+    endianness = GGUFInfoParser.get_model_endianness(model_path)
+
+    with GGUFInfoParser._open_model(model_path) as reader:
+        magic_number = GGUFInfoParser.read_string(reader, endianness, 4)
+        if magic_number != GGUFModelInfo.MAGIC_NUMBER:
+            raise ParseError(f"Invalid GGUF magic number '{magic_number}'")
+
+        version = int(GGUFInfoParser.read_number(reader, GGUFValueType.UINT32, endianness))
+        tensor_count = int(GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, endianness))
+        kv_count = int(GGUFInfoParser.read_number(reader, GGUFValueType.UINT64, endianness))
+
+        metadata: Dict[str, Any] = {}
+        kv_entries: Dict[str, bytes] = {}
+        for _ in range(kv_count):
+            start = reader.tell()
+            key = GGUFInfoParser.read_string(reader, endianness)
+            value_type = GGUFInfoParser.read_value_type(reader, endianness)
+            metadata[key] = GGUFInfoParser.read_value(reader, value_type, endianness)
+            end = reader.tell()
+            reader.seek(start)
+            kv_entries[key] = reader.read(end - start)
+
+        tensor_infos = GGUFInfoParser._parse_tensors(reader, tensor_count, endianness)
+        alignment = int(metadata.get(GGUF_ALIGNMENT_KEY, GGUF_DEFAULT_ALIGNMENT))
+        data_offset = _pad(reader.tell(), alignment)
+        file_size = os.path.getsize(model_path)
+
+    # The size of a tensor is derived from the offset of the next tensor, so quantization block
+    # sizes don't need to be known here. The last tensor spans to the end of the file.
+    offsets = sorted({info.offset for info in tensor_infos})
+    next_offset = dict(zip(offsets, offsets[1:] + [file_size - data_offset]))
+    tensors = [
+        GGUFTensorEntry(
+            name=info.name,
+            dimensions=info.dimensions,
+            type=int(GGML_TYPE[info.type]),
+            source_path=model_path,
+            source_offset=data_offset + info.offset,
+            size=next_offset[info.offset] - info.offset,
+        )
+        for info in tensor_infos
+    ]
+    if any(tensor.size < 0 or tensor.source_offset + tensor.size > file_size for tensor in tensors):
+        raise ParseError(f"Tensor data of '{model_path}' exceeds the file size")
+
+    return GGUFLayout(model_path, endianness, version, alignment, metadata, kv_entries, tensors)
+
+
+def _encode_string(value: str, prefix: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack(f"{prefix}Q", len(raw)) + raw
+
+
+def _encode_kv(key: str, value_type: GGUFValueType, value: int, prefix: str) -> bytes:
+    return (
+        _encode_string(key, prefix)
+        + struct.pack(f"{prefix}I", value_type)
+        + struct.pack(f"{prefix}{GGUF_VALUE_TYPE_FORMAT[value_type]}", value)
+    )
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, length: int) -> None:
+    if hasattr(os, "copy_file_range"):
+        dst.flush()
+        try:
+            while length > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), min(length, COPY_CHUNK_SIZE), offset)
+                if copied == 0:
+                    raise ParseError(f"Unexpected EOF in '{src.name}' at offset {offset}")
+                offset += copied
+                length -= copied
+            # copy_file_range writes at the file descriptor position, sync the buffered writer with it
+            dst.seek(0, os.SEEK_END)
+            return
+        except OSError as ex:
+            # e.g. cross file system copies on older kernels, continue with a plain copy
+            logger.debug(f"copy_file_range failed, falling back to buffered copy: {ex}")
+            dst.seek(0, os.SEEK_END)
+
+    src.seek(offset)
+    while length > 0:
+        chunk = src.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise ParseError(f"Unexpected EOF in '{src.name}' at offset {offset}")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def _write_gguf(
+    output_path: str,
+    layout: GGUFLayout,
+    kv_entries: list[bytes],
+    tensors: list[GGUFTensorEntry],
+) -> None:
+    prefix = layout.prefix
+    alignment = layout.alignment
+
+    header = [
+        GGUFModelInfo.MAGIC_NUMBER.encode("ascii"),
+        struct.pack(f"{prefix}IQQ", layout.version, len(tensors), len(kv_entries)),
+        *kv_entries,
+    ]
+    offset = 0
+    for tensor in tensors:
+        header.append(_encode_string(tensor.name, prefix))
+        header.append(struct.pack(f"{prefix}I", len(tensor.dimensions)))
+        header.append(struct.pack(f"{prefix}{len(tensor.dimensions)}Q", *tensor.dimensions))
+        header.append(struct.pack(f"{prefix}IQ", tensor.type, offset))
+        offset += _pad(tensor.size, alignment)
+    raw_header = b"".join(header)
+
+    sources: Dict[str, BinaryIO] = {}
+    try:
+        with open(output_path, "wb") as output:
+            output.write(raw_header)
+            output.write(b"\0" * (_pad(len(raw_header), alignment) - len(raw_header)))
+            for tensor in tensors:
+                if tensor.source_path not in sources:
+                    sources[tensor.source_path] = open(tensor.source_path, "rb")
+                _copy_range(sources[tensor.source_path], output, tensor.source_offset, tensor.size)
+                output.write(b"\0" * (_pad(tensor.size, alignment) - tensor.size))
+    finally:
+        for source in sources.values():
+            source.close()
+
+
+def _split_kv_entries(layout: GGUFLayout, index: int, count: int, tensor_count: int) -> list[bytes]:
+    # Like llama.cpp only the first shard carries the model metadata, the other shards only
+    # describe the split. A non-default alignment is kept so each shard stays readable on its own.
+    if index == 0:
+        entries = [raw for key, raw in layout.kv_entries.items() if key not in SPLIT_KEYS]
+    elif layout.alignment != GGUF_DEFAULT_ALIGNMENT:
+        entries = [layout.kv_entries[GGUF_ALIGNMENT_KEY]]
+    else:
+        entries = []
+
+    entries.append(_encode_kv(SPLIT_KEY_NO, GGUFValueType.UINT16, index, layout.prefix))
+    entries.append(_encode_kv(SPLIT_KEY_COUNT, GGUFValueType.UINT16, count, layout.prefix))
+    entries.append(_encode_kv(SPLIT_KEY_TENSORS_COUNT, GGUFValueType.INT32, tensor_count, layout.prefix))
+    return entries
+
+
+def plan_split(
+    tensors: list[GGUFTensorEntry], alignment: int, max_size: Optional[int] = None, max_tensors: Optional[int] = None
+) -> list[list[GGUFTensorEntry]]:
+    """Groups tensors into shards with at most max_size bytes of tensor data and max_tensors tensors.
+    A single tensor larger than max_size gets a shard of its own."""
+    if not max_size and not max_tensors:
+        raise ValueError("Either a maximum shard size or a maximum number of tensors is required")
+
+    shards: list[list[GGUFTensorEntry]] = [[]]
+    shard_size = 0
+    for tensor in tensors:
+        tensor_size = _pad(tensor.size, alignment)
+        current = shards[-1]
+        exceeds_size = max_size is not None and shard_size + tensor_size > max_size
+        exceeds_count = max_tensors is not None and len(current) >= max_tensors
+        if current and (exceeds_size or exceeds_count):
+            shards.append([])
+            shard_size = 0
+        shards[-1].append(tensor)
+        shard_size += tensor_size
+    return shards
+
+
+def split_gguf(
+    model_path: str,
+    output_dir: str,
+    max_size: Optional[int] = None,
+    max_tensors: Optional[int] = None,
+    prefix: Optional[str] = None,
+) -> list[str]:
+    """Splits a GGUF model into llama.cpp compatible <prefix>-0000N-of-0000M.gguf shards.
+
+    Tensor data is streamed from the source file into the shards without loading it into memory.
+    Returns the paths of the written shards in order.
+    """
+    layout = read_gguf_layout(model_path)
+    if layout.split_count > 1:
+        raise ValueError(f"Model '{model_path}' is already split into {layout.split_count} parts")
+
+    shards = plan_split(layout.tensors, layout.alignment, max_size, max_tensors)
+    if len(shards) > 0xFFFF:
+        raise ValueError(f"Splitting '{model_path}' would result in too many shards ({len(shards)})")
+
+    if prefix is None:
+        prefix = os.path.basename(model_path).removesuffix(".gguf")
+
+    os.makedirs(output_dir, exist_ok=True)
+    shard_paths: list[str] = []
+    for index, shard_tensors in enumerate(shards):
+        shard_path = os.path.join(output_dir, split_file_name(prefix, index + 1, len(shards)))
+        logger.debug(f"Writing shard {shard_path} with {len(shard_tensors)} tensors")
+        kv_entries = _split_kv_entries(layout, index, len(shards), len(layout.tensors))
+        _write_gguf(shard_path, layout, kv_entries, shard_tensors)
+        shard_paths.append(shard_path)
+    return shard_paths
+
+
+def is_gguf_shard(name: str, model_path: str) -> bool:
+    """Returns whether a GGUF file is a part of a split model, going by the shard suffix of its
+    name or, for renamed shards, the split count in its metadata."""
+    if SHARD_NAME_RE.search(name):
+        return True
+    return read_gguf_layout(model_path).split_count > 1
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
 import os
+import tempfile
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from ramalama import oci_tools
 from ramalama.arg_types import EngineArgs
-from ramalama.model_store.constants import DIRECTORY_NAME_BLOBS, DIRECTORY_NAME_REFS, DIRECTORY_NAME_SNAPSHOTS
+from ramalama.logger import logger
+from ramalama.model_store.constants import (
+    DIRECTORY_NAME_BLOBS,
+    DIRECTORY_NAME_REFS,
+    DIRECTORY_NAME_SNAPSHOTS,
+    FILE_NAME_GENERATION,
+)
 from ramalama.model_store.reffile import RefJSONFile, migrate_reffile_to_refjsonfile
 
 
@@ -29,6 +36,29 @@ class GlobalModelStore:
     def path(self) -> str:
         return self._store_base_path
 
+    @property
+    def generation_file_path(self) -> str:
+        return os.path.join(self.path, FILE_NAME_GENERATION)
+
+    def generation(self) -> Tuple[int, int]:
+        """Returns a token which changes whenever a model is added to or removed from the store."""
+        try:
+            stat = os.stat(self.generation_file_path)
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def bump_generation(self) -> None:
+        # the file is replaced rather than modified, a new inode changes the generation even
+        # on file systems with a coarse mtime resolution
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f"{FILE_NAME_GENERATION}.")
+            os.close(fd)
+            os.replace(tmp_path, self.generation_file_path)
+        except OSError as ex:
+            logger.debug(f"Failed to update the generation of the model store: {ex}")
+
     def list_models(self, engine: str, show_container: bool) -> Dict[str, List[ModelFile]]:
         models: Dict[str, List[ModelFile]] = {}
 
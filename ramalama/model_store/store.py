@@ -12,6 +12,7 @@ from ramalama.common import perror, sanitize_filename, verify_checksum
 from ramalama.endian import EndianMismatchError, get_system_endianness
 from ramalama.logger import logger
 from ramalama.model_inspect.gguf_parser import GGUFInfoParser, GGUFModelInfo
+from ramalama.model_inspect.safetensor_parser import SAFETENSORS_INDEX_SUFFIX
 from ramalama.model_store import go2jinja
 from ramalama.model_store.constants import DIRECTORY_NAME_BLOBS, DIRECTORY_NAME_REFS, DIRECTORY_NAME_SNAPSHOTS
 from ramalama.model_store.global_store import GlobalModelStore
@@ -122,10 +123,14 @@ class ModelStore:
         for file in snapshot_files:
             ref_file.files.append(StoreFile(file.hash, file.name, map_to_store_file_type(file.type)))
 
-        ref_file.write_to_file()
+        self._write_ref_file(ref_file)
 
         return ref_file
 
+    def _write_ref_file(self, ref_file: RefJSONFile):
+        ref_file.write_to_file()
+        self._store.bump_generation()
+
     def get_snapshot_hash(self, model_tag: str) -> str:
         ref_file = self.get_ref_file(model_tag)
         if ref_file is None:
@@ -155,6 +160,15 @@ class ModelStore:
         chosen = matched if matched is not None else safetensor_files[0]
         return self.get_blob_file_path(chosen.hash)
 
+    def get_safetensor_index_path(self, model_tag: str) -> Optional[str]:
+        ref_file = self.get_ref_file(model_tag)
+        if ref_file is None or not ref_file.safetensor_model_files:
+            return None
+        index_file = next((f for f in ref_file.files if f.name.endswith(SAFETENSORS_INDEX_SUFFIX)), None)
+        if index_file is None:
+            return None
+        return self.get_snapshot_file_path(ref_file.hash, index_file.name)
+
     def get_blob_file_path_by_name(self, tag_hash: str, filename: str) -> str:
         return str(Path(self.get_snapshot_file_path(tag_hash, filename)).resolve())
 
@@ -191,7 +205,7 @@ class ModelStore:
                 file.type = StoreFileType.SAFETENSOR_MODEL
                 should_write = True
         if should_write:
-            ref_file.write_to_file()
+            self._write_ref_file(ref_file)
 
         for file in ref_file.files:
             path = self.get_blob_file_path(file.hash)
@@ -212,7 +226,7 @@ class ModelStore:
             for file in snapshot_files:
                 ref_file.files.append(StoreFile(file.hash, file.name, map_to_store_file_type(file.type)))
 
-            ref_file.write_to_file()
+            self._write_ref_file(ref_file)
 
         snapshot_directory = self.get_snapshot_directory(snapshot_hash)
         os.makedirs(snapshot_directory, exist_ok=True)
@@ -248,7 +262,7 @@ class ModelStore:
             create_file_link(blob_absolute_path, link_path)
 
         # save updated ref file
-        ref_file.write_to_file()
+        self._write_ref_file(ref_file)
 
     def _try_convert_existing_chat_template(self, ref_file: RefJSONFile, snapshot_hash: str) -> bool:
         for file in ref_file.chat_templates:
@@ -399,7 +413,7 @@ class ModelStore:
                         map_to_store_file_type(new_snapshot_file.type),
                     )
                 )
-        ref_file.write_to_file()
+        self._write_ref_file(ref_file)
 
         self._download_snapshot_files(ref_file, snapshot_hash, new_snapshot_files)
         return True
@@ -458,4 +472,5 @@ class ModelStore:
 
         # Remove ref file, ignore if file is not found
         Path(self.get_ref_file_path(model_tag)).unlink(missing_ok=True)
+        self._store.bump_generation()
         return True
@@ -19,9 +19,10 @@ from ramalama.config import ActiveConfig
 from ramalama.logger import logger
 from ramalama.plugins.interface import InferenceRuntimePlugin
 from ramalama.plugins.loader import assemble_command
+from ramalama.prewarm import ModelPrewarmer
 from ramalama.stack import Stack
 from ramalama.transports.api import APITransport
-from ramalama.transports.base import compute_serving_port
+from ramalama.transports.base import compute_serving_port, local_model_paths
 from ramalama.transports.transport_factory import New, TransportFactory
 
 
@@ -100,6 +101,12 @@ class BaseInferenceRuntime(InferenceRuntimePlugin):
                 help="IP address to listen",
                 completer=suppressCompleter,
             )
+            parser.add_argument(
+                "--prewarm",
+                dest="prewarm",
+                action="store_true",
+                help="read the model weights into the page cache in the background while the server starts",
+            )
 
     def register_subcommands(self, subparsers: "argparse._SubParsersAction") -> None:
         super().register_subcommands(subparsers)
@@ -159,6 +166,13 @@ class BaseInferenceRuntime(InferenceRuntimePlugin):
     def _do_serve(self, args: argparse.Namespace, model: "Any") -> None:
         """Execute serve after the model is resolved. Override to inject pre-serve logic."""
         set_accel_env_vars()
+        if getattr(args, "prewarm", False) and not args.dryrun and not getattr(args, "generate", None):
+            # Start prewarming before the image is ensured so reading the weights overlaps with it
+            try:
+                model_paths = local_model_paths(model)
+                args.prewarmer = ModelPrewarmer(model_paths).start()
+            except Exception as e:
+                logger.debug(f"Skipping prewarm of model weights: {e}")
         if args.container and not args.dryrun:
             config = ActiveConfig()
             generate = getattr(args, "generate", None)
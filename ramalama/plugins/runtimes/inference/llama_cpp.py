@@ -28,6 +28,7 @@ from ramalama.cli import (
     get_shortnames,
     local_images,
     local_models,
+    parse_size_option,
     runtime_options,
     suppressCompleter,
 )
@@ -588,6 +589,14 @@ Model "artifact" stores the AI Model as an OCI Artifact.
 Model "car" includes base image with the model stored in a /models subdir.
 Model "raw" contains the model and a link file model.file to it stored at /.""",
         )
+        convert_parser.add_argument(
+            "--split-max-size",
+            dest="split_max_size",
+            type=parse_size_option,
+            default=None,
+            help="split GGUF models into shards of at most this size (e.g. 2G), only valid with --type artifact",
+            completer=suppressCompleter,
+        )
         convert_parser.add_argument("SOURCE")
         convert_parser.add_argument("TARGET")
         convert_parser.set_defaults(func=self._convert_handler)
@@ -0,0 +1,177 @@
+"""Page cache prewarming of model weights before serving."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import mmap
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from ramalama.logger import logger
+from ramalama.model_inspect.gguf_parser import GGUFInfoParser
+
+PREWARM_CHUNK_SIZE = 64 * 1024 * 1024
+PREWARM_MAX_WORKERS = 4
+
+# All byte values with the lowest bit set, used to count resident pages in a mincore vector
+_RESIDENT_PAGE_BYTES = bytes(range(1, 256, 2))
+
+
+def _expand_model_paths(paths: Iterable[str]) -> list[str]:
+    files: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            # safetensor models are served from their snapshot directory
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".safetensors"))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def weight_ranges(model_path: str) -> list[tuple[int, int]]:
+    """Returns the byte ranges holding the model weights, the tensor data section for GGUF models
+    and the complete file for everything else."""
+    if GGUFInfoParser.is_model_gguf(model_path):
+        try:
+            return GGUFInfoParser.get_tensor_data_ranges(model_path)
+        except Exception as ex:
+            logger.debug(f"Failed to read tensor table of '{model_path}', prewarming whole file: {ex}")
+
+    size = os.path.getsize(model_path)
+    return [(0, size)] if size > 0 else []
+
+
+def _split_ranges(ranges: list[tuple[int, int]], chunk_size: int) -> list[tuple[int, int]]:
+    chunks: list[tuple[int, int]] = []
+    for start, end in ranges:
+        for chunk_start in range(start, end, chunk_size):
+            chunks.append((chunk_start, min(chunk_start + chunk_size, end)))
+    return chunks
+
+
+def _warm_chunk(model_path: str, start: int, end: int) -> None:
+    with open(model_path, "rb") as model_file:
+        if hasattr(os, "posix_fadvise"):
+            # Schedules readahead of the whole range at once, the reads below only wait for it
+            os.posix_fadvise(model_file.fileno(), start, end - start, os.POSIX_FADV_WILLNEED)
+
+        # fadvise returns as soon as the readahead is queued, reading the range returns once its
+        # pages are in the page cache, so the prewarm is only done once the weights are warm
+        model_file.seek(start)
+        buffer = bytearray(min(end - start, 1024 * 1024))
+        remaining = end - start
+        while remaining > 0:
+            n = model_file.readinto(memoryview(buffer)[: min(remaining, len(buffer))])
+            if not n:
+                break
+            remaining -= n
+
+
+def page_cache_residency(model_paths: list[str]) -> Optional[float]:
+    """Returns the fraction of pages of the given files which are resident in the page cache.
+
+    Residency is determined via mincore(2) and therefore only available on Linux, None is
+    returned if it can not be determined.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    except (OSError, AttributeError) as ex:
+        logger.debug(f"mincore is not available: {ex}")
+        return None
+
+    map_failed = ctypes.c_void_p(-1).value
+    total_pages = 0
+    resident_pages = 0
+    for path in model_paths:
+        size = os.path.getsize(path)
+        if size == 0:
+            continue
+
+        with open(path, "rb") as model_file:
+            addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, model_file.fileno(), 0)
+            if addr is None or addr == map_failed:
+                logger.debug(f"Failed to mmap '{path}': {os.strerror(ctypes.get_errno())}")
+                return None
+            try:
+                pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+                vec = (ctypes.c_ubyte * pages)()
+                if libc.mincore(addr, size, vec) != 0:
+                    logger.debug(f"mincore failed for '{path}': {os.strerror(ctypes.get_errno())}")
+                    return None
+                raw = bytes(vec)
+                total_pages += pages
+                resident_pages += pages - len(raw.translate(None, _RESIDENT_PAGE_BYTES))
+            finally:
+                libc.munmap(addr, size)
+
+    if total_pages == 0:
+        return None
+    return resident_pages / total_pages
+
+
+class ModelPrewarmer:
+    """Reads the weight ranges of model files into the page cache in the background.
+
+    Prewarming runs in a daemon thread with a bounded pool of workers, so it can overlap with
+    pulling and starting the inference container. Use wait() to block until it has finished.
+    """
+
+    def __init__(
+        self,
+        model_paths: Iterable[str],
+        max_workers: int = PREWARM_MAX_WORKERS,
+        chunk_size: int = PREWARM_CHUNK_SIZE,
+    ):
+        self.model_paths: list[str] = _expand_model_paths(model_paths)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+        self.residency: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def start(self) -> "ModelPrewarmer":
+        self._thread = threading.Thread(target=self.run, name="ramalama-prewarm", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def run(self) -> None:
+        try:
+            chunks = [
+                (path, start, end)
+                for path in self.model_paths
+                for start, end in _split_ranges(weight_ranges(path), self.chunk_size)
+            ]
+            logger.debug(f"Prewarming {len(chunks)} chunks of {self.model_paths}")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # consume the iterator to propagate errors of the workers
+                list(executor.map(lambda chunk: _warm_chunk(*chunk), chunks))
+
+            self.residency = page_cache_residency(self.model_paths)
+            if self.residency is not None:
+                logger.debug(f"Prewarmed model weights, {self.residency:.1%} resident in page cache")
+        except Exception as ex:
+            # prewarming is an optimization only, never fail serving because of it
+            logger.debug(f"Failed to prewarm model weights: {ex}")
+            self.error = ex
+        finally:
+            self._done.set()
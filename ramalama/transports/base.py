@@ -783,7 +783,7 @@ class Transport(TransportBase):
 
             metadata = GGUFInfoParser.parse_metadata(model_path)
             if show_all_metadata:
-                return metadata.serialize(json=as_json)
+                return metadata.serialize(json=as_json, all=show_all)
             elif get_field != "":  # If a specific field is requested, print only that field
                 field_value = metadata.get(get_field)
                 if field_value is None:
@@ -791,7 +791,12 @@ class Transport(TransportBase):
                 return field_value
 
         if SafetensorInfoParser.is_model_safetensor(model_name):
-            safetensor_info: SafetensorModelInfo = SafetensorInfoParser.parse(model_name, model_registry, model_path)
+            index_path = None if dryrun else self.model_store.get_safetensor_index_path(self.model_tag)
+            safetensor_info: SafetensorModelInfo
+            if index_path is not None and os.path.exists(index_path):
+                safetensor_info = SafetensorInfoParser.parse_sharded(model_name, model_registry, index_path)
+            else:
+                safetensor_info = SafetensorInfoParser.parse(model_name, model_registry, model_path)
             return safetensor_info.serialize(json=as_json, all=show_all)
 
         return ModelInfoBase(model_name, model_registry, model_path).serialize(json=as_json)
@@ -807,6 +812,14 @@ class Transport(TransportBase):
         return False
 
 
+def local_model_paths(model: TransportBase) -> list[str]:
+    """Returns the paths of all parts of a model in the local store. Transports without local
+    files, like the hosted API providers, have none."""
+    if not isinstance(model, Transport):
+        return []
+    return [src for src, _ in model._get_all_model_part_paths(False, False, False)]
+
+
 def compute_ports(exclude: Optional[list[str]] = None) -> list[int]:
     excluded = set() if exclude is None else set(map(int, exclude))
 
@@ -11,6 +11,8 @@ from typing import Optional, Union
 import ramalama.annotations as oci_annotations
 from ramalama.common import MNT_DIR, exec_cmd, perror, run_cmd, set_accel_env_vars
 from ramalama.engine import BuildEngine, dry_run
+from ramalama.model_store.gguf_split import is_gguf_shard, split_gguf
+from ramalama.model_store.reffile import StoreFileType
 from ramalama.oci_tools import OciRef, engine_supports_manifest_attributes
 from ramalama.transports.base import Transport
 from ramalama.transports.oci import spec as oci_spec
@@ -215,15 +217,38 @@ class OCI(Transport):
             ignore_stderr=True,
         )
 
+    def _artifact_files(self, source_model, ref_file, split_dir: str, split_max_size: Optional[int]):
+        """Returns (file name, path) pairs of all files to add to the artifact. GGUF models larger
+        than split_max_size are split into llama.cpp compatible shards in split_dir."""
+        files: list[tuple[str, str]] = []
+        for file in ref_file.files:
+            blob_file_path = source_model.model_store.get_blob_file_path(file.hash)
+            if (
+                split_max_size
+                and file.type == StoreFileType.GGUF_MODEL
+                and os.path.getsize(blob_file_path) > split_max_size
+                and not is_gguf_shard(file.name, blob_file_path)
+            ):
+                perror(f"Splitting {file.name} into shards of at most {split_max_size} bytes ...")
+                shard_paths = split_gguf(
+                    blob_file_path, split_dir, max_size=split_max_size, prefix=file.name.removesuffix(".gguf")
+                )
+                files.extend((os.path.basename(path), path) for path in shard_paths)
+                continue
+            files.append((file.name, blob_file_path))
+        return files
+
     def _create_artifact(self, source_model, target, args) -> None:
         model_name = source_model.model_name
         ref_file = source_model.model_store.get_ref_file(source_model.model_tag)
-        name = ref_file.model_files[0].name if ref_file.model_files else model_name
-        create = True
-        for file in ref_file.files:
-            blob_file_path = source_model.model_store.get_blob_file_path(file.hash)
-            self._add_artifact(create, name, blob_file_path, file.name)
-            create = False
+        with tempfile.TemporaryDirectory(prefix="RamaLama_split_") as split_dir:
+            files = self._artifact_files(source_model, ref_file, split_dir, getattr(args, "split_max_size", None))
+            model_file_names = [name for name, _ in files if name.endswith(".gguf")]
+            name = model_file_names[0] if model_file_names else model_name
+            create = True
+            for file_name, path in files:
+                self._add_artifact(create, name, path, file_name)
+                create = False
 
     def _create_manifest_without_attributes(self, target, imageid, args):
         # Create manifest list for target with imageid
@@ -264,6 +289,9 @@ class OCI(Transport):
             run_cmd(cmd_args, stdout=None)
 
     def _convert(self, source_model, args):
+        # validated before the existing image is removed, so an invalid command leaves it intact
+        if getattr(args, "split_max_size", None) and args.type != "artifact":
+            raise ValueError("--split-max-size is only supported with --type artifact")
         set_accel_env_vars()
         perror(
             f"Converting {source_model.model_store.model_name} ({source_model.model_store.model_type}) to "
@@ -7,6 +7,7 @@ from ramalama.chat_providers.openai import OpenAIResponsesChatProvider
 from ramalama.config import ActiveConfig
 from ramalama.transports import api as api_module
 from ramalama.transports.api import APITransport
+from ramalama.transports.base import local_model_paths
 
 CONFIG = ActiveConfig()
 
@@ -126,3 +127,7 @@ def test_run_cli_api_transport_does_not_call_pull(monkeypatch):
 
     transport.pull.assert_not_called()
     transport.run.assert_called_once()
+
+
+def test_api_transport_has_no_local_model_paths():
+    assert local_model_paths(APITransport("gpt-4", make_provider())) == []
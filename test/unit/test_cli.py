@@ -4,7 +4,7 @@ from unittest import mock
 
 import pytest
 
-from ramalama.cli import ParsedGenerateInput, parse_generate_option, post_parse_setup
+from ramalama.cli import ParsedGenerateInput, parse_generate_option, parse_size_option, post_parse_setup
 from ramalama.transports.base import NoGGUFModelFileFound, SafetensorModelNotSupported
 
 
@@ -31,6 +31,27 @@ def test_parse_generate_option(input: str, expected: ParsedGenerateInput):
     assert out.output_dir == expected.output_dir
 
 
+@pytest.mark.parametrize(
+    "input,expected",
+    [
+        ("1024", 1024),
+        ("500M", 500 * 1024**2),
+        ("2G", 2 * 1024**3),
+        ("1.5g", int(1.5 * 1024**3)),
+        ("2GiB", 2 * 1024**3),
+        ("10KB", 10 * 1024),
+    ],
+)
+def test_parse_size_option(input: str, expected: int):
+    assert parse_size_option(input) == expected
+
+
+@pytest.mark.parametrize("input", ["", "G", "abc", "0", "-1M"])
+def test_parse_size_option_invalid(input: str):
+    with pytest.raises(ValueError):
+        parse_size_option(input)
+
+
 @pytest.mark.parametrize(
     "input,expected",
     [
@@ -235,3 +256,15 @@ def test_post_parse_setup_model_input(
     assert input_args.UNRESOLVED_MODEL == expected_unresolved
     assert input_args.MODEL == expected_resolved
     assert input_args.model == input_args.MODEL
+
+
+def test_push_rejects_split_max_size_for_non_oci_target(monkeypatch):
+    from ramalama.cli import init_cli, push_cli
+
+    monkeypatch.setattr(
+        sys, "argv", ["ramalama", "push", "--type", "artifact", "--split-max-size", "1G", "model", "hf://org/model"]
+    )
+    _, args = init_cli()
+    with mock.patch("ramalama.cli._get_source_model", return_value=mock.Mock(type="Ollama")):
+        with pytest.raises(ValueError, match="--split-max-size"):
+            push_cli(args)
@@ -12,6 +12,7 @@ from ramalama.config import (
     load_env_config,
 )
 from ramalama.log_levels import LogLevel
+from ramalama.toml_parser import TOMLParser
 
 config = ActiveConfig()
 
@@ -670,3 +671,36 @@ class TestConfigIntegration:
             # Values not set in any layer should return False
             assert cfg.is_set("host") is False
             assert cfg.is_set("port") is False
+
+    def test_config_daemon_preload(self):
+        """Test that the preload tables of the daemon are parsed into preload configs."""
+        parser = TOMLParser()
+        parser.parse(
+            """
+            [ramalama.daemon]
+            preload_concurrency = 4
+
+            [ramalama.daemon.preload.granite]
+            model = "ollama://granite3.1-moe:3b"
+            pinned = true
+
+            [ramalama.daemon.preload.granite.options]
+            ctx_size = 8192
+
+            [ramalama.daemon.preload.smollm]
+            """
+        )
+        env = {"RAMALAMA_DAEMON__PRELOAD__SMOLLM__PINNED": "yes"}
+
+        with patch("ramalama.config.load_file_config", return_value=parser.data["ramalama"]):
+            cfg = load_config(env)
+
+            assert cfg.daemon.preload_concurrency == 4
+            granite = cfg.daemon.preload["granite"]
+            assert granite.model == "ollama://granite3.1-moe:3b"
+            assert granite.pinned is True
+            assert granite.runtime is None
+            assert granite.options == {"ctx_size": 8192}
+            smollm = cfg.daemon.preload["smollm"]
+            assert smollm.model == "smollm"
+            assert smollm.pinned is True
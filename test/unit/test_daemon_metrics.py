@@ -0,0 +1,62 @@
+"""
+Unit tests for the metrics of the ramalama daemon
+"""
+
+import threading
+
+from ramalama.daemon.service.metrics import CallbackGauge, Counter, Histogram, MetricsRegistry
+
+
+def test_counter_sums_increments_of_all_threads():
+    counter = Counter("requests", "Requests", ["model"])
+
+    def work():
+        for _ in range(1000):
+            counter.inc(("a",))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counter.inc(("b",), 2)
+
+    assert counter.value(("a",)) == 8000
+    assert counter.value(("b",)) == 2
+    assert counter.total() == 8002
+    # shards of finished threads are merged into the retired values
+    assert len(counter._shards) == 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ["model"], buckets=[0.1, 1])
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value, ("a",))
+
+    assert histogram.count(("a",)) == 4
+    assert list(histogram.render()) == [
+        "# TYPE latency_seconds histogram",
+        "# HELP latency_seconds Latency",
+        'latency_seconds_bucket{model="a",le="0.1"} 2',
+        'latency_seconds_bucket{model="a",le="1.0"} 3',
+        'latency_seconds_bucket{model="a",le="+Inf"} 4',
+        'latency_seconds_count{model="a"} 4',
+        'latency_seconds_sum{model="a"} 3.65',
+    ]
+
+
+def test_registry_renders_openmetrics():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("evictions", "Evicted models", ["model"]))
+    registry.register(CallbackGauge("memory_used_bytes", "Used memory", lambda: [((), 1024)]))
+    counter.inc(('say "hi"\n',))
+
+    assert registry.render() == (
+        "# TYPE evictions counter\n"
+        "# HELP evictions Evicted models\n"
+        'evictions_total{model="say \\"hi\\"\\n"} 1\n'
+        "# TYPE memory_used_bytes gauge\n"
+        "# HELP memory_used_bytes Used memory\n"
+        "memory_used_bytes 1024\n"
+        "# EOF\n"
+    )
@@ -0,0 +1,838 @@
+"""
+Unit tests for the model proxy of the ramalama daemon, using a local fake upstream instead of llama-server
+"""
+
+import http.client
+import http.server
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ramalama.config import DaemonConfig
+from ramalama.daemon.async_server import AsyncRamalamaServer
+from ramalama.daemon.daemon import RamalamaServer
+from ramalama.daemon.handler.daemon import DaemonAPIHandler
+from ramalama.daemon.handler.proxy import MAX_INSPECTED_BODY_SIZE, RELAY_BLOCK_SIZE, iter_chunked_body
+from ramalama.daemon.service.access_log import AccessLog
+from ramalama.daemon.service.admission import AdmissionController
+from ramalama.daemon.service.affinity import SlotTracker
+from ramalama.daemon.service.coalescing import EmbeddingCoalescer
+from ramalama.daemon.service.connection_pool import UpstreamConnectionPool
+from ramalama.daemon.service.model_runner import ManagedModel, ModelState
+from ramalama.daemon.service.preload import ModelPreloader
+from ramalama.daemon.service.response_cache import ResponseCache
+from ramalama.daemon.unix_socket import UnixHTTPConnection, bind_unix_socket, daemon_connection
+
+SERVE_PATH = "/model/test/tiny"
+
+
+class FakeUpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, count: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(count):
+            event = f"data: {i}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%b\r\n" % (len(event), event))
+            # the next event is only sent once the client received the previous one
+            self.server.events_received.wait(5)
+            self.server.events_received.clear()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _hold_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write(b"%x\r\n%b\r\n" % (len(b"data: open\n\n"), b"data: open\n\n"))
+        self.server.streams_released.wait(30)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        if self.path == "/stream":
+            self._stream_events(3)
+            return
+        if self.path == "/hold":
+            self._hold_stream()
+            return
+        self._reply({"path": self.path})
+
+    def _embed(self, inputs: list):
+        self.server.embedding_batches.append(inputs)
+        if "bad" in inputs:
+            body = b'{"error": "bad input"}'
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        data = [{"object": "embedding", "index": i, "embedding": [len(text), i]} for i, text in enumerate(inputs)]
+        tokens = sum(len(text) for text in inputs)
+        self._reply({"object": "list", "data": data, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def do_POST(self):
+        self.server.posts += 1
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            body = b"".join(iter_chunked_body(self.rfile))
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/v1/embeddings":
+            inputs = json.loads(body)["input"]
+            self._embed([inputs] if isinstance(inputs, str) else inputs)
+            return
+        if b'"stream": true' in body:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(3):
+                event = f"data: {i}\n\n".encode("utf-8")
+                self.wfile.write(b"%x\r\n%b\r\n" % (len(event), event))
+            if b'"include_usage": true' in body:
+                event = b'data: {"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 3}}\n\n'
+                self.wfile.write(b"%x\r\n%b\r\n" % (len(event), event))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self._reply({"path": self.path, "echo": body.decode("utf-8")})
+
+
+def start_upstream():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstreamHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.posts = 0
+    server.embedding_batches = []
+    server.events_received = threading.Event()
+    server.streams_released = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def upstream():
+    server = start_upstream()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def start_daemon(
+    server_class, store_path, upstream, idle_check_interval: timedelta = timedelta(seconds=10), socket_path=None
+):
+    server = server_class("127.0.0.1", 0, str(store_path), idle_check_interval, socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # the fake upstream is served in-process, the managed process only stands in for llama-server
+    model = SimpleNamespace(
+        model_name="tiny", model_tag="latest", model_organization="test", model_type="ollama", type="Ollama"
+    )
+    cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+    managed_model = ManagedModel(model, cmd, upstream.server_address[1])
+    server.model_runner.add_model(managed_model)
+    server.model_runner.start_model(managed_model.id, SERVE_PATH)
+    return server
+
+
+@pytest.fixture(params=[RamalamaServer, AsyncRamalamaServer], ids=["threaded", "asyncio"])
+def daemon(request, tmp_path, upstream):
+    server = start_daemon(request.param, tmp_path, upstream)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def async_daemon(tmp_path, upstream):
+    server = start_daemon(AsyncRamalamaServer, tmp_path, upstream)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def idle_upstream_connections(server) -> int:
+    model = next(iter(server.model_runner.managed_models.values()))
+    if isinstance(server, AsyncRamalamaServer):
+        # the pools of the asyncio daemon are created on the first request
+        entry = server._pools.get(model.id)
+        return entry[1].idle_count if entry else 0
+    return model.connection_pool.idle_count
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def request(server, method: str, path: str, body: bytes = None, headers: dict = None):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+    try:
+        headers = headers or {}
+        conn.request(method, path, body=body, headers=headers, encode_chunked="Transfer-Encoding" in headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_proxy_reuses_upstream_connections(daemon, upstream):
+    for i in range(5):
+        status, body = request(daemon, "POST", SERVE_PATH, json.dumps({"i": i}).encode("utf-8"))
+        assert status == 200
+        assert json.loads(body) == {"path": "/", "echo": json.dumps({"i": i})}
+        assert wait_for(lambda: idle_upstream_connections(daemon) == 1)
+
+    assert upstream.connections == 1
+
+
+def test_proxy_forwards_referred_path(daemon):
+    status, body = request(daemon, "GET", "/model/test/v1/models", headers={"Referer": f"http://host{SERVE_PATH}"})
+    assert status == 200
+    assert json.loads(body) == {"path": "/v1/models"}
+
+
+def test_proxy_streams_large_request_body(daemon):
+    payload = "x" * (3 * RELAY_BLOCK_SIZE + 7)
+    status, body = request(daemon, "POST", SERVE_PATH, payload.encode("utf-8"))
+    assert status == 200
+    assert json.loads(body)["echo"] == payload
+
+
+def test_proxy_forwards_chunked_request_body(daemon):
+    chunks = (part.encode("utf-8") for part in ["hello ", "chunked ", "world"])
+    status, body = request(daemon, "POST", SERVE_PATH, chunks, {"Transfer-Encoding": "chunked"})
+    assert status == 200
+    assert json.loads(body)["echo"] == "hello chunked world"
+
+
+def test_proxy_relays_event_stream_incrementally(daemon, upstream):
+    conn = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+    conn.request("GET", "/model/test/stream", headers={"Referer": f"http://host{SERVE_PATH}"})
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.chunked
+
+    for i in range(3):
+        assert response.read1(1024) == f"data: {i}\n\n".encode("utf-8")
+        upstream.events_received.set()
+    assert response.read() == b""
+
+    # the chunked response is delimited, so the client connection is kept alive
+    conn.request("GET", SERVE_PATH)
+    assert json.loads(conn.getresponse().read()) == {"path": "/"}
+    conn.close()
+
+
+def test_proxy_closes_connection_for_http10_clients(daemon, upstream):
+    with socket.create_connection(daemon.server_address) as sock:
+        sock.sendall(b"GET /model/test/stream HTTP/1.0\r\nReferer: http://host" + SERVE_PATH.encode() + b"\r\n\r\n")
+        data = b""
+        while chunk := sock.recv(4096):
+            data += chunk
+            upstream.events_received.set()
+
+    head, body = data.split(b"\r\n\r\n", 1)
+    assert b"chunked" not in head.lower()
+    assert body == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+
+
+def test_proxy_unknown_model(daemon):
+    status, _ = request(daemon, "GET", "/model/test/unknown")
+    assert status == 404
+
+
+def test_stopping_model_closes_pool(tmp_path, upstream):
+    daemon = start_daemon(RamalamaServer, tmp_path, upstream)
+    request(daemon, "GET", SERVE_PATH)
+    managed_model = next(iter(daemon.model_runner.managed_models.values()))
+    pool = managed_model.connection_pool
+    # the connection is released after the response has been relayed to the client
+    assert wait_for(lambda: pool.idle_count == 1)
+
+    daemon.model_runner.stop_model(managed_model.id)
+    assert pool.idle_count == 0
+    daemon.shutdown()
+    daemon.server_close()
+
+
+def test_pool_discards_connections_closed_by_server():
+    listener = socket.create_server(("127.0.0.1", 0))
+    pool = UpstreamConnectionPool("127.0.0.1", listener.getsockname()[1])
+
+    conn, reused = pool.acquire()
+    conn.connect()
+    accepted, _ = listener.accept()
+    assert not reused
+    assert UpstreamConnectionPool.is_healthy(conn)
+    pool.release(conn)
+    assert pool.idle_count == 1
+
+    accepted.close()
+    conn, reused = pool.acquire()
+    assert not reused
+    assert pool.idle_count == 0
+
+    pool.close()
+    pool.release(conn)
+    assert pool.idle_count == 0
+    listener.close()
+
+
+def test_proxy_queues_requests_until_model_is_ready(daemon, upstream):
+    ready = threading.Event()
+    model = SimpleNamespace(model_name="cold", model_tag="latest", model_organization="test")
+    cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+    cold = ManagedModel(model, cmd, upstream.server_address[1], ready_check=ready.is_set)
+    daemon.model_runner.add_model(cold)
+    daemon.model_runner.start_model(cold.id, "/model/test/cold")
+    assert cold.state == ModelState.STARTING
+
+    results = []
+    client = threading.Thread(target=lambda: results.append(request(daemon, "GET", "/model/test/cold")))
+    client.start()
+    client.join(0.5)
+    assert client.is_alive()
+
+    ready.set()
+    client.join(5)
+    assert results == [(200, b'{"path": "/"}')]
+    assert cold.state == ModelState.READY
+
+
+def test_async_daemon_waits_for_starting_model_in_a_single_thread(async_daemon, upstream):
+    ready = threading.Event()
+    model = SimpleNamespace(model_name="cold", model_tag="latest", model_organization="test")
+    cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+    cold = ManagedModel(model, cmd, upstream.server_address[1], ready_check=ready.is_set)
+    async_daemon.model_runner.add_model(cold)
+    async_daemon.model_runner.start_model(cold.id, "/model/test/cold")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [executor.submit(request, async_daemon, "GET", "/model/test/cold") for _ in range(8)]
+        assert wait_for(lambda: cold in async_daemon._ready_waiters)
+        time.sleep(0.2)
+        waiting = [t for t in threading.enumerate() if t.name == f"ready-wait-{cold.port}"]
+        assert len(waiting) == 1
+
+        ready.set()
+        assert [r.result(5)[0] for r in results] == [200] * 8
+    assert wait_for(lambda: not async_daemon._ready_waiters)
+
+
+def test_proxy_rejects_model_which_failed_to_start(daemon, upstream):
+    model = SimpleNamespace(model_name="broken", model_tag="latest", model_organization="test")
+    broken = ManagedModel(
+        model, [sys.executable, "-c", "exit(1)"], upstream.server_address[1], ready_check=lambda: False
+    )
+    daemon.model_runner.add_model(broken)
+    daemon.model_runner.start_model(broken.id, "/model/test/broken")
+
+    status, _ = request(daemon, "GET", "/model/test/broken")
+    assert status == 503
+    # a server exiting while starting crashed and is restarted by the supervisor
+    assert broken.state == ModelState.FAILED
+
+
+def test_ready_once_pinned_models_are_ready(daemon, upstream):
+    status, body = request(daemon, "GET", "/api/ready")
+    assert status == 200
+    assert json.loads(body) == {"ready": True, "models": []}
+
+    loaded = threading.Event()
+
+    def serve(serve_request):
+        model = SimpleNamespace(model_name=serve_request.model_name, model_tag="latest", model_organization="test")
+        cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+        pinned = ManagedModel(model, cmd, upstream.server_address[1], ready_check=loaded.is_set, pinned=True)
+        daemon.model_runner.add_model(pinned)
+        daemon.model_runner.start_model(pinned.id, "/model/test/pinned")
+        return pinned
+
+    config = DaemonConfig(preload={"pinned": {"pinned": True}})
+    preloader = ModelPreloader(daemon.model_runner, serve, config, "llama.cpp")
+    daemon.model_runner.preloader = preloader
+    preloader.start()
+    try:
+        status, body = request(daemon, "GET", "/api/ready")
+        assert status == 503
+        assert json.loads(body)["models"][0]["state"] in ("pending", "starting")
+
+        loaded.set()
+        assert preloader.wait(5)
+        status, body = request(daemon, "GET", "/api/ready")
+        assert status == 200
+        assert json.loads(body)["models"] == [{"name": "pinned", "model": "pinned", "pinned": True, "state": "ready"}]
+    finally:
+        preloader.stop()
+
+
+def test_async_daemon_routes_api_requests(async_daemon):
+    status, body = request(async_daemon, "GET", "/api/ps")
+    assert status == 200
+    assert [m["name"] for m in json.loads(body)["models"]] == ["tiny"]
+
+    status, body = request(async_daemon, "GET", "/model")
+    assert status == 200
+    assert [m["state"] for m in json.loads(body)["models"]] == ["ready"]
+
+    status, _ = request(async_daemon, "HEAD", "/")
+    assert status == 200
+
+
+def test_async_daemon_keeps_client_connections_alive(async_daemon):
+    conn = http.client.HTTPConnection("127.0.0.1", async_daemon.server_address[1], timeout=10)
+    for i in range(3):
+        conn.request("POST", SERVE_PATH, body=str(i).encode("utf-8"))
+        response = conn.getresponse()
+        assert json.loads(response.read())["echo"] == str(i)
+        assert not response.will_close
+    conn.close()
+
+
+def test_async_daemon_unreachable_upstream(async_daemon):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    model = SimpleNamespace(model_name="gone", model_tag="latest", model_organization="test")
+    gone = ManagedModel(model, [sys.executable, "-c", "import time; time.sleep(60)"], port)
+    async_daemon.model_runner.add_model(gone)
+    async_daemon.model_runner.start_model(gone.id, "/model/test/gone")
+
+    status, _ = request(async_daemon, "GET", "/model/test/gone")
+    assert status == 502
+
+
+def test_async_daemon_serves_concurrent_streams_without_threads(async_daemon, upstream):
+    n_streams = 200
+    threads_before = threading.active_count()
+    clients = []
+    try:
+        for _ in range(n_streams):
+            sock = socket.create_connection(async_daemon.server_address, timeout=10)
+            sock.sendall(b"GET /model/test/hold HTTP/1.1\r\nHost: test\r\nReferer: http://host" + SERVE_PATH.encode())
+            sock.sendall(b"\r\n\r\n")
+            clients.append(sock)
+        for sock in clients:
+            data = b""
+            while b"data: open" not in data:
+                data += sock.recv(4096)
+
+        # the fake upstream uses a thread per stream, the daemon serves them all from its event loop
+        assert threading.active_count() - threads_before <= n_streams + 2
+        upstream.streams_released.set()
+        for sock in clients:
+            data = b""
+            while not data.endswith(b"0\r\n\r\n"):
+                data += sock.recv(4096)
+    finally:
+        upstream.streams_released.set()
+        for sock in clients:
+            sock.close()
+
+
+def test_metrics_of_proxied_requests(daemon, upstream):
+    for _ in range(2):
+        request(daemon, "GET", SERVE_PATH)
+    conn = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+    conn.request("GET", "/model/test/stream", headers={"Referer": f"http://host{SERVE_PATH}"})
+    response = conn.getresponse()
+    for _ in range(3):
+        response.read1(1024)
+        upstream.events_received.set()
+    response.read()
+    conn.close()
+    # requests are recorded once the response has been relayed completely
+    assert wait_for(lambda: daemon.model_runner.metrics.request_duration.count(("test/tiny:latest",)) == 3)
+
+    conn = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+    conn.request("GET", "/metrics")
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("application/openmetrics-text")
+    lines = response.read().decode("utf-8").splitlines()
+    conn.close()
+
+    assert lines[-1] == "# EOF"
+    assert 'ramalama_daemon_requests_total{model="test/tiny:latest",code="200"} 3' in lines
+    assert 'ramalama_daemon_time_to_first_byte_seconds_count{model="test/tiny:latest"} 3' in lines
+    # the three events of the stream are relayed in separate blocks
+    assert 'ramalama_daemon_inter_chunk_seconds_count{model="test/tiny:latest"} 2' in lines
+    assert 'ramalama_daemon_requests_in_flight{model="test/tiny:latest"} 0' in lines
+    assert 'ramalama_daemon_models{model="test/tiny:latest",state="ready"} 1' in lines
+
+
+def test_metrics_of_upstream_errors(daemon):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    model = SimpleNamespace(model_name="gone", model_tag="latest", model_organization="test")
+    gone = ManagedModel(model, [sys.executable, "-c", "import time; time.sleep(60)"], port)
+    daemon.model_runner.add_model(gone)
+    daemon.model_runner.start_model(gone.id, "/model/test/gone")
+
+    status, _ = request(daemon, "GET", "/model/test/gone")
+    assert status == 502
+    metrics = daemon.model_runner.metrics
+    assert metrics.upstream_errors.value(("test/gone:latest",)) == 1
+    assert metrics.requests.value(("test/gone:latest", "502")) == 1
+
+
+def test_client_disconnect_within_body_is_not_an_upstream_error(daemon, upstream):
+    # bodies larger than the inspected ones are streamed upstream as they arrive
+    length = 2 * MAX_INSPECTED_BODY_SIZE
+    with socket.create_connection(("127.0.0.1", daemon.server_address[1]), timeout=10) as client:
+        head = f"POST {SERVE_PATH} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {length}\r\n\r\n"
+        client.sendall(head.encode("ascii") + b"x" * (length // 2))
+
+    metrics = daemon.model_runner.metrics
+    assert wait_for(lambda: metrics.requests.value(("test/tiny:latest", "499")) == 1)
+    assert metrics.upstream_errors.value(("test/tiny:latest",)) == 0
+
+
+def test_proxy_limits_concurrent_requests(daemon, upstream):
+    model = daemon.model_runner.get_served_model(SERVE_PATH)
+    model.admission = AdmissionController(max_concurrent=1, max_queued=1)
+    metrics = daemon.model_runner.metrics
+
+    holding = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+    holding.request("GET", "/model/test/hold", headers={"Referer": f"http://host{SERVE_PATH}"})
+    response = holding.getresponse()
+    assert response.read1(1024) == b"data: open\n\n"
+
+    # the second request waits for the slot, the third one finds the queue full
+    queued = ThreadPoolExecutor(max_workers=1).submit(request, daemon, "GET", SERVE_PATH)
+    assert wait_for(lambda: model.admission.queued == 1)
+    conn = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+    conn.request("GET", SERVE_PATH)
+    rejected = conn.getresponse()
+    assert rejected.status == 429
+    assert int(rejected.getheader("Retry-After")) >= 1
+    conn.close()
+
+    upstream.streams_released.set()
+    response.read()
+    holding.close()
+    assert queued.result(5)[0] == 200
+    assert wait_for(lambda: metrics.queue_wait.count(("test/tiny:latest",)) == 2)
+    assert metrics.requests.value(("test/tiny:latest", "429")) == 1
+    # the slot is released right after the response has been relayed
+    assert wait_for(lambda: model.admission.active == 0)
+
+
+@pytest.mark.parametrize("server_class", [RamalamaServer, AsyncRamalamaServer], ids=["threaded", "asyncio"])
+def test_idle_models_are_stopped_while_daemon_keeps_running(server_class, tmp_path, upstream):
+    server = start_daemon(server_class, tmp_path, upstream, timedelta(seconds=0.05))
+    try:
+        model = server.model_runner.get_served_model(SERVE_PATH)
+        model.expires_after = timedelta(seconds=0.2)
+        status, _ = request(server, "GET", SERVE_PATH)
+        assert status == 200
+
+        assert wait_for(lambda: not server.model_runner.managed_models)
+        status, body = request(server, "GET", "/api/ps")
+        assert status == 200
+        assert json.loads(body)["models"] == []
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_proxy_caches_deterministic_responses(daemon, upstream):
+    cache = daemon.model_runner.response_cache = ResponseCache(1024 * 1024)
+
+    def post(payload: str):
+        conn = http.client.HTTPConnection("127.0.0.1", daemon.server_address[1], timeout=10)
+        try:
+            conn.request("POST", SERVE_PATH, body=payload.encode("utf-8"))
+            response = conn.getresponse()
+            return response.getheader("X-Ramalama-Cache"), response.chunked, response.read()
+        finally:
+            conn.close()
+
+    _, _, body = post('{"prompt": "hi", "temperature": 0, "seed": 42}')
+    # the response is stored once it has been relayed completely
+    assert wait_for(lambda: len(cache) == 1)
+    # the body is canonicalized, so the order of the fields doesn't matter
+    result, _, cached_body = post('{"seed":42,"temperature":0.0,"prompt":"hi"}')
+    assert result == "hit"
+    assert cached_body == body
+    assert upstream.posts == 1
+
+    # requests sampling randomly are never cached
+    for _ in range(2):
+        result, _, _ = post('{"prompt": "hi", "temperature": 0.7, "seed": 42}')
+        assert result is None
+    post('{"prompt": "hi", "temperature": 0}')
+    assert upstream.posts == 4
+
+    streamed = '{"prompt": "hi", "temperature": 0, "seed": 42, "stream": true}'
+    assert post(streamed) == (None, True, b"data: 0\n\ndata: 1\n\ndata: 2\n\n")
+    assert wait_for(lambda: len(cache) == 2)
+    assert post(streamed) == ("hit", True, b"data: 0\n\ndata: 1\n\ndata: 2\n\n")
+    assert upstream.posts == 5
+    assert daemon.model_runner.metrics.response_cache_lookups.value(("test/tiny:latest", "hit")) == 2
+
+
+def test_proxy_adds_slot_hints_for_llama_server(daemon):
+    model = daemon.model_runner.get_served_model(SERVE_PATH)
+    model.slot_hints, model.slots = True, SlotTracker(4)
+
+    payload = {"messages": [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]}
+    status, body = request(daemon, "POST", "/model/test/tiny", json.dumps(payload).encode("utf-8"))
+    assert status == 200
+    forwarded = json.loads(json.loads(body)["echo"])
+    assert forwarded["messages"] == payload["messages"]
+    assert forwarded["cache_prompt"] is True
+    assert 0 <= forwarded["id_slot"] < 4
+
+    # requests without a prompt are forwarded as they are
+    status, body = request(daemon, "POST", SERVE_PATH, b'{"input": "x"}')
+    assert json.loads(body)["echo"] == '{"input": "x"}'
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires Unix domain sockets")
+@pytest.mark.parametrize("server_class", [RamalamaServer, AsyncRamalamaServer], ids=["threaded", "asyncio"])
+def test_daemon_listens_on_unix_socket(server_class, tmp_path, upstream):
+    socket_path = str(tmp_path / "d.sock")
+    server = start_daemon(server_class, tmp_path, upstream, socket_path=socket_path)
+    try:
+        assert os.stat(socket_path).st_mode & 0o777 == 0o660
+        conn = daemon_connection("127.0.0.1", server.server_address[1], socket_path, timeout=10)
+        assert isinstance(conn, UnixHTTPConnection)
+        try:
+            for _ in range(2):
+                conn.request("POST", SERVE_PATH, body=b'{"prompt": "hi"}')
+                response = conn.getresponse()
+                assert response.status == 200
+                assert json.loads(response.read())["echo"] == '{"prompt": "hi"}'
+        finally:
+            conn.close()
+        # connections are kept alive like over TCP
+        assert upstream.connections == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert not os.path.exists(socket_path)
+    assert not isinstance(daemon_connection("127.0.0.1", 8080, socket_path), UnixHTTPConnection)
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires Unix domain sockets")
+def test_bind_unix_socket_replaces_stale_socket(tmp_path):
+    socket_path = str(tmp_path / "d.sock")
+    stale = bind_unix_socket(socket_path, 0o600)
+    stale.close()
+    with bind_unix_socket(socket_path, 0o600) as sock:
+        sock.listen()
+        assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        with pytest.raises(OSError, match="Another daemon"):
+            bind_unix_socket(socket_path, 0o600)
+
+
+def test_proxy_coalesces_embeddings_requests(daemon, upstream):
+    model = daemon.model_runner.get_served_model(SERVE_PATH)
+
+    def embed(text: str):
+        headers = {"Referer": f"http://host{SERVE_PATH}", "Content-Type": "application/json"}
+        body = json.dumps({"input": text, "model": "tiny"}).encode("utf-8")
+        status, body = request(daemon, "POST", "/model/test/v1/embeddings", body, headers)
+        return status, json.loads(body)
+
+    texts = ["a" * (i + 1) for i in range(8)]
+    # the batch is sent once it is full, long before the window ends
+    model.embedding_coalescer = EmbeddingCoalescer(model, window=5, max_inputs=len(texts))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(embed, texts))
+    (batch,) = upstream.embedding_batches
+    assert sorted(batch) == texts
+    for text, (status, response) in zip(texts, results):
+        assert status == 200
+        assert [(item["index"], item["embedding"][0]) for item in response["data"]] == [(0, len(text))]
+        assert response["usage"]["prompt_tokens"] == len(text)
+
+    # a batch failing for one input is retried request by request, so only that one fails
+    upstream.embedding_batches.clear()
+    model.embedding_coalescer = EmbeddingCoalescer(model, window=5, max_inputs=2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        bad, good = executor.map(embed, ["bad", "good"])
+    assert bad[0] == 400
+    assert good[0] == 200 and good[1]["data"][0]["embedding"][0] == 4
+
+
+def swap_to_upstream(monkeypatch, new_upstream, ready: threading.Event):
+    """Makes swap requests start a model server which becomes ready once ready is set."""
+    model = SimpleNamespace(model_name="tiny", model_tag="v2", model_organization="test")
+
+    def create_managed_model(self, serve_request, port, replica=0, generation=0):
+        cmd = [sys.executable, "-c", "import time; time.sleep(60)"]
+        m = ManagedModel(model, cmd, new_upstream.server_address[1], ready_check=ready.is_set, generation=generation)
+        m.serve_request = serve_request
+        return m
+
+    monkeypatch.setattr(DaemonAPIHandler, "_create_model", lambda self, name: model)
+    monkeypatch.setattr(DaemonAPIHandler, "_create_managed_model", create_managed_model)
+
+
+def test_hot_swap_keeps_serving_requests(daemon, upstream, monkeypatch):
+    new_upstream = start_upstream()
+    old = daemon.model_runner.get_served_model(SERVE_PATH)
+    ready = threading.Event()
+    swap_to_upstream(monkeypatch, new_upstream, ready)
+
+    stream = socket.create_connection(daemon.server_address, timeout=10)
+    try:
+        stream.sendall(
+            f"GET /model/test/hold HTTP/1.1\r\nHost: test\r\nReferer: http://host{SERVE_PATH}\r\n\r\n".encode()
+        )
+        data = b""
+        while b"data: open" not in data:
+            data += stream.recv(4096)
+
+        body = json.dumps({"model_name": "tiny:v2", "runtime": "llama.cpp", "drain_timeout": 10}).encode()
+        results = []
+        swap = threading.Thread(target=lambda: results.append(request(daemon, "POST", "/api/swap", body)))
+        swap.start()
+        assert wait_for(lambda: len(daemon.model_runner.managed_models) == 2)
+
+        # requests go to the old model server until the new one is ready
+        assert request(daemon, "GET", SERVE_PATH)[0] == 200
+        assert new_upstream.connections == 0
+        ready.set()
+        assert wait_for(lambda: daemon.model_runner.get_served_model(SERVE_PATH) is not old)
+        assert request(daemon, "GET", SERVE_PATH)[0] == 200
+        assert new_upstream.connections == 1
+
+        # the old model server is stopped once its stream finished
+        swap.join(0.2)
+        assert swap.is_alive() and old.process is not None
+        upstream.streams_released.set()
+        while not data.endswith(b"0\r\n\r\n"):
+            data += stream.recv(4096)
+        swap.join(5)
+        ((status, response),) = results
+        assert status == 200
+        swapped = daemon.model_runner.get_served_model(SERVE_PATH)
+        assert json.loads(response) == {"model_id": swapped.id, "serve_path": SERVE_PATH}
+        assert swapped.generation == 1 and swapped.state == ModelState.READY
+        assert list(daemon.model_runner.managed_models) == [swapped.id]
+        assert old.state == ModelState.STOPPED and old.process is None
+    finally:
+        upstream.streams_released.set()
+        stream.close()
+        new_upstream.shutdown()
+        new_upstream.server_close()
+
+
+def test_hot_swap_waits_for_requests_not_yet_admitted(daemon, upstream, monkeypatch):
+    new_upstream = start_upstream()
+    old = daemon.model_runner.get_served_model(SERVE_PATH)
+    ready = threading.Event()
+    ready.set()
+    swap_to_upstream(monkeypatch, new_upstream, ready)
+    # the request stays on the replica it was routed to before its body arrived
+    daemon.model_runner.prefix_affinity_chars = 0
+
+    body = json.dumps({"prompt": "hi"}).encode()
+    client = socket.create_connection(daemon.server_address, timeout=10)
+    try:
+        # the route of the request is resolved while its body is still being received
+        client.sendall(f"POST {SERVE_PATH} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n\r\n".encode())
+        client.sendall(body[:5])
+        assert wait_for(lambda: not old.idle)
+
+        swap_body = json.dumps({"model_name": "tiny:v2", "runtime": "llama.cpp", "drain_timeout": 10}).encode()
+        results = []
+        swap = threading.Thread(target=lambda: results.append(request(daemon, "POST", "/api/swap", swap_body)))
+        swap.start()
+        assert wait_for(lambda: daemon.model_runner.get_served_model(SERVE_PATH) is not old)
+        # the old model server is kept for the request routed to it
+        swap.join(0.3)
+        assert swap.is_alive() and old.process is not None
+
+        client.sendall(body[5:])
+        response = http.client.HTTPResponse(client)
+        response.begin()
+        assert response.status == 200
+        assert json.loads(response.read())["echo"] == body.decode()
+        assert upstream.posts == 1 and new_upstream.posts == 0
+
+        swap.join(5)
+        assert [status for status, _ in results] == [200]
+        assert old.state == ModelState.STOPPED and old.process is None
+    finally:
+        client.close()
+        new_upstream.shutdown()
+        new_upstream.server_close()
+
+
+class RecordingAccessLog(AccessLog):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records = []
+
+    def log(self, record):
+        self.records.append(record)
+        return super().log(record)
+
+
+def test_access_log_of_proxied_requests(daemon, upstream, tmp_path):
+    access_log = RecordingAccessLog(str(tmp_path / "logs" / "access.log"), max_bytes=1024 * 1024, backups=1)
+    access_log.start()
+    daemon.model_runner.access_log = access_log
+
+    body = json.dumps({"prompt": "hi", "stream": True, "stream_options": {"include_usage": True}}).encode()
+    status, streamed = request(daemon, "POST", SERVE_PATH, body)
+    assert status == 200
+    status, replied = request(daemon, "GET", SERVE_PATH)
+    assert status == 200
+    # requests are logged once the response has been sent
+    assert wait_for(lambda: len(access_log.records) == 2)
+    access_log.close()
+
+    with open(tmp_path / "logs" / "access.log") as f:
+        entries = sorted((json.loads(line) for line in f), key=lambda entry: entry["method"])
+    get, post = entries
+    assert {key: post[key] for key in ("client", "method", "path", "model", "status", "bytes")} == {
+        "client": "127.0.0.1",
+        "method": "POST",
+        "path": SERVE_PATH,
+        "model": "test/tiny:latest",
+        "status": 200,
+        "bytes": len(streamed),
+    }
+    # the token counts are the ones of the final event of the stream
+    assert (post["prompt_tokens"], post["completion_tokens"]) == (5, 3)
+    assert 0 <= post["ttfb_ms"] <= post["duration_ms"]
+    assert get["bytes"] == len(replied) and "prompt_tokens" not in get
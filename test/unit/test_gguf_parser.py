@@ -0,0 +1,128 @@
+"""
+Unit tests for the GGUFInfoParser
+"""
+
+import struct
+
+import pytest
+
+from ramalama.endian import GGUFEndian
+from ramalama.model_inspect.error import ParseError
+from ramalama.model_inspect.gguf_parser import GGML_TYPE, GGUF_VALUE_TYPE_FORMAT, GGUFInfoParser, GGUFValueType
+
+
+def encode_string(value: str, prefix: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack(f"{prefix}Q", len(raw)) + raw
+
+
+def encode_value(value_type: GGUFValueType, value, prefix: str) -> bytes:
+    if value_type == GGUFValueType.STRING:
+        return encode_string(value, prefix)
+    if value_type == GGUFValueType.ARRAY:
+        array_type, items = value
+        data = struct.pack(f"{prefix}IQ", array_type, len(items))
+        return data + b"".join(encode_value(array_type, item, prefix) for item in items)
+    return struct.pack(f"{prefix}{GGUF_VALUE_TYPE_FORMAT[value_type]}", value)
+
+
+def write_gguf(path, metadata: dict, tensors: list, endianness: GGUFEndian = GGUFEndian.LITTLE):
+    prefix = "<" if endianness == GGUFEndian.LITTLE else ">"
+    data = b"GGUF" + struct.pack(f"{prefix}IQQ", 3, len(tensors), len(metadata))
+    for key, (value_type, value) in metadata.items():
+        data += encode_string(key, prefix) + struct.pack(f"{prefix}I", value_type)
+        data += encode_value(value_type, value, prefix)
+    for name, dims, tensor_type, offset in tensors:
+        data += encode_string(name, prefix) + struct.pack(f"{prefix}I", len(dims))
+        data += b"".join(struct.pack(f"{prefix}Q", dim) for dim in dims)
+        data += struct.pack(f"{prefix}IQ", tensor_type, offset)
+    path.write_bytes(data)
+    return path
+
+
+TOKENS = ["<s>", "</s>", "hello", "wörld", ""]
+METADATA = {
+    "general.architecture": (GGUFValueType.STRING, "llama"),
+    "llama.block_count": (GGUFValueType.UINT32, 2),
+    "tokenizer.ggml.tokens": (GGUFValueType.ARRAY, (GGUFValueType.STRING, TOKENS)),
+    "tokenizer.ggml.scores": (GGUFValueType.ARRAY, (GGUFValueType.FLOAT32, [0.0, -1.5, 2.25, 3.0, -4.0])),
+    "tokenizer.ggml.token_type": (GGUFValueType.ARRAY, (GGUFValueType.INT32, [3, 3, 1, 1, -1])),
+    "tokenizer.ggml.merges_flags": (GGUFValueType.ARRAY, (GGUFValueType.BOOL, [True, False, True])),
+    "test.large_ids": (GGUFValueType.ARRAY, (GGUFValueType.UINT64, [0, 2**63, 2**64 - 1])),
+    "test.nested": (
+        GGUFValueType.ARRAY,
+        (GGUFValueType.ARRAY, [(GGUFValueType.UINT8, [1, 2]), (GGUFValueType.UINT8, [255])]),
+    ),
+}
+TENSORS = [
+    ("token_embd.weight", [8, 5], GGML_TYPE.GGML_TYPE_F32, 0),
+    ("output.weight", [8], GGML_TYPE.GGML_TYPE_F16, 160),
+]
+
+
+@pytest.mark.parametrize("endianness", [GGUFEndian.LITTLE, GGUFEndian.BIG])
+def test_parse_decodes_arrays(tmp_path, endianness):
+    model_path = write_gguf(tmp_path / "model.gguf", METADATA, TENSORS, endianness)
+
+    assert GGUFInfoParser.get_model_endianness(str(model_path)) == endianness
+
+    info = GGUFInfoParser.parse("model", "registry", str(model_path))
+    assert info.Endianness == endianness
+    assert info.Metadata.get("general.architecture") == "llama"
+    assert info.Metadata.get("llama.block_count") == 2
+    assert info.Metadata.get("tokenizer.ggml.tokens") == TOKENS
+    assert info.Metadata.get("tokenizer.ggml.scores") == [0.0, -1.5, 2.25, 3.0, -4.0]
+    assert info.Metadata.get("tokenizer.ggml.token_type") == [3, 3, 1, 1, -1]
+    assert info.Metadata.get("tokenizer.ggml.merges_flags") == [True, False, True]
+    assert info.Metadata.get("test.large_ids") == [0, 2**63, 2**64 - 1]
+    assert info.Metadata.get("test.nested") == [[1, 2], [255]]
+    assert [(t.name, t.dimensions, t.type, t.offset) for t in info.Tensors] == [
+        ("token_embd.weight", [8, 5], "GGML_TYPE_F32", 0),
+        ("output.weight", [8], "GGML_TYPE_F16", 160),
+    ]
+
+
+def test_parse_metadata_matches_buffered_reader(tmp_path):
+    model_path = write_gguf(tmp_path / "model.gguf", METADATA, TENSORS)
+
+    with open(model_path, "rb") as model:
+        model.seek(4 + 4 + 8)
+        buffered = GGUFInfoParser._parse_metadata(model, GGUFEndian.LITTLE)
+
+    assert GGUFInfoParser.parse_metadata(str(model_path)).data == buffered
+
+
+def test_parse_truncated_string_array(tmp_path):
+    metadata = {"tokenizer.ggml.tokens": (GGUFValueType.ARRAY, (GGUFValueType.STRING, TOKENS))}
+    model_path = write_gguf(tmp_path / "model.gguf", metadata, [])
+    model_path.write_bytes(model_path.read_bytes()[:-10])
+
+    with pytest.raises(ParseError):
+        GGUFInfoParser.parse_metadata(str(model_path))
+
+
+def test_parse_invalid_bool_array(tmp_path):
+    metadata = {"test.flags": (GGUFValueType.ARRAY, (GGUFValueType.UINT8, [0, 1, 2]))}
+    model_path = write_gguf(tmp_path / "model.gguf", metadata, [])
+    data = bytearray(model_path.read_bytes())
+    # patch the array element type from UINT8 to BOOL
+    type_offset = data.index(b"test.flags") + len(b"test.flags") + 4
+    data[type_offset : type_offset + 4] = struct.pack("<I", GGUFValueType.BOOL)
+    model_path.write_bytes(bytes(data))
+
+    with pytest.raises(ParseError):
+        GGUFInfoParser.parse_metadata(str(model_path))
+
+
+def test_get_tensor_data_ranges(tmp_path):
+    metadata = {"general.alignment": (GGUFValueType.UINT32, 64)}
+    model_path = write_gguf(tmp_path / "model.gguf", metadata, TENSORS)
+    header_size = model_path.stat().st_size
+    data_offset = header_size + (64 - header_size % 64) % 64
+    with open(model_path, "ab") as model:
+        model.write(b"\0" * (data_offset - header_size + 200))
+
+    assert GGUFInfoParser.get_tensor_data_ranges(str(model_path)) == [
+        (data_offset, data_offset + 160),
+        (data_offset + 160, data_offset + 200),
+    ]
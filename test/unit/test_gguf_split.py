@@ -0,0 +1,127 @@
+"""
+Unit tests for splitting GGUF models
+"""
+
+import os
+import struct
+
+import pytest
+
+from ramalama.model_inspect.gguf_parser import GGUFInfoParser, GGUFValueType
+from ramalama.model_store.gguf_split import (
+    SPLIT_KEY_COUNT,
+    SPLIT_KEY_NO,
+    SPLIT_KEY_TENSORS_COUNT,
+    is_gguf_shard,
+    read_gguf_layout,
+    split_gguf,
+)
+
+ALIGNMENT = 32
+
+
+def _string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * ((ALIGNMENT - len(data) % ALIGNMENT) % ALIGNMENT)
+
+
+def write_model(path, tensor_sizes: list[int]) -> str:
+    """Writes a little endian GGUF model with F32 tensors of the given element counts."""
+    kvs = [
+        _string("general.architecture") + struct.pack("<I", GGUFValueType.STRING) + _string("llama"),
+        _string("general.name") + struct.pack("<I", GGUFValueType.STRING) + _string("tiny"),
+    ]
+    infos = b""
+    data = b""
+    for i, size in enumerate(tensor_sizes):
+        infos += _string(f"blk.{i}.weight") + struct.pack("<IQIQ", 1, size, 0, len(data))
+        data += _pad(bytes([i + 1]) * size * 4)
+    header = b"GGUF" + struct.pack("<IQQ", 3, len(tensor_sizes), len(kvs)) + b"".join(kvs) + infos
+    with open(path, "wb") as model:
+        model.write(_pad(header) + data)
+    return str(path)
+
+
+def tensor_data(model_path: str) -> dict[str, bytes]:
+    layout = read_gguf_layout(model_path)
+    with open(model_path, "rb") as model:
+        result = {}
+        for tensor in layout.tensors:
+            model.seek(tensor.source_offset)
+            result[tensor.name] = model.read(tensor.size)
+        return result
+
+
+def test_read_gguf_layout(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [10, 3, 8])
+    layout = read_gguf_layout(model_path)
+
+    assert layout.metadata["general.name"] == "tiny"
+    assert list(layout.kv_entries) == ["general.architecture", "general.name"]
+    assert [t.name for t in layout.tensors] == ["blk.0.weight", "blk.1.weight", "blk.2.weight"]
+    assert [t.size for t in layout.tensors] == [64, 32, 32]
+    assert layout.tensors[-1].source_offset + layout.tensors[-1].size == os.path.getsize(model_path)
+
+
+def test_split_and_merge_roundtrip(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [10, 3, 8, 20, 1])
+
+    shard_paths = split_gguf(model_path, str(tmp_path / "shards"), max_size=128)
+    assert [os.path.basename(p) for p in shard_paths] == [
+        "model-00001-of-00002.gguf",
+        "model-00002-of-00002.gguf",
+    ]
+
+    first = GGUFInfoParser.parse_metadata(shard_paths[0])
+    assert first.get("general.name") == "tiny"
+    assert first.get(SPLIT_KEY_NO) == 0
+    assert first.get(SPLIT_KEY_COUNT) == 2
+    assert first.get(SPLIT_KEY_TENSORS_COUNT) == 5
+    last = GGUFInfoParser.parse_metadata(shard_paths[1])
+    assert last.get("general.name") is None
+    assert last.get(SPLIT_KEY_NO) == 1
+
+    shard_tensors: dict[str, bytes] = {}
+    for shard_path in shard_paths:
+        shard_tensors.update(tensor_data(shard_path))
+    assert shard_tensors == tensor_data(model_path)
+
+
+def test_split_by_tensor_count(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [1, 1, 1, 1, 1])
+    shard_paths = split_gguf(model_path, str(tmp_path), max_tensors=2, prefix="tiny")
+    assert [len(read_gguf_layout(p).tensors) for p in shard_paths] == [2, 2, 1]
+    assert os.path.basename(shard_paths[0]) == "tiny-00001-of-00003.gguf"
+
+
+def test_split_oversized_tensor_gets_own_shard(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [1, 100, 1])
+    shard_paths = split_gguf(model_path, str(tmp_path / "shards"), max_size=64)
+    assert [len(read_gguf_layout(p).tensors) for p in shard_paths] == [1, 1, 1]
+
+
+def test_split_already_split_model(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [1, 1])
+    shard_paths = split_gguf(model_path, str(tmp_path / "shards"), max_tensors=1)
+    with pytest.raises(ValueError):
+        split_gguf(shard_paths[0], str(tmp_path / "again"), max_tensors=1)
+
+
+def test_split_requires_limit(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [1])
+    with pytest.raises(ValueError):
+        split_gguf(model_path, str(tmp_path / "shards"))
+
+
+def test_is_gguf_shard(tmp_path):
+    model_path = write_model(tmp_path / "model.gguf", [1, 1, 1])
+    shard_paths = split_gguf(model_path, str(tmp_path / "shards"), max_tensors=1)
+    assert not is_gguf_shard("model.gguf", model_path)
+    for shard_path in shard_paths:
+        assert is_gguf_shard(os.path.basename(shard_path), shard_path)
+    # renamed shards are recognized by their metadata
+    assert is_gguf_shard("renamed.gguf", shard_paths[1])
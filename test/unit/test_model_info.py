@@ -0,0 +1,69 @@
+"""
+Unit tests for the serialization of model information
+"""
+
+import json
+
+import pytest
+
+from ramalama.endian import GGUFEndian
+from ramalama.model_inspect.base_info import MAX_ARRAY_ITEMS, Tensor, adjust_new_line, dump_json, truncate_array
+from ramalama.model_inspect.gguf_info import GGUFModelInfo
+
+METADATA = {
+    "general.architecture": "llama",
+    "llama.block_count": 2,
+    "tokenizer.ggml.tokens": [f"tok\n{i} wörld" for i in range(100)],
+    "tokenizer.ggml.scores": [i / 3 for i in range(100)],
+    "test.flags": [True, False, None],
+    "test.nested": [[1, 2], [], {"a": [1.5]}],
+    "test.empty": {},
+}
+TENSORS = [Tensor(f"blk.{i}.weight", 2, [4096, i], "GGML_TYPE_Q4_K", i * 128) for i in range(50)]
+
+
+def model_info() -> GGUFModelInfo:
+    return GGUFModelInfo("model", "registry", "/models/model.gguf", 3, METADATA, TENSORS, GGUFEndian.LITTLE)
+
+
+@pytest.mark.parametrize("value", [METADATA, [], {}, "", 0, [[]], [float("inf"), -0.0, 2**64]])
+def test_dump_json_matches_json_module(value):
+    assert dump_json(value) == json.dumps(value, sort_keys=True, indent=4)
+
+
+def test_gguf_to_json_all_matches_json_module():
+    info = model_info()
+    expected = json.dumps(info, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+    assert info.serialize(json=True, all=True) == expected
+
+
+def test_truncate_array():
+    assert truncate_array([1, 2, 3], 3) == [1, 2, 3]
+    assert truncate_array([1, 2, 3, 4], 2) == [1, 2, "... (2 more)"]
+    assert truncate_array("not an array", 2) == "not an array"
+
+
+def test_metadata_serialize_truncates_arrays():
+    metadata = model_info().Metadata
+
+    tokens = json.loads(metadata.serialize(json=True))["tokenizer.ggml.tokens"]
+    assert len(tokens) == MAX_ARRAY_ITEMS + 1
+    assert tokens[-1] == f"... ({100 - MAX_ARRAY_ITEMS} more)"
+
+    assert (
+        json.loads(metadata.serialize(json=True, all=True))["tokenizer.ggml.tokens"]
+        == METADATA["tokenizer.ggml.tokens"]
+    )
+
+
+def test_serialize_all_lists_every_tensor():
+    lines = model_info().serialize(all=True).splitlines()
+    assert lines[0] == "model"
+    assert sum(1 for line in lines if "blk." in line) == len(TENSORS)
+
+
+def test_adjust_new_line():
+    assert adjust_new_line("short", 10) == "short\n"
+    assert adjust_new_line("short\n", 10) == "short\n"
+    assert adjust_new_line("a" * 20, 10) == "aaaaaaa...\n"
+    assert adjust_new_line("a" * 20 + "\n", 10) == "aaaaaaa...\n"
@@ -0,0 +1,117 @@
+"""
+Unit tests for the cached model listing of the ramalama daemon
+"""
+
+import json
+import struct
+
+import pytest
+
+from ramalama.daemon.service.model_listing import ModelListingCache, etag_matches
+from ramalama.model_inspect.gguf_parser import GGUFValueType
+from ramalama.model_store.global_store import GlobalModelStore
+from ramalama.model_store.snapshot_file import LocalSnapshotFile, SnapshotFileType
+from ramalama.model_store.store import ModelStore
+
+
+def _string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw
+
+
+def gguf_content(metadata: dict) -> bytes:
+    kvs = b""
+    for key, value in metadata.items():
+        if isinstance(value, str):
+            kvs += _string(key) + struct.pack("<I", GGUFValueType.STRING) + _string(value)
+        else:
+            kvs += _string(key) + struct.pack("<II", GGUFValueType.UINT32, value)
+    return b"GGUF" + struct.pack("<IQQ", 3, 0, len(metadata)) + kvs
+
+
+def add_model(store_path, name: str, metadata: dict) -> ModelStore:
+    model_store = ModelStore(GlobalModelStore(str(store_path)), name, "ollama", "library")
+    content = gguf_content(metadata)
+    files = [LocalSnapshotFile(content, "model.gguf", SnapshotFileType.GGUFModel)]
+    model_store.new_snapshot("latest", files[0].hash, files, verify=False)
+    return model_store
+
+
+LLAMA_METADATA = {"general.architecture": "llama", "general.size_label": "135M", "general.file_type": 15}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ModelListingCache(str(tmp_path))
+    built = []
+    build_response = cache._build_response
+
+    def counting_build_response(model_name, model_files):
+        built.append(model_name)
+        return build_response(model_name, model_files)
+
+    monkeypatch.setattr(cache, "_build_response", counting_build_response)
+    cache.built = built
+    return cache
+
+
+def test_listing_contains_gguf_details(tmp_path, cache):
+    add_model(tmp_path, "tiny", LLAMA_METADATA)
+
+    body, etag = cache.get()
+    models = json.loads(body)["models"]
+    assert [m["name"] for m in models] == ["tiny"]
+    assert models[0]["details"] == {
+        "parent_model": "",
+        "format": "gguf",
+        "family": "llama",
+        "families": ["llama"],
+        "parameter_size": "135M",
+        "quantization_level": "Q4_K_M",
+    }
+    assert etag.startswith('"') and etag.endswith('"')
+
+
+def test_listing_is_rebuilt_incrementally(tmp_path, cache):
+    add_model(tmp_path, "tiny", LLAMA_METADATA)
+    body, etag = cache.get()
+    assert cache.get() == (body, etag)
+    assert cache.built == ["ollama://library/tiny:latest"]
+
+    # adding a model bumps the generation of the store, only the new model is built
+    small = add_model(tmp_path, "small", {"general.architecture": "qwen2"})
+    new_body, new_etag = cache.get()
+    assert new_etag != etag
+    assert sorted(m["name"] for m in json.loads(new_body)["models"]) == ["small", "tiny"]
+    assert cache.built == ["ollama://library/tiny:latest", "ollama://library/small:latest"]
+
+    small.remove_snapshot("latest")
+    assert cache.get() == (body, etag)
+    assert len(cache.built) == 2
+
+
+def test_listing_rechecks_store_after_max_age(tmp_path, cache, monkeypatch):
+    add_model(tmp_path, "tiny", LLAMA_METADATA)
+    cache.get()
+    # a store modified without updating the generation is picked up after the max age
+    monkeypatch.setattr(GlobalModelStore, "bump_generation", lambda self: None)
+    add_model(tmp_path, "small", {"general.architecture": "qwen2"})
+    assert len(json.loads(cache.get()[0])["models"]) == 1
+
+    cache.max_age = 0
+    assert len(json.loads(cache.get()[0])["models"]) == 2
+
+
+@pytest.mark.parametrize(
+    "if_none_match,expected",
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+    ],
+)
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, '"abc"') == expected
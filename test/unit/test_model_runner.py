@@ -0,0 +1,861 @@
+"""
+Unit tests for the ModelRunner of the ramalama daemon
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ramalama.config import DaemonConfig
+from ramalama.daemon.dto.serve import ServeRequest
+from ramalama.daemon.handler.daemon import DaemonAPIHandler
+from ramalama.daemon.service.access_log import AccessLog, AccessRecord, token_counts
+from ramalama.daemon.service.admission import (
+    AdmissionController,
+    QueueFullError,
+    QueueTimeoutError,
+    parallel_slots,
+)
+from ramalama.daemon.service.affinity import SlotTracker, hinted_body, prefix_hash, prompt_prefix
+from ramalama.daemon.service.coalescing import embedding_inputs, split_embeddings
+from ramalama.daemon.service.footprint import estimate_footprint, estimate_kv_cache_size
+from ramalama.daemon.service.model_runner import ManagedModel, MemoryBudgetExceededError, ModelRunner, ModelState
+from ramalama.daemon.service.port_allocator import PortAllocator
+from ramalama.daemon.service.preload import ModelPreloader
+from ramalama.daemon.service.reaper import IdleModelReaper
+from ramalama.daemon.service.replicas import ReplicaAutoscaler, ReplicaScaling, replica_cpus
+from ramalama.daemon.service.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    parse_json_request,
+    response_cache_key,
+)
+from ramalama.daemon.service.services import DaemonServices
+from ramalama.daemon.service.state import (
+    STATE_FILE_NAME,
+    AdoptedProcess,
+    DaemonStateFile,
+    ModelRecord,
+    process_matches,
+)
+from ramalama.daemon.service.supervisor import ModelSupervisor, restart_backoff
+from ramalama.model_inspect.gguf_info import GGUFModelMetadata
+from ramalama.model_inspect.gguf_parser import GGUFValueType
+
+GiB = 1024**3
+IDLE_CMD = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def managed_model(name: str, footprint: int, port: int = 0) -> ManagedModel:
+    model = SimpleNamespace(model_name=name, model_tag="latest", model_organization="test")
+    return ManagedModel(model, IDLE_CMD, port, footprint=footprint)
+
+
+@pytest.fixture
+def runner():
+    runner = ModelRunner(memory_budget=10 * GiB)
+    yield runner
+    runner.stop()
+
+
+def serve(runner: ModelRunner, name: str, footprint: int) -> ManagedModel:
+    m = managed_model(name, footprint)
+    runner.add_model(m)
+    runner.start_model(m.id, f"/model/test/{name}")
+    return m
+
+
+def test_evicts_least_recently_used(runner):
+    a = serve(runner, "a", 4 * GiB)
+    b = serve(runner, "b", 4 * GiB)
+    with a.track_request():
+        pass
+
+    c = serve(runner, "c", 4 * GiB)
+    assert set(runner.managed_models) == {a.id, c.id}
+    assert runner.memory_used == 8 * GiB
+    assert runner.evictions == 1
+    assert b.process is None
+
+
+def test_never_evicts_models_in_flight(runner):
+    a = serve(runner, "a", 4 * GiB)
+    b = serve(runner, "b", 4 * GiB)
+    with a.track_request():
+        serve(runner, "c", 4 * GiB)
+        assert a.id in runner.managed_models
+        assert b.id not in runner.managed_models
+
+        d = managed_model("d", 8 * GiB)
+        runner.add_model(d)
+        with pytest.raises(MemoryBudgetExceededError):
+            runner.start_model(d.id, "/model/test/d")
+    assert a.in_flight == 0
+
+
+def test_never_evicts_or_expires_models_with_queued_requests(runner):
+    a = serve(runner, "a", 4 * GiB)
+    a.admission = AdmissionController(max_concurrent=1, max_queued=10)
+    b = serve(runner, "b", 4 * GiB)
+    with b.track_request():
+        pass
+
+    def request():
+        with a.admit("client"), a.track_request():
+            pass
+
+    # the only slot of a is taken, so the request waits in its queue
+    with a.admission.admit("client"):
+        thread = threading.Thread(target=request)
+        thread.start()
+        assert wait_for(lambda: a.admission.queued == 1)
+        assert a.in_flight == 0
+
+        a.expiration_date = datetime.now() - timedelta(seconds=1)
+        runner.stop_expired_models()
+        assert a.id in runner.managed_models
+
+        serve(runner, "c", 4 * GiB)
+        assert a.id in runner.managed_models
+        assert b.id not in runner.managed_models
+    thread.join(5)
+
+
+def test_model_exceeding_budget(runner):
+    a = serve(runner, "a", 4 * GiB)
+    big = managed_model("big", 11 * GiB)
+    runner.add_model(big)
+    with pytest.raises(MemoryBudgetExceededError):
+        runner.start_model(big.id, "/model/test/big")
+    assert a.process is not None
+
+
+def test_unlimited_budget():
+    runner = ModelRunner()
+    try:
+        for name in ["a", "b", "c"]:
+            serve(runner, name, 100 * GiB)
+        assert runner.evictions == 0
+    finally:
+        runner.stop()
+
+
+def _string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return struct.pack("<Q", len(raw)) + raw
+
+
+def write_gguf(path, metadata: dict) -> str:
+    kvs = b""
+    for key, value in metadata.items():
+        if isinstance(value, str):
+            kvs += _string(key) + struct.pack("<I", GGUFValueType.STRING) + _string(value)
+        else:
+            kvs += _string(key) + struct.pack("<II", GGUFValueType.UINT32, value)
+    path.write_bytes(b"GGUF" + struct.pack("<IQQ", 3, 0, len(metadata)) + kvs)
+    return str(path)
+
+
+LLAMA_METADATA = {
+    "general.architecture": "llama",
+    "llama.block_count": 32,
+    "llama.embedding_length": 4096,
+    "llama.attention.head_count": 32,
+    "llama.attention.head_count_kv": 8,
+    "llama.context_length": 8192,
+}
+
+
+def test_estimate_kv_cache_size():
+    metadata = GGUFModelMetadata(LLAMA_METADATA)
+    # 32 layers * 8 KV heads * (128 + 128) head dims * 2 bytes per context token
+    assert estimate_kv_cache_size(metadata, 4096) == 32 * 8 * 256 * 2 * 4096
+    assert estimate_kv_cache_size(metadata) == 32 * 8 * 256 * 2 * 8192
+    assert estimate_kv_cache_size(GGUFModelMetadata({"general.architecture": "llama"})) == 0
+
+
+def test_estimate_footprint(tmp_path):
+    model_path = write_gguf(tmp_path / "model.gguf", LLAMA_METADATA)
+    size = (tmp_path / "model.gguf").stat().st_size
+
+    assert estimate_footprint([model_path], 1024) == size + 32 * 8 * 256 * 2 * 1024
+    assert estimate_footprint([str(tmp_path / "missing.gguf")]) == 0
+
+
+def test_drain_waits_for_requests_in_flight(runner):
+    a = serve(runner, "a", GiB)
+    assert a.state == ModelState.READY
+
+    with a.track_request():
+        assert not a.drain(timeout=0.1)
+        assert a.state == ModelState.DRAINING
+        assert not a.wait_until_ready(0)
+    assert a.drain(timeout=0.1)
+
+    runner.stop_model(a.id)
+    assert a.state == ModelState.STOPPED
+
+
+def test_ready_probe_timeout(runner):
+    m = managed_model("slow", GiB)
+    m.ready_check = lambda: False
+    m.ready_timeout = 0.2
+    runner.add_model(m)
+    runner.start_model(m.id, "/model/test/slow")
+
+    assert m.state == ModelState.STARTING
+    assert not m.wait_until_ready(5)
+    assert m.state == ModelState.STOPPED
+
+
+def test_port_allocator_reuses_released_ports_last():
+    allocator = PortAllocator(20000, 20002)
+    first = allocator.allocate()
+    second = allocator.allocate()
+    allocator.release(first)
+    assert allocator.allocate() == 20002
+    assert allocator.allocate() == first
+    assert allocator.used == {first, second, 20002}
+    with pytest.raises(RuntimeError):
+        allocator.allocate()
+
+
+def test_port_allocator_skips_ports_in_use():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        allocator = PortAllocator(port, port + 1)
+        assert allocator.allocate() == port + 1
+
+
+def test_concurrent_port_allocation():
+    allocator = PortAllocator(20000, 20199)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ports = list(executor.map(lambda _: allocator.allocate(), range(100)))
+    assert len(set(ports)) == 100
+
+
+def test_stop_model_releases_port(runner):
+    port = runner.next_available_port()
+    m = managed_model("a", GiB, port)
+    runner.add_model(m)
+    runner.start_model(m.id, "/model/test/a")
+    assert runner.get_served_model("/model/test/a") is m
+
+    runner.stop_model(m.id)
+    assert runner.get_served_model("/model/test/a") is None
+    assert port not in runner._ports.used
+
+
+def test_records_model_start_duration(runner):
+    ready = [False]
+    m = managed_model("slow", GiB)
+    m.ready_check = lambda: ready[0]
+    runner.add_model(m)
+    runner.start_model(m.id, "/model/test/slow")
+    assert runner.metrics.model_start_duration.count(("test/slow:latest",)) == 0
+
+    ready[0] = True
+    assert m.wait_until_ready(5)
+    assert runner.metrics.model_start_duration.count(("test/slow:latest",)) == 1
+
+
+def test_never_evicts_or_expires_pinned_models(runner):
+    a = serve(runner, "a", 4 * GiB)
+    a.pinned = True
+    b = serve(runner, "b", 4 * GiB)
+    with b.track_request():
+        pass
+
+    serve(runner, "c", 4 * GiB)
+    assert a.id in runner.managed_models
+    assert b.id not in runner.managed_models
+
+    a.expiration_date = datetime.now() - timedelta(seconds=1)
+    runner.stop_expired_models()
+    assert a.id in runner.managed_models
+
+
+def preloader(runner: ModelRunner, preload: dict, serve_fn=None) -> ModelPreloader:
+    def serve_request(request: ServeRequest) -> ManagedModel:
+        m = managed_model(request.model_name, GiB)
+        m.pinned = request.pinned
+        runner.add_model(m)
+        runner.start_model(m.id, f"/model/test/{request.model_name}")
+        return m
+
+    config = DaemonConfig(preload=preload, preload_concurrency=2)
+    return ModelPreloader(runner, serve_fn or serve_request, config, "llama.cpp")
+
+
+def test_preloads_models(runner):
+    p = preloader(runner, {"a": {"pinned": True, "options": {"ctx_size": 4096}}, "b": {}})
+    assert p.entries[0].serve_request.exec_args == {"--ctx-size": "4096"}
+    assert p.readiness()[0] is False
+
+    p.start()
+    assert p.wait(5)
+    ready, models = p.readiness()
+    assert ready
+    assert [(m["name"], m["pinned"], m["state"]) for m in models] == [("a", True, "ready"), ("b", False, "ready")]
+    assert {m.model.model_name for m in runner.managed_models.values()} == {"a", "b"}
+
+    p.stop()
+    assert not runner.managed_models
+    assert p.readiness()[0] is False
+
+
+def test_not_ready_when_pinned_model_fails(runner):
+    def fail(request: ServeRequest) -> ManagedModel:
+        raise RuntimeError("no such model")
+
+    p = preloader(runner, {"a": {"pinned": True}}, fail)
+    p.start()
+    assert p.wait(5)
+    ready, models = p.readiness()
+    assert not ready
+    assert models[0]["state"] == "failed"
+    assert models[0]["error"] == "no such model"
+
+
+def test_parallel_slots():
+    assert parallel_slots(["llama-server", "--parallel", "8"]) == 8
+    assert parallel_slots(["llama-server", "-np", "2", "--port", "8081"]) == 2
+    assert parallel_slots(["llama-server", "--parallel=3"]) == 3
+    assert parallel_slots(["llama-server", "-np", "-1"]) is None
+    assert parallel_slots(["llama-server"]) is None
+
+
+def test_admission_serves_clients_in_turn():
+    admission = AdmissionController(max_concurrent=1, max_queued=10)
+    order = []
+
+    def request(client: str, name: str):
+        with admission.admit(client):
+            order.append(name)
+
+    with admission.admit("a"):
+        threads = []
+        for client, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1")]:
+            thread = threading.Thread(target=request, args=(client, name))
+            thread.start()
+            threads.append(thread)
+            # the requests are queued in the order they were sent
+            assert wait_for(lambda: admission.queued == len(threads))
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+    assert admission.active == 0
+    assert admission.queued == 0
+
+
+def test_admission_rejects_requests_when_queue_is_full():
+    admission = AdmissionController(max_concurrent=1, max_queued=0)
+    with admission.admit("a"):
+        with pytest.raises(QueueFullError) as e:
+            with admission.admit("b"):
+                pass
+        assert e.value.retry_after >= 1
+    assert admission.active == 0
+
+    admission.max_queued = 1
+    with admission.admit("a"):
+        with pytest.raises(QueueTimeoutError):
+            with admission.admit("b", timeout=0.1):
+                pass
+        assert admission.queued == 0
+    assert admission.active == 0
+
+
+def test_async_admission_releases_slot_of_cancelled_request():
+    admission = AdmissionController(max_concurrent=1, max_queued=10)
+
+    async def scenario():
+        async with admission.admit_async("a") as waited:
+            assert waited < 0.1
+            queued = asyncio.create_task(admission.admit_async("b").__aenter__())
+            await asyncio.sleep(0.01)
+            assert admission.queued == 1
+            queued.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+        assert admission.queued == 0
+        assert admission.active == 0
+
+        async with admission.admit_async("a"):
+            with pytest.raises(QueueTimeoutError):
+                async with admission.admit_async("b", timeout=0.05):
+                    pass
+
+    asyncio.run(scenario())
+    assert admission.active == 0
+
+
+def test_reaper_stops_idle_models(runner):
+    idle = serve(runner, "idle", GiB)
+    idle.expires_after = timedelta(seconds=0.1)
+    busy = serve(runner, "busy", GiB)
+    busy.expires_after = timedelta(seconds=0.1)
+    pinned = serve(runner, "pinned", GiB)
+    pinned.expires_after = timedelta(seconds=0.1)
+    pinned.pinned = True
+    for m in (idle, busy, pinned):
+        m.update_expiration_date()
+
+    reaper = IdleModelReaper(runner, 0.05)
+    reaper.start()
+    try:
+        with busy.track_request():
+            assert wait_for(lambda: idle.id not in runner.managed_models)
+            time.sleep(0.2)
+            assert busy.id in runner.managed_models
+        # the idle timeout starts once the last request finished
+        assert busy.expiration_date > datetime.now()
+        assert wait_for(lambda: busy.id not in runner.managed_models)
+        assert pinned.id in runner.managed_models
+    finally:
+        reaper.stop()
+
+
+def test_supervisor_restarts_crashed_model_servers(runner):
+    m = serve(runner, "crashy", GiB)
+    supervisor = ModelSupervisor(runner, max_restarts=2, backoff=0.5, interval=0.02)
+    supervisor.start()
+    try:
+        crashed = m.process
+        crashed.kill()
+        assert wait_for(lambda: m.state == ModelState.FAILED)
+        # requests waiting for the model are answered right away instead of waiting for its restart
+        start = time.monotonic()
+        assert not m.wait_until_ready(5)
+        assert time.monotonic() - start < 0.5
+        assert runner.get_served_model("/model/test/crashy") is m
+
+        assert wait_for(lambda: m.state == ModelState.READY)
+        assert m.process is not crashed and m.process.poll() is None
+        assert runner.metrics.model_crashes.total() == 1
+
+        # with more than max_restarts crashes within the window the model is given up on
+        supervisor.backoff = 0.01
+        for crashes in (2, 3):
+            m.process.kill()
+            assert wait_for(lambda: runner.metrics.model_crashes.total() == crashes)
+            if crashes == 2:
+                assert wait_for(lambda: m.state == ModelState.READY)
+        assert wait_for(lambda: m.id not in runner.managed_models)
+        assert m.state == ModelState.STOPPED and m.process is None
+    finally:
+        supervisor.stop()
+
+
+def test_supervisor_ignores_stopped_models(runner):
+    m = serve(runner, "stopped", GiB)
+    supervisor = ModelSupervisor(runner, interval=0.01)
+    supervisor.start()
+    try:
+        runner.stop_model(m.id)
+        time.sleep(0.1)
+        assert runner.metrics.model_crashes.total() == 0
+    finally:
+        supervisor.stop()
+    assert [restart_backoff(n, 1.0) for n in (1, 2, 3, 8)] == [1.0, 2.0, 4.0, 60.0]
+
+
+def test_swap_keeps_replaced_models_in_budget(runner):
+    old = serve(runner, "a", 4 * GiB)
+    idle = serve(runner, "idle", 4 * GiB)
+    new = ManagedModel(old.model, IDLE_CMD, 0, footprint=4 * GiB, generation=1)
+    assert new.id == f"{old.id}-v1"
+    runner.add_model(new)
+
+    # the idle model is evicted for the new one, the replaced one keeps running until stopped
+    runner.start_standby(new.id, "/model/test/a")
+    assert set(runner.managed_models) == {old.id, new.id}
+    assert runner.get_served_model("/model/test/a") is old
+    assert runner.memory_used == 8 * GiB and idle.process is None
+
+    assert runner.swap_served_model("/model/test/a", new.id) == [old]
+    assert runner.get_served_model("/model/test/a") is new
+    # the replaced model is finishing its requests and never evicted
+    with new.track_request(), pytest.raises(MemoryBudgetExceededError):
+        serve(runner, "b", 4 * GiB)
+    runner.stop_model(old.id)
+    assert runner.memory_used == 4 * GiB
+
+
+def serve_replicas(runner: ModelRunner, name: str, min_replicas: int, max_replicas: int, footprint: int = GiB) -> str:
+    def create_replica(replica: int) -> ManagedModel:
+        model = SimpleNamespace(model_name=name, model_tag="latest", model_organization="test")
+        m = ManagedModel(model, IDLE_CMD, runner.next_available_port(), footprint=footprint, replica=replica)
+        m.admission = AdmissionController(1, 8)
+        return m
+
+    serve_path = f"/model/test/{name}"
+    first = create_replica(0)
+    runner.add_model(first)
+    runner.start_model(first.id, serve_path)
+    runner.set_scaling(serve_path, ReplicaScaling(create_replica, min_replicas, max_replicas))
+    for _ in range(1, min_replicas):
+        runner.add_replica(serve_path)
+    return serve_path
+
+
+def test_routes_to_replica_with_fewest_outstanding_requests(runner):
+    serve_path = serve_replicas(runner, "a", 2, 2)
+    first, second = runner.get_replicas(serve_path)
+    assert (first.id, second.id) == (first.model_id, f"{first.model_id}-1")
+    assert first.port != second.port
+    assert runner.get_served_model(serve_path) is first
+
+    with first.track_request():
+        assert runner.get_served_model(serve_path) is second
+        with second.track_request(), second.track_request():
+            assert runner.get_served_model(serve_path) is first
+
+    with pytest.raises(RuntimeError):
+        runner.add_replica(serve_path)
+    second.drain(0)
+    assert runner.get_served_model(serve_path) is first
+    runner.stop_served_model(serve_path)
+    assert runner.managed_models == {}
+    assert runner.scaling == {}
+
+
+def test_replicas_are_not_evicted_for_each_other(runner):
+    serve_path = serve_replicas(runner, "a", 1, 2, footprint=6 * GiB)
+    with pytest.raises(MemoryBudgetExceededError):
+        runner.add_replica(serve_path)
+    assert len(runner.get_replicas(serve_path)) == 1
+    assert runner.evictions == 0
+
+
+def test_autoscaler_follows_queue_depth(runner):
+    serve_path = serve_replicas(runner, "a", 1, 2)
+    first = runner.get_served_model(serve_path)
+    release = threading.Event()
+
+    def hold_slot():
+        with first.admit("b"):
+            release.wait()
+
+    autoscaler = ReplicaAutoscaler(runner, scale_up_queue_depth=2, scale_down_delay=0.2, interval=0.05)
+    autoscaler.start()
+    try:
+        with first.admit("a"):
+            queued = [threading.Thread(target=hold_slot) for _ in range(2)]
+            for t in queued:
+                t.start()
+            # new requests are routed to the added replica once it is ready
+            assert wait_for(lambda: runner.get_served_model(serve_path).replica == 1)
+        release.set()
+        for t in queued:
+            t.join()
+
+        # the added replica is stopped once it has been idle for the scale down delay
+        assert wait_for(lambda: runner.get_replicas(serve_path) == [first])
+    finally:
+        release.set()
+        autoscaler.stop()
+
+
+def test_autoscaler_drains_idle_replica_in_the_background(runner, monkeypatch):
+    serve_path = serve_replicas(runner, "a", 1, 2)
+    runner.add_replica(serve_path)
+    first, second = runner.get_replicas(serve_path)
+    drained = threading.Event()
+    monkeypatch.setattr(second, "wait_until_idle", lambda timeout=None: drained.wait(timeout))
+
+    autoscaler = ReplicaAutoscaler(runner, scale_down_delay=0)
+    autoscaler.scale()
+    # the replica stops receiving requests right away and is stopped once its requests finished
+    assert second.state == ModelState.DRAINING
+    assert runner.get_served_model(serve_path) is first
+    autoscaler.scale()
+    assert runner.get_replicas(serve_path) == [first, second]
+
+    drained.set()
+    assert wait_for(lambda: runner.get_replicas(serve_path) == [first])
+    assert first.state == ModelState.READY
+
+
+def test_replica_cpus():
+    cpus = list(range(8))
+    assert replica_cpus(0, 1, cpus) is None
+    assert replica_cpus(0, 2, cpus) == [0, 1, 2, 3]
+    assert replica_cpus(1, 2, cpus) == [4, 5, 6, 7]
+    assert replica_cpus(2, 3, cpus) == [4, 5]
+    assert replica_cpus(0, 16, cpus) is None
+
+
+@pytest.mark.parametrize(
+    "body, cacheable",
+    [
+        (b'{"temperature": 0, "seed": 1}', True),
+        (b'{"temperature": 0.0, "seed": 0, "stream": true}', True),
+        (b'{"temperature": 0.2, "seed": 1}', False),
+        (b'{"temperature": 0}', False),
+        (b'{"temperature": 0, "seed": -1}', False),
+        (b'{"temperature": 0, "seed": 1.5}', False),
+        (b'{"seed": 1}', False),
+        (b'[{"temperature": 0, "seed": 1}]', False),
+        (b"not json", False),
+    ],
+)
+def test_response_cache_key(body, cacheable):
+    request = parse_json_request(body)
+    assert (response_cache_key("digest", "POST", "/completion", request) is not None) == cacheable
+    assert response_cache_key("digest", "GET", "/completion", request) is None
+
+
+def test_response_cache_key_canonicalizes_a_copy():
+    request = parse_json_request(b'{"temperature": 0.0, "seed": 1.0, "top_p": 1.0}')
+    key = response_cache_key("digest", "POST", "/completion", request)
+    assert key == response_cache_key("digest", "POST", "/completion", {"top_p": 1, "seed": 1, "temperature": 0})
+    # the values forwarded upstream are left as they were sent
+    assert request == {"temperature": 0.0, "seed": 1.0, "top_p": 1.0}
+    assert all(isinstance(value, float) for value in request.values())
+
+    # responses to one set of credentials aren't replayed to another one
+    with_token = response_cache_key("digest", "POST", "/completion", request, "Bearer a")
+    assert with_token not in (key, response_cache_key("digest", "POST", "/completion", request, "Bearer b"))
+
+
+def test_response_cache_spills_to_disk(tmp_path):
+    def response(i: int) -> CachedResponse:
+        return CachedResponse(200, "OK", [("Content-Type", "text/event-stream")], f"data: {i}\n\n".encode() * 20)
+
+    size = response(0).size
+    cache = ResponseCache(2 * size, str(tmp_path), 2 * len(response(0).serialize()))
+    for i in range(5):
+        cache.put(f"key{i}", response(i))
+
+    # two responses are in memory, the two evicted last are on disk and the first ones are dropped
+    assert len(cache) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["key1", "key2"]
+    assert cache.get("key0") is None
+    assert cache.get("key1").body == response(1).body
+    assert list(cache.get("key4").blocks()) == [b"data: 4\n\n"] * 20
+
+    # responses on disk are found again after a restart
+    assert ResponseCache(size, str(tmp_path), 10 * size).get("key2").body == response(2).body
+
+
+def test_prompt_prefix():
+    system = {"role": "system", "content": "You are a helpful assistant. " * 10}
+    chat = {"messages": [system, {"role": "user", "content": "What is 2 + 2?"}]}
+    other_chat = {"messages": [system, {"role": "user", "content": [{"type": "text", "text": "Hi"}]}]}
+    # chats sharing the system prompt share the prefix, whatever the user asks
+    assert prompt_prefix(chat) == prompt_prefix(other_chat)
+    assert prompt_prefix(chat).startswith("<system>You are")
+    assert prompt_prefix({"messages": [{"role": "user", "content": "Hi"}]}) == "<user>Hi"
+    assert prompt_prefix({"prompt": "x" * 100}, 10) == "x" * 10
+    assert prompt_prefix({"prompt": [1, 2, 3]}) == "[1, 2, 3]"
+    assert prompt_prefix({"input": "embed me"}) is None
+
+
+def test_routes_requests_sharing_a_prefix_to_the_same_replica(runner):
+    serve_path = serve_replicas(runner, "a", 3, 3)
+    affinities = [prefix_hash(f"system prompt {i}") for i in range(30)]
+    chosen = {affinity: runner.get_served_model(serve_path, affinity) for affinity in affinities}
+    assert len({m.replica for m in chosen.values()}) == 3
+    for affinity, model in chosen.items():
+        assert runner.get_served_model(serve_path, affinity) is model
+
+    # a saturated replica passes requests on to a less loaded one
+    affinity = affinities[0]
+    preferred = chosen[affinity]
+    with preferred.track_request():
+        assert runner.get_served_model(serve_path, affinity) is not preferred
+
+    # removing a replica only moves the prefixes it served
+    removed = runner.get_replicas(serve_path)[-1]
+    runner.stop_model(removed.id)
+    for affinity, model in chosen.items():
+        if model is not removed:
+            assert runner.get_served_model(serve_path, affinity) is model
+
+
+def test_slot_hints(runner):
+    m = managed_model("a", GiB)
+    request = {"prompt": "hi"}
+    with hinted_body(m, request, 5) as body:
+        assert body is None
+
+    m.slot_hints, m.slots = True, SlotTracker(4)
+    with hinted_body(m, request, 5) as body:
+        assert json.loads(body) == {"prompt": "hi", "cache_prompt": True, "id_slot": 1}
+        # another request with the same prefix isn't pinned to the busy slot
+        with hinted_body(m, {"prompt": "hi", "cache_prompt": False}, 5) as other:
+            assert json.loads(other) == {"prompt": "hi", "cache_prompt": False}
+    with hinted_body(m, request, 5) as body:
+        assert json.loads(body)["id_slot"] == 1
+    assert request == {"prompt": "hi"}
+
+
+def served_request(name: str) -> ServeRequest:
+    return ServeRequest(model_name=f"test/{name}", runtime="llama.cpp", exec_args={})
+
+
+@pytest.fixture
+def model_server():
+    process = subprocess.Popen(IDLE_CMD, start_new_session=True)
+    yield process
+    process.kill()
+    process.wait()
+
+
+def test_state_file_lists_running_models(runner, tmp_path):
+    runner.state_file = DaemonStateFile(str(tmp_path / STATE_FILE_NAME))
+    m = managed_model("a", GiB, port=8100)
+    m.serve_request = served_request("a")
+    runner.add_model(m)
+    runner.start_model(m.id, "/model/test/a")
+
+    (record,) = runner.state_file.load()
+    assert (record.id, record.serve_path, record.pid, record.port) == (m.id, "/model/test/a", m.process.pid, 8100)
+    assert record.run_cmd == IDLE_CMD
+    assert ServeRequest.from_string(json.dumps(record.serve_request)).model_name == "test/a"
+
+    runner.stop_model(m.id)
+    assert runner.state_file.load() == []
+
+
+def test_adopted_process(model_server):
+    assert process_matches(model_server.pid, IDLE_CMD)
+    assert not process_matches(model_server.pid, IDLE_CMD[:-1] + ["import time; time.sleep(30)"])
+
+    adopted = AdoptedProcess(model_server.pid)
+    assert adopted.poll() is None
+    with pytest.raises(TimeoutError):
+        adopted.wait(0.1)
+    adopted.terminate()
+    assert adopted.wait(5) == 0
+    assert not process_matches(model_server.pid, IDLE_CMD)
+
+
+def test_adopts_model_server_of_previous_daemon(runner, tmp_path, model_server, monkeypatch):
+    runner.state_file = DaemonStateFile(str(tmp_path / STATE_FILE_NAME))
+    model = SimpleNamespace(model_name="a", model_tag="latest", model_organization="test")
+    monkeypatch.setattr(DaemonAPIHandler, "_create_model", lambda self, name: model)
+
+    def create_managed_model(
+        self, serve_request: ServeRequest, port: int, replica: int = 0, generation: int = 0
+    ) -> ManagedModel:
+        m = ManagedModel(model, ["llama-server"], port, replica=replica, generation=generation)
+        m.serve_request = serve_request
+        return m
+
+    monkeypatch.setattr(DaemonAPIHandler, "_create_managed_model", create_managed_model)
+    handler = DaemonAPIHandler(runner, str(tmp_path))
+    record = ModelRecord("a", "/model/test/a", model_server.pid, 8100, 0, IDLE_CMD, served_request("a").to_dict())
+
+    assert not handler.adopt(ModelRecord(**{**asdict(record), "run_cmd": ["llama-server"]}))
+    assert handler.adopt(record)
+    adopted = runner.served_models["/model/test/a"]
+    assert adopted.state == ModelState.READY
+    assert (adopted.process.pid, adopted.port, adopted.run_cmd) == (model_server.pid, 8100, IDLE_CMD)
+    assert not runner.reserve_port(8100)
+    assert [r.pid for r in runner.state_file.load()] == [model_server.pid]
+    # serving the adopted model again returns it instead of starting another server
+    assert handler.serve(served_request("a")) is adopted
+
+    runner.detach_models()
+    assert runner.managed_models == {}
+    assert model_server.poll() is None
+
+
+@pytest.mark.parametrize("keep_models_on_exit", [False, True])
+def test_daemon_services_stop(runner, tmp_path, keep_models_on_exit):
+    config = DaemonConfig(keep_models_on_exit=keep_models_on_exit, embedding_batch_window_ms=5)
+    services = DaemonServices(runner, str(tmp_path), timedelta(seconds=10), config)
+    assert runner.embedding_batch_window == 0.005
+    assert runner.state_file is not None
+
+    m = serve(runner, "a", GiB)
+    process = m.process
+    services.start()
+    services.stop()
+    services.close()
+    assert runner.managed_models == {}
+    try:
+        assert (process.poll() is None) == keep_models_on_exit
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_split_embeddings():
+    assert embedding_inputs({"input": "a"}) == ["a"]
+    assert embedding_inputs({"input": [1, 2]}) == [[1, 2]]
+    assert embedding_inputs({"input": ["a", [1, 2]]}) == ["a", [1, 2]]
+    assert embedding_inputs({"input": [{"type": "image"}]}) is None
+    assert embedding_inputs({"input": []}) is None
+
+    data = [{"object": "embedding", "index": i, "embedding": [float(i)]} for i in reversed(range(3))]
+    response = {"object": "list", "data": data, "model": "m", "usage": {"prompt_tokens": 30, "total_tokens": 30}}
+    first, second = split_embeddings(response, [1, 2], [10, 20])
+    assert first["data"] == [{"object": "embedding", "index": 0, "embedding": [0.0]}]
+    assert [(item["index"], item["embedding"]) for item in second["data"]] == [(0, [1.0]), (1, [2.0])]
+    assert (first["usage"]["prompt_tokens"], second["usage"]["prompt_tokens"]) == (10, 20)
+    assert second["model"] == "m"
+    with pytest.raises(ValueError):
+        split_embeddings(response, [1, 1], [1, 1])
+
+
+def test_token_counts():
+    stream = (
+        b'data: {"usage": null}\n\ndata: {"usage": {"prompt_tokens": 7, "completion_tokens": 2}}\n\ndata: [DONE]\n\n'
+    )
+    assert token_counts(stream) == {"prompt_tokens": 7, "completion_tokens": 2}
+    assert token_counts(b'{"tokens_evaluated": 4, "tokens_predicted": 9, "stop": true}') == {
+        "prompt_tokens": 4,
+        "completion_tokens": 9,
+    }
+    assert token_counts(b'{"usage": {"prompt_tokens_details": {"cached_tokens": 1}}}') == {}
+
+
+def test_access_log_rotates_by_size(tmp_path):
+    path = str(tmp_path / "access.log")
+    access_log = AccessLog(path, max_bytes=1000, backups=2)
+    access_log.start()
+    for i in range(40):
+        assert access_log.log(AccessRecord(time.time(), "127.0.0.1", "GET", f"/model/test/{i}", "m", 200, 0, 0, 0, 0))
+    access_log.close()
+
+    files = [path, f"{path}.1", f"{path}.2"]
+    assert not os.path.exists(f"{path}.3")
+    lines = []
+    for name in reversed(files):
+        assert os.path.getsize(name) <= 1000
+        with open(name) as f:
+            lines.extend(json.loads(line)["path"] for line in f)
+    # the oldest entries were rotated out, the remaining ones are in order
+    assert lines == [f"/model/test/{i}" for i in range(40 - len(lines), 40)]
+
+    # records are dropped instead of waiting for the writer
+    stalled = AccessLog(path, max_bytes=1000, backups=0, queue_size=1)
+    record = AccessRecord(time.time(), "", "GET", "/", "m", 200, 0, 0, 0, 0)
+    assert stalled.log(record)
+    assert not stalled.log(record)
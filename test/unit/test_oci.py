@@ -3,6 +3,7 @@ from typing import Optional, Union
 
 import pytest
 
+import ramalama.transports.oci.oci as oci_module
 from ramalama.model_store.reffile import RefJSONFile, StoreFile, StoreFileType
 from ramalama.model_store.store import ModelStore
 from ramalama.transports.huggingface import Huggingface
@@ -21,6 +22,7 @@ class Args:
         self.type = type
         self.carimage = carimage
         self.gguf = gguf
+        self.dryrun = False
 
 
 class Input:
@@ -157,3 +159,15 @@ def test__generate_containerfile(input: Input, expected_file_path: Path, monkeyp
     file = oci._generate_containerfile(input.source_model, input.args)
     with open(expected_file_path, "r") as expected_file:
         assert file == expected_file.read().strip()
+
+
+def test_convert_rejects_split_max_size_before_removing_image(monkeypatch):
+    oci = OCI("custom-container", STORE_PATH, "podman")
+    commands = []
+    monkeypatch.setattr(oci_module, "run_cmd", lambda cmd, **kwargs: commands.append(cmd))
+
+    args = Args(type="raw")
+    args.split_max_size = 1024
+    with pytest.raises(ValueError):
+        oci.convert(Ollama("tinyllama/tinyllama", STORE_PATH), args)
+    assert commands == []
@@ -0,0 +1,99 @@
+"""
+Unit tests for prewarming model weights into the page cache
+"""
+
+import sys
+from argparse import Namespace
+
+import pytest
+
+import ramalama.engine
+import ramalama.prewarm
+from ramalama.prewarm import ModelPrewarmer, _split_ranges, _warm_chunk, page_cache_residency, weight_ranges
+
+
+def test_split_ranges():
+    assert _split_ranges([(0, 10), (20, 25)], 4) == [(0, 4), (4, 8), (8, 10), (20, 24), (24, 25)]
+
+
+def test_weight_ranges_non_gguf(tmp_path):
+    model_path = tmp_path / "model.bin"
+    model_path.write_bytes(b"\1" * 100)
+    assert weight_ranges(str(model_path)) == [(0, 100)]
+
+
+def test_prewarmer_expands_directories(tmp_path):
+    (tmp_path / "model-00001-of-00002.safetensors").write_bytes(b"\1" * 10)
+    (tmp_path / "model-00002-of-00002.safetensors").write_bytes(b"\1" * 10)
+    (tmp_path / "config.json").write_text("{}")
+
+    prewarmer = ModelPrewarmer([str(tmp_path), str(tmp_path / "missing.gguf")])
+    assert prewarmer.model_paths == [
+        str(tmp_path / "model-00001-of-00002.safetensors"),
+        str(tmp_path / "model-00002-of-00002.safetensors"),
+    ]
+
+
+def test_prewarmer_run(tmp_path):
+    model_path = tmp_path / "model.bin"
+    model_path.write_bytes(b"\1" * (3 * 4096 + 10))
+
+    prewarmer = ModelPrewarmer([str(model_path)], chunk_size=4096).start()
+    assert prewarmer.wait(10)
+    assert prewarmer.done
+    assert prewarmer.error is None
+    if sys.platform.startswith("linux"):
+        assert prewarmer.residency is not None
+        assert 0.0 <= prewarmer.residency <= 1.0
+
+
+def test_warm_chunk_reads_the_range(tmp_path, monkeypatch):
+    model_path = tmp_path / "model.bin"
+    model_path.write_bytes(b"\1" * (3 * 1024 * 1024))
+    read = []
+
+    class CountingFile:
+        def __init__(self, path, mode):
+            self._file = open(path, mode)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self._file.close()
+
+        def __getattr__(self, name):
+            return getattr(self._file, name)
+
+        def readinto(self, buffer):
+            n = self._file.readinto(buffer)
+            read.append(n)
+            return n
+
+    monkeypatch.setattr(ramalama.prewarm, "open", CountingFile, raising=False)
+    # the range is read, not only scheduled for readahead, so the prewarm only ends once it is cached
+    _warm_chunk(str(model_path), 100, 2 * 1024 * 1024 + 100)
+    assert sum(read) == 2 * 1024 * 1024
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="mincore is only used on Linux")
+def test_page_cache_residency_empty_files(tmp_path):
+    model_path = tmp_path / "empty.bin"
+    model_path.write_bytes(b"")
+    assert page_cache_residency([str(model_path)]) is None
+
+
+class FakePrewarmer:
+    def __init__(self, done: bool):
+        self._done = done
+        self.residency = 1.0
+
+    def wait(self, timeout=None):
+        return self._done
+
+
+@pytest.mark.parametrize("done, expected", [(True, True), (False, False)])
+def test_wait_for_prewarm(done, expected):
+    args = Namespace(prewarmer=FakePrewarmer(done))
+    assert ramalama.engine._wait_for_prewarm(args, 0) is expected
+    assert ramalama.engine._wait_for_prewarm(Namespace(), 0) is True
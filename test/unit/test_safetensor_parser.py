@@ -0,0 +1,74 @@
+"""
+Unit tests for the SafetensorInfoParser
+"""
+
+import json
+import struct
+
+import pytest
+
+from ramalama.model_inspect.error import ParseError
+from ramalama.model_inspect.safetensor_parser import SafetensorInfoParser
+
+
+def write_safetensor(path, header: dict) -> str:
+    raw = json.dumps(header).encode("utf-8")
+    path.write_bytes(struct.pack("<Q", len(raw)) + raw)
+    return str(path)
+
+
+def write_sharded_model(tmp_path) -> str:
+    shards = {
+        "model-00001-of-00002.safetensors": {
+            "__metadata__": {"format": "pt"},
+            "embed.weight": {"dtype": "BF16", "shape": [10, 4], "data_offsets": [0, 80]},
+            "layer.0.weight": {"dtype": "BF16", "shape": [4, 4], "data_offsets": [80, 112]},
+        },
+        "model-00002-of-00002.safetensors": {
+            "layer.1.weight": {"dtype": "F32", "shape": [4, 4], "data_offsets": [0, 64]},
+            "norm.weight": {"dtype": "F32", "shape": [4], "data_offsets": [64, 80]},
+        },
+    }
+    weight_map = {}
+    for name, header in shards.items():
+        write_safetensor(tmp_path / name, header)
+        weight_map.update({tensor: name for tensor in header if tensor != "__metadata__"})
+
+    index_path = tmp_path / "model.safetensors.index.json"
+    index_path.write_text(json.dumps({"metadata": {"total_size": 272}, "weight_map": weight_map}))
+    return str(index_path)
+
+
+def test_parse_sharded(tmp_path):
+    index_path = write_sharded_model(tmp_path)
+    info = SafetensorInfoParser.parse_sharded("model.safetensors", "huggingface", index_path)
+
+    assert info.Shards == ["model-00001-of-00002.safetensors", "model-00002-of-00002.safetensors"]
+    assert info.Parameters == 40 + 16 + 16 + 4
+    assert info.Dtypes == {
+        "BF16": {"tensors": 2, "parameters": 56},
+        "F32": {"tensors": 2, "parameters": 20},
+    }
+    assert info.Header["__metadata__"] == {"format": "pt", "total_size": 272}
+    assert info.Header["norm.weight"]["shard"] == "model-00002-of-00002.safetensors"
+
+    assert "Shards: 2" in info.serialize()
+    assert json.loads(info.serialize(json=True))["Parameters"] == 76
+
+
+def test_parse_sharded_missing_tensor(tmp_path):
+    index_path = write_sharded_model(tmp_path)
+    index = json.loads(open(index_path).read())
+    index["weight_map"]["lm_head.weight"] = "model-00002-of-00002.safetensors"
+    open(index_path, "w").write(json.dumps(index))
+
+    with pytest.raises(ParseError):
+        SafetensorInfoParser.parse_sharded("model.safetensors", "huggingface", index_path)
+
+
+def test_parse_sharded_missing_shard(tmp_path):
+    index_path = write_sharded_model(tmp_path)
+    (tmp_path / "model-00002-of-00002.safetensors").unlink()
+
+    with pytest.raises(ParseError):
+        SafetensorInfoParser.parse_sharded("model.safetensors", "huggingface", index_path)